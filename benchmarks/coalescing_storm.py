@@ -0,0 +1,66 @@
+"""
+Simulates a refresh storm of concurrent Fiscalismia_RawDataETL invocations against the local stand-ins.
+
+Every caller runs download and extraction of the synthetic sheet, once directly and once via
+coalescing.coalesce. Reports the requests reaching the HTTP stub and the s3 stand-in per mode.
+
+Usage:
+  python coalescing_storm.py --callers 20 --rows 10000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_lambda_powertools import Logger
+from synthetic_sheet import FUNCTION_DIR, generate_sheet, to_csv_bytes
+from local_stubs import LocalHttpStub, LocalS3
+
+sys.path.insert(0, FUNCTION_DIR)
+# coalescing is opt-in, see etl_config.COALESCE_WINDOW_SECONDS
+os.environ.setdefault("ETL_COALESCE_WINDOW_SECONDS", "30")
+from coalescing import coalesce
+from download_csv import download_csv
+from extract_transform import extract_and_transform_to_tsv
+from instrumentation import Profiler
+
+S3_BUCKET = "fiscalismia-benchmark"
+logger = Logger(service="Fiscalismia_RawDataETL_Benchmark", level="WARNING")
+
+def _invoke(caller: int, stub: LocalHttpStub, s3_client: LocalS3, coalesced: bool) -> dict:
+  run_id = f"storm-{caller}"
+  profiler = Profiler("Fiscalismia_RawDataETL_Benchmark")
+
+  def run() -> dict:
+    sheet, _ = download_csv(run_id, stub.url, S3_BUCKET, profiler, s3_client, logger)
+    etl_result = extract_and_transform_to_tsv(run_id, sheet, S3_BUCKET, profiler, s3_client, logger)
+    return {"statusCode": 202, "body": json.dumps({"presigned_urls": list(etl_result["presigned_urls"])})}
+
+  if coalesced:
+    return coalesce(run_id, S3_BUCKET, s3_client, profiler, logger, run)
+  return run()
+
+def run_storm(callers: int, rows: int, s3_latency: float, coalesced: bool) -> dict:
+  s3_client = LocalS3(request_latency=s3_latency)
+  with LocalHttpStub(to_csv_bytes(generate_sheet(rows))) as stub:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+      responses = list(executor.map(lambda caller: _invoke(caller, stub, s3_client, coalesced), range(callers)))
+    duration = time.perf_counter() - start
+  return {
+    "duration_s": round(duration, 3),
+    "distinct_responses": len({response["body"] for response in responses}),
+    "http_requests": stub.request_count,
+    "s3_requests": dict(sorted(s3_client.request_counts.items())),
+  }
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Concurrent invocations of Fiscalismia_RawDataETL with and without coalescing")
+  parser.add_argument("--callers", type=int, default=20)
+  parser.add_argument("--rows", type=int, default=10_000)
+  parser.add_argument("--s3-latency", type=float, default=0.02, help="simulated s3 round trip time in seconds")
+  args = parser.parse_args()
+  for coalesced in (False, True):
+    result = run_storm(args.callers, args.rows, args.s3_latency, coalesced)
+    print(f"{'coalesced' if coalesced else 'independent'}: {json.dumps(result)}")
@@ -0,0 +1,78 @@
+"""
+Reports the import cost of Fiscalismia_RawDataETL at cold start, based on python -X importtime.
+
+Each scenario imports the given modules in a fresh interpreter:
+- handler: index.py only, which is what every cold start pays during init
+- etl: additionally the modules deferred until a changed spreadsheet is processed
+
+Usage:
+  python import_profile.py --top 25
+"""
+import argparse
+import os
+import subprocess
+import sys
+from synthetic_sheet import FUNCTION_DIR
+
+# modules shared by all functions, added to every archive by create_function_archives.sh
+SHARED_DIR = os.path.join(os.path.dirname(FUNCTION_DIR), "_shared")
+
+SCENARIOS = {
+  "handler": ["index"],
+  "etl": ["index", "download_csv", "extract_transform"],
+}
+
+def profile_imports(module_names: list[str]) -> list[dict]:
+  """
+  Returns self and cumulative import time in microseconds per module, in import order.
+  """
+  statement = "; ".join(f"import {module_name}" for module_name in module_names)
+  completed = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", statement],
+    cwd=FUNCTION_DIR,
+    env={**os.environ, "PYTHONPATH": SHARED_DIR},
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  entries = []
+  for line in completed.stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+    entries.append({
+      "module": name.strip(),
+      "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+      "self_us": int(self_us),
+      "cumulative_us": int(cumulative_us),
+    })
+  return entries
+
+def summarize_packages(entries: list[dict]) -> dict[str, int]:
+  """
+  Sums the self time of all modules per top level package.
+  """
+  packages = {}
+  for entry in entries:
+    package = entry["module"].split(".")[0]
+    packages[package] = packages.get(package, 0) + entry["self_us"]
+  return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Import time report of Fiscalismia_RawDataETL")
+  parser.add_argument("--scenario", choices=list(SCENARIOS), nargs="+", default=list(SCENARIOS))
+  parser.add_argument("--top", type=int, default=20, help="number of packages and modules listed")
+  args = parser.parse_args()
+  for scenario in args.scenario:
+    entries = profile_imports(SCENARIOS[scenario])
+    total_us = sum(entry["self_us"] for entry in entries)
+    print(f"\n== {scenario}: import {', '.join(SCENARIOS[scenario])} -> {total_us / 1000:.1f}ms total")
+    print(f"{'package':<40} {'self ms':>10}")
+    for package, self_us in list(summarize_packages(entries).items())[:args.top]:
+      print(f"{package:<40} {self_us / 1000:>10.1f}")
+    # modules imported directly by the function code, with everything they pull in
+    function_modules = {file_name[:-3] for file_name in os.listdir(FUNCTION_DIR) if file_name.endswith(".py")}
+    print(f"\n{'function module':<40} {'cumulative ms':>14}")
+    for entry in entries:
+      if entry["module"] in function_modules:
+        print(f"{entry['module']:<40} {entry['cumulative_us'] / 1000:>14.1f}")
@@ -0,0 +1,197 @@
+"""
+Local stand-ins for the Google Sheets export and the s3 bucket used by Fiscalismia_RawDataETL,
+and for the Telegram bot API used by Infrastructure_NotificationMessageSender.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qsl
+from botocore.exceptions import ClientError
+
+class LocalHttpStub:
+  """
+  Serves an in-memory payload over HTTP on localhost, standing in for the Google Sheets export.
+  The payload can be replaced between requests via the payload attribute.
+  """
+  def __init__(self, payload: bytes = b"", content_type: str = "text/csv"):
+    self.payload = payload
+    self.content_type = content_type
+    self.request_count = 0
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def do_GET(self):
+        stub.request_count += 1
+        payload = stub.payload
+        self.send_response(200)
+        self.send_header("Content-Type", stub.content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+      def log_message(self, *args):
+        pass
+
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self._server.server_port}/spreadsheets/d/synthetic/export"
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._server.shutdown()
+    self._server.server_close()
+
+class LocalTelegramApi:
+  """
+  Answers sendMessage requests of python-telegram-bot on localhost, standing in for the Telegram bot API.
+  - Every request is recorded in calls as (time.monotonic(), method, parameters)
+  - Messages containing a text of failing_texts are rejected with 400, like messages to an unknown chat
+  - flood_waits maps text prefixes to the number of times they are answered with a 429 flood wait
+  - response_delay simulates the round trip time of every request in seconds
+  """
+  def __init__(self, failing_texts: set[str] | None = None, flood_waits: dict[str, int] | None = None, response_delay: float = 0.0):
+    self.failing_texts = set(failing_texts or ())
+    self.flood_waits = dict(flood_waits or {})
+    self.response_delay = response_delay
+    self.calls: list[tuple[float, str, dict]] = []
+    self._lock = threading.Lock()
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # python-telegram-bot sends the parameters form encoded
+        parameters = dict(parse_qsl(body.decode("utf-8")))
+        method = self.path.rsplit("/", 1)[-1]
+        status, response = stub._answer(method, parameters)
+        if stub.response_delay:
+          time.sleep(stub.response_delay)
+        payload = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+      def log_message(self, *args):
+        pass
+
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+  def _answer(self, method: str, parameters: dict) -> tuple[int, dict]:
+    text = str(parameters.get("text", ""))
+    with self._lock:
+      self.calls.append((time.monotonic(), method, parameters))
+      message_id = len(self.calls)
+      if any(failing_text in text for failing_text in self.failing_texts):
+        return 400, {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"}
+      prefix = next((prefix for prefix, count in self.flood_waits.items() if count > 0 and text.startswith(prefix)), None)
+      if prefix is not None:
+        self.flood_waits[prefix] -= 1
+        return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}}
+    chat = {"id": int(parameters.get("chat_id", 0)), "type": "private"}
+    return 200, {"ok": True, "result": {"message_id": message_id, "date": int(time.time()), "chat": chat, "text": text}}
+
+  @property
+  def base_url(self) -> str:
+    return f"http://127.0.0.1:{self._server.server_port}/bot"
+
+  def sent_messages(self) -> list[tuple[float, dict]]:
+    return [(sent_at, parameters) for sent_at, method, parameters in self.calls if method == "sendMessage"]
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._server.shutdown()
+    self._server.server_close()
+
+def _client_error(code: str, operation: str, status: int) -> ClientError:
+  return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+class LocalS3:
+  """
+  In-memory stand-in for the subset of the boto3 s3 client used by Fiscalismia_RawDataETL.
+  - request_latency simulates the round trip time of every request in seconds
+  - Supports conditional writes via IfNoneMatch="*" and IfMatch=<ETag> like s3
+  """
+  def __init__(self, request_latency: float = 0.0):
+    self.request_latency = request_latency
+    self.objects: dict[tuple[str, str], dict] = {}
+    self.request_counts: dict[str, int] = {}
+    self._lock = threading.Lock()
+
+  def _request(self, operation: str):
+    with self._lock:
+      self.request_counts[operation] = self.request_counts.get(operation, 0) + 1
+    if self.request_latency:
+      time.sleep(self.request_latency)
+
+  def _get(self, bucket: str, key: str, operation: str) -> dict:
+    stored = self.objects.get((bucket, key), None)
+    if stored is None:
+      raise _client_error("NoSuchKey" if operation == "GetObject" else "404", operation, 404)
+    return stored
+
+  def put_object(self, Bucket: str, Key: str, Body=b"", IfNoneMatch: str | None = None, IfMatch: str | None = None, **kwargs) -> dict:
+    self._request("PutObject")
+    body = Body.read() if hasattr(Body, "read") else bytes(Body)
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    with self._lock:
+      existing = self.objects.get((Bucket, Key), None)
+      if IfNoneMatch == "*" and existing is not None:
+        raise _client_error("PreconditionFailed", "PutObject", 412)
+      if IfMatch is not None and (existing is None or existing["ETag"] != IfMatch):
+        raise _client_error("PreconditionFailed", "PutObject", 412)
+      self.objects[(Bucket, Key)] = {"Body": body, "ETag": etag, "LastModified": time.time(), **kwargs}
+    return {"ETag": etag}
+
+  def upload_fileobj(self, Fileobj, Bucket: str, Key: str, ExtraArgs: dict | None = None, Callback=None, Config=None):
+    self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), **(ExtraArgs or {}))
+
+  def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+    self._request("GetObject")
+    stored = self._get(Bucket, Key, "GetObject")
+    return {**stored, "Body": BytesIO(stored["Body"]), "ContentLength": len(stored["Body"])}
+
+  def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+    self._request("HeadObject")
+    stored = self._get(Bucket, Key, "HeadObject")
+    return {key: value for key, value in stored.items() if key != "Body"} | {"ContentLength": len(stored["Body"])}
+
+  def delete_object(self, Bucket: str, Key: str, IfMatch: str | None = None, **kwargs) -> dict:
+    self._request("DeleteObject")
+    with self._lock:
+      existing = self.objects.get((Bucket, Key), None)
+      if IfMatch is not None and (existing is None or existing["ETag"] != IfMatch):
+        raise _client_error("PreconditionFailed", "DeleteObject", 412)
+      self.objects.pop((Bucket, Key), None)
+    return {}
+
+  def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs) -> dict:
+    self._request("ListObjectsV2")
+    contents = [
+      {"Key": key, "Size": len(stored["Body"]), "ETag": stored["ETag"]}
+      for (bucket, key), stored in sorted(self.objects.items())
+      if bucket == Bucket and key.startswith(Prefix)
+    ]
+    return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+  def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600) -> str:
+    # presigning is a local computation in boto3 and does not count as request
+    return f"https://{Params['Bucket']}.s3.localhost/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
@@ -0,0 +1,151 @@
+"""
+Benchmarks the stages of Fiscalismia_RawDataETL against synthetic Finance sheets.
+
+- download_csv / download_xlsx: download and parsing, served from a local HTTP stub
+- load_tables_from_sheet: extraction and typing of all tables from the parsed sheet
+- load_tables_from_csv_chunks: parsing, extraction and typing of the csv export in chunks of CSV_CHUNK_ROWS rows
+- extract_and_transform_to_tsv: extraction, serialization and upload to a local s3 stand-in
+
+Results are written to benchmarks/results/<commit>.json and compared against the
+previous results file, flagging every stage that became slower than REGRESSION_THRESHOLD.
+
+Usage:
+  python run_benchmarks.py --rows 1000 10000 100000 --repeat 5
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from aws_lambda_powertools import Logger
+from synthetic_sheet import FUNCTION_DIR, generate_sheet, to_csv_bytes, to_xlsx_bytes
+from local_stubs import LocalHttpStub, LocalS3
+
+sys.path.insert(0, FUNCTION_DIR)
+from download_csv import download_csv, iter_csv_chunks
+from download_xlsx import download_xlsx
+from extract_transform import load_tables_from_sheet, extract_and_transform_to_tsv
+from instrumentation import Profiler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Relative slowdown of a stage's median against the previous results that is reported as regression
+REGRESSION_THRESHOLD = 0.10
+S3_BUCKET = "fiscalismia-benchmark"
+# Rows per chunk of the chunked csv extraction, see etl_config.CSV_CHUNK_ROWS
+CSV_CHUNK_ROWS = 10000
+logger = Logger(service="Fiscalismia_RawDataETL_Benchmark", level="WARNING")
+
+def _measure(function, repeat: int) -> dict:
+  durations = []
+  for _ in range(repeat):
+    start = time.perf_counter_ns()
+    function()
+    durations.append(time.perf_counter_ns() - start)
+  return {
+    "median_ms": round(statistics.median(durations) / 1_000_000, 3),
+    "min_ms": round(min(durations) / 1_000_000, 3),
+  }
+
+def _profiler() -> Profiler:
+  # spans are discarded, the benchmark times whole stages
+  return Profiler("Fiscalismia_RawDataETL_Benchmark")
+
+def _download(download_function, stub: LocalHttpStub, s3_client: LocalS3):
+  sheet, _ = download_function("benchmark", stub.url, S3_BUCKET, _profiler(), s3_client, logger)
+  return sheet
+
+def run_benchmarks(row_counts: list[int], repeat: int, s3_latency: float) -> dict:
+  results = {}
+  for row_count in row_counts:
+    sheet = generate_sheet(row_count)
+    payloads = {"csv": to_csv_bytes(sheet), "xlsx": to_xlsx_bytes(sheet)}
+    s3_client = LocalS3(request_latency=s3_latency)
+    stages = {}
+    with LocalHttpStub() as stub:
+      for export_type, download_function in (("csv", download_csv), ("xlsx", download_xlsx)):
+        stub.payload = payloads[export_type]
+        stages[f"download_{export_type}"] = _measure(lambda: _download(download_function, stub, s3_client), repeat)
+        stages[f"download_{export_type}"]["bytes"] = len(payloads[export_type])
+      stub.payload = payloads["csv"]
+      parsed_sheet = _download(download_csv, stub, s3_client)
+    stages["load_tables_from_sheet"] = _measure(lambda: load_tables_from_sheet(parsed_sheet, logger, {}), repeat)
+    csv_view = memoryview(payloads["csv"])
+    stages["load_tables_from_csv_chunks"] = _measure(
+      lambda: load_tables_from_sheet(iter_csv_chunks(csv_view, CSV_CHUNK_ROWS), logger, {}),
+      repeat,
+    )
+    stages["extract_and_transform_to_tsv"] = _measure(
+      lambda: extract_and_transform_to_tsv("benchmark", parsed_sheet, S3_BUCKET, _profiler(), s3_client, logger),
+      repeat,
+    )
+    results[str(row_count)] = stages
+    print(f"{row_count} rows: " + ", ".join(f"{stage} {values['median_ms']}ms" for stage, values in stages.items()))
+  return results
+
+def _current_commit() -> str:
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown"
+
+def _previous_results(exclude_path: str) -> dict | None:
+  paths = [path for path in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if path != exclude_path]
+  if not paths:
+    return None
+  with open(max(paths, key=os.path.getmtime)) as file:
+    return json.load(file)
+
+def find_regressions(previous: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+  """
+  Compares the medians of every stage and row count present in both results.
+  """
+  regressions = []
+  for row_count, stages in current["results"].items():
+    for stage, values in stages.items():
+      previous_values = previous["results"].get(row_count, {}).get(stage, None)
+      if not previous_values or not previous_values["median_ms"]:
+        continue
+      change = values["median_ms"] / previous_values["median_ms"] - 1
+      if change > threshold:
+        regressions.append(
+          f"{stage} @ {row_count} rows: {previous_values['median_ms']}ms -> {values['median_ms']}ms (+{change:.0%}) "
+          f"since {previous['commit']}"
+        )
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark Fiscalismia_RawDataETL against synthetic Finance sheets")
+  parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--s3-latency", type=float, default=0.02, help="simulated s3 round trip time in seconds")
+  parser.add_argument("--no-save", action="store_true", help="only compare, do not write a results file")
+  args = parser.parse_args()
+
+  commit = _current_commit()
+  current = {
+    "commit": commit,
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "repeat": args.repeat,
+    "s3_latency": args.s3_latency,
+    "results": run_benchmarks(args.rows, args.repeat, args.s3_latency),
+  }
+  results_path = os.path.join(RESULTS_DIR, f"{commit}.json")
+  previous = _previous_results(results_path)
+  if previous:
+    regressions = find_regressions(previous, current)
+    for regression in regressions:
+      print(f"REGRESSION {regression}")
+    if not regressions:
+      print(f"No regressions above {REGRESSION_THRESHOLD:.0%} since {previous['commit']}")
+  if not args.no_save:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(results_path, "w") as file:
+      json.dump(current, file, indent=2)
+    print(f"Results written to {results_path}")
@@ -0,0 +1,184 @@
+"""
+Generates synthetic Finance sheets laid out exactly as ddl_schema.py expects.
+
+- Rows 0-3 hold the filler row, table name and date range annotations and the column headers
+- Trivial tables contain repeated header rows and border rows matching their skip markers
+- Multi-section tables are split into sections opened by "Date: DD.MM.YYYY - DD.MM.YYYY" rows
+- Scratch columns between and after the tables are filled with noise, as in the real sheet
+
+Usage:
+  python synthetic_sheet.py --rows 10000 --out-dir ./sheets
+"""
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "python", "Fiscalismia_RawDataETL")
+sys.path.insert(0, FUNCTION_DIR)
+from column_types import DECIMAL, DATE, BOOLEAN, CATEGORY
+from ddl_schema import HEADER_ROW, DATA_START_ROW, TABLES, SHEET_USECOLS
+
+# Additional unused columns right of the last table
+SCRATCH_COL_COUNT = 12
+# A border row and a repeated header row are inserted into trivial tables at these intervals
+BORDER_INTERVAL = 250
+HEADER_REPEAT_INTERVAL = 1000
+# Rows per "Date:" section of multi-section tables, including Date, header and SUM rows
+SECTION_ROW_COUNT = 40
+# Share of rows filled per table. Tables in the real sheet have different lengths
+TABLE_FILL_RATIO = {
+  "variable_expenses": 1.0,
+  "investments": 0.3,
+  "food_items": 0.25,
+  "fixed_costs": 1.0,
+  "income": 1.0,
+}
+CATEGORY_POOLS = {
+  "category": ["Groceries", "Leisure", "Travel", "Health", "Rent", "Insurance", "Internet", "Mobility"],
+  "store": ["Rewe", "Aldi", "Lidl", "Edeka", "dm", "Amazon", "Kaufland"],
+  "investment_type": ["etf", "stock", "bond"],
+  "main_macro": ["Protein", "Carbs", "Fat"],
+}
+STRING_POOLS = {
+  "execution_type": ["buy", "buy", "buy", "sell"],
+  "isin": ["DE000A0H0744", "IE00B4L5Y983", "US0378331005", "IE00B3RBWM25", "LU0274208692"],
+  "marketplace": ["XETRA", "Tradegate", "NYSE"],
+  "type": ["net salary", "bonus", "interest"],
+}
+
+def _decimal_strings(rng: np.random.Generator, size: int, low: int, high: int) -> np.ndarray:
+  cents = rng.integers(low * 100, high * 100, size=size)
+  euros = (cents // 100).astype(str)
+  fraction = pd.Series(cents % 100).astype(str).str.zfill(2).to_numpy()
+  return (pd.Series(euros) + "," + fraction).to_numpy(dtype=object)
+
+def _percent_strings(rng: np.random.Generator, size: int) -> np.ndarray:
+  thousandths = rng.integers(0, 100_000, size=size)
+  fraction = pd.Series(thousandths % 1000).astype(str).str.zfill(3).to_numpy()
+  return (pd.Series((thousandths // 1000).astype(str)) + "," + fraction + "%").to_numpy(dtype=object)
+
+def _date_strings(rng: np.random.Generator, size: int) -> np.ndarray:
+  days = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 365 * 11, size=size), unit="D")
+  return pd.Series(days).dt.strftime("%d.%m.%Y").to_numpy(dtype=object)
+
+def _column_values(col_name: str, col_type: str | None, size: int, rng: np.random.Generator) -> np.ndarray:
+  if col_type == DECIMAL and col_name.startswith("pct_"):
+    return _percent_strings(rng, size)
+  if col_type == DECIMAL:
+    return _decimal_strings(rng, size, 0, 2000)
+  if col_type == DATE:
+    return _date_strings(rng, size)
+  if col_type == BOOLEAN:
+    return rng.choice(np.array(["TRUE", "FALSE"], dtype=object), size=size)
+  if col_type == CATEGORY:
+    return rng.choice(np.array(CATEGORY_POOLS.get(col_name, ["a", "b", "c"]), dtype=object), size=size)
+  if col_name in STRING_POOLS:
+    return rng.choice(np.array(STRING_POOLS[col_name], dtype=object), size=size)
+  return (f"{col_name} " + pd.Series(rng.integers(0, size * 10, size=size)).astype(str)).to_numpy(dtype=object)
+
+def _fill_trivial_table(sheet: np.ndarray, table_name: str, table_def: dict, row_count: int, rng: np.random.Generator):
+  start = table_def["col_slice"].start
+  if table_def["col_names"][0] not in table_def["skip_markers"]:
+    raise ValueError(f"Header of {table_name} is not one of its skip markers")
+  filled = rng.random(row_count) < TABLE_FILL_RATIO[table_name]
+  for offset, col_name in enumerate(table_def["col_names"]):
+    values = _column_values(col_name, table_def.get("col_types", {}).get(col_name), row_count, rng)
+    sheet[DATA_START_ROW:, start + offset] = np.where(filled, values, "")
+  for row in range(DATA_START_ROW + HEADER_REPEAT_INTERVAL - 1, sheet.shape[0], HEADER_REPEAT_INTERVAL):
+    sheet[row, start:start + len(table_def["col_names"])] = table_def["col_names"]
+  for row in range(DATA_START_ROW + BORDER_INTERVAL - 1, sheet.shape[0], BORDER_INTERVAL):
+    sheet[row, start:table_def["col_slice"].stop] = ""
+    sheet[row, start] = "border"
+
+def _fill_multisection_table(sheet: np.ndarray, table_name: str, table_def: dict, row_count: int, rng: np.random.Generator):
+  start = table_def["col_slice"].start
+  stop = table_def["col_slice"].stop
+  for offset, col_name in enumerate(table_def["col_names"]):
+    col_type = table_def.get("col_types", {}).get(col_name)
+    sheet[DATA_START_ROW:, start + offset] = _column_values(col_name, col_type, row_count, rng)
+  for section, row in enumerate(range(DATA_START_ROW, sheet.shape[0], SECTION_ROW_COUNT)):
+    # sections cycle through 25 consecutive years to stay within valid dates on large sheets
+    year = 2000 + section % 25
+    sheet[row, start:stop] = ""
+    sheet[row, start] = table_def["date_marker"]
+    sheet[row, start + table_def["date_value_col_offset"]] = f"01.01.{year} - 31.12.{year}"
+    if row + 1 < sheet.shape[0]:
+      sheet[row + 1, start:start + len(table_def["col_names"])] = table_def["col_names"]
+    section_end = min(row + SECTION_ROW_COUNT, sheet.shape[0]) - 1
+    if section_end > row + 1:
+      sheet[section_end, start:stop] = ""
+      sheet[section_end, start] = "SUM" if "SUM" in table_def["skip_markers"] else "border"
+
+def generate_sheet(row_count: int, seed: int = 0, blank_leading: bool = False, scratch_col_count: int = SCRATCH_COL_COUNT) -> pd.DataFrame:
+  """
+  Returns a sheet of row_count data rows below the annotation and header rows as DataFrame of strings.
+  With blank_leading, column A stays empty like the filler row, so the used range of the sheet starts at B2.
+  """
+  rng = np.random.default_rng(seed)
+  width = max(SHEET_USECOLS) + 1 + scratch_col_count
+  sheet = np.full((DATA_START_ROW + row_count, width), "", dtype=object)
+  # scratch columns hold noise, which column pruning should never materialize
+  scratch_cols = [col for col in range(1 if blank_leading else 0, width) if col not in SHEET_USECOLS]
+  sheet[DATA_START_ROW:, scratch_cols] = _decimal_strings(rng, row_count, 0, 100)[:, None]
+
+  for table_name, table_def in TABLES.items():
+    start = table_def["col_slice"].start
+    sheet[1, start] = table_name
+    sheet[2, start] = "01.01.2015 - 31.12.2025"
+    sheet[HEADER_ROW, start:start + len(table_def["col_names"])] = table_def["col_names"]
+    if "date_marker" in table_def:
+      _fill_multisection_table(sheet, table_name, table_def, row_count, rng)
+    else:
+      _fill_trivial_table(sheet, table_name, table_def, row_count, rng)
+  return pd.DataFrame(sheet)
+
+def to_csv_bytes(sheet: pd.DataFrame) -> bytes:
+  return sheet.to_csv(header=False, index=False).encode("utf-8")
+
+def to_xlsx_bytes(sheet: pd.DataFrame) -> bytes:
+  """
+  Writes the sheet as [Finances] worksheet next to an unrelated worksheet, as in the real workbook.
+  Percentages such as "26,375%" become percent formatted number cells holding their fraction, as Google Sheets exports them.
+  Requires openpyxl, see benchmarks/requirements.txt.
+  """
+  from io import BytesIO
+  from openpyxl import Workbook
+  from openpyxl.cell import WriteOnlyCell
+  workbook = Workbook(write_only=True)
+  workbook.create_sheet("Overview").append(["unrelated worksheet"])
+  worksheet = workbook.create_sheet("Finances")
+
+  def to_cell(value):
+    # empty cells are omitted by Google Sheets exports instead of being written as empty strings
+    if value == "":
+      return None
+    if not value.endswith("%"):
+      return value
+    cell = WriteOnlyCell(worksheet, value=float(value[:-1].replace(",", ".") + "e-2"))
+    cell.number_format = "0.000%"
+    return cell
+
+  for row in sheet.itertuples(index=False, name=None):
+    worksheet.append([to_cell(value) for value in row])
+  buffer = BytesIO()
+  workbook.save(buffer)
+  return buffer.getvalue()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Generate synthetic Finance sheets as CSV and XLSX")
+  parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--formats", nargs="+", choices=["csv", "xlsx"], default=["csv", "xlsx"])
+  parser.add_argument("--out-dir", default="sheets")
+  args = parser.parse_args()
+  os.makedirs(args.out_dir, exist_ok=True)
+  for row_count in args.rows:
+    sheet = generate_sheet(row_count, args.seed)
+    for export_type in args.formats:
+      payload = to_csv_bytes(sheet) if export_type == "csv" else to_xlsx_bytes(sheet)
+      path = os.path.join(args.out_dir, f"finance-{row_count}.{export_type}")
+      with open(path, "wb") as file:
+        file.write(payload)
+      print(f"{path}: {len(payload)} bytes")
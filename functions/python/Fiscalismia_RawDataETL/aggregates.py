@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from interval_index import IntervalIndex, INTERVAL_TABLES, build_interval_index
+
+# Rollups over the typed tables of load_tables_from_sheet, published next to the tables once per run,
+# so the frontend and API no longer recompute them from the full tables on every request.
+# Months are rendered as YYYY-MM. Rows missing the date or amount an aggregate is based on are left out.
+
+def _month(dates: pd.Series) -> pd.Series:
+  return dates.dt.strftime("%Y-%m")
+
+def monthly_spend_by(variable_expenses: pd.DataFrame, col_name: str) -> pd.DataFrame:
+  """
+  Sum and count of variable expenses per month and value of col_name.
+  """
+  expenses = variable_expenses.dropna(subset=["purchasing_date", "cost"])
+  return (
+    expenses.groupby([_month(expenses["purchasing_date"]).rename("month"), col_name], observed=True, sort=True)["cost"]
+    .agg(total_cost="sum", purchases="count")
+    .reset_index()
+  )
+
+def monthly_spend_by_category(tables: dict[str, pd.DataFrame], interval_indexes: dict[str, IntervalIndex]) -> pd.DataFrame:
+  return monthly_spend_by(tables["variable_expenses"], "category")
+
+def monthly_spend_by_store(tables: dict[str, pd.DataFrame], interval_indexes: dict[str, IntervalIndex]) -> pd.DataFrame:
+  return monthly_spend_by(tables["variable_expenses"], "store")
+
+def _months_to_str(ordinals: np.ndarray) -> pd.Series:
+  return pd.Series(pd.PeriodIndex.from_ordinals(ordinals, freq="M").strftime("%Y-%m"))
+
+def active_fixed_costs_per_month(tables: dict[str, pd.DataFrame], interval_indexes: dict[str, IntervalIndex]) -> pd.DataFrame:
+  """
+  Sum of the monthly cost of all fixed costs active per month and category.
+  Open periods are active until the month of the latest effective or expiration date.
+  """
+  fixed_costs = tables["fixed_costs"]
+  positions, months = interval_indexes["fixed_costs"].expand_monthly()
+  expanded = pd.DataFrame({
+    "month": _months_to_str(months),
+    "category": fixed_costs["category"].to_numpy()[positions],
+    "monthly_cost": fixed_costs["monthly_cost"].to_numpy()[positions],
+  })
+  return (
+    expanded.groupby(["month", "category"], observed=True, sort=True)["monthly_cost"]
+    .agg(total_monthly_cost="sum", fixed_costs="count")
+    .reset_index()
+  )
+
+def income_per_type_and_period(tables: dict[str, pd.DataFrame], interval_indexes: dict[str, IntervalIndex]) -> pd.DataFrame:
+  """
+  Income per type and validity period of the "Date:" sections, as paid and as monthly equivalent.
+  """
+  income = tables["income"].dropna(subset=["effective_date", "value"])
+  income = income.assign(monthly_value=income["value"] / income["monthly_interval"].where(income["monthly_interval"] > 0))
+  return (
+    income.groupby(["type", "effective_date", "expiration_date"], dropna=False, sort=True)
+    .agg(total_value=("value", "sum"), total_monthly_value=("monthly_value", "sum"), incomes=("value", "count"))
+    .reset_index()
+  )
+
+def food_price_per_100_kcal(tables: dict[str, pd.DataFrame], interval_indexes: dict[str, IntervalIndex]) -> pd.DataFrame:
+  """
+  Price per 100 kcal of every food item, cheapest first. kcal_amount is given per 100 grams and price per weight.
+  """
+  food_items = tables["food_items"]
+  total_kcal = food_items["kcal_amount"] * food_items["weight"] / 100
+  price_per_100_kcal = (food_items["price"] / total_kcal.where(total_kcal > 0) * 100).round(4)
+  return (
+    food_items[["food_item", "brand", "store", "main_macro"]]
+    .assign(price_per_100_kcal=price_per_100_kcal)
+    .dropna(subset=["price_per_100_kcal"])
+    .sort_values("price_per_100_kcal", kind="stable")
+    .reset_index(drop=True)
+  )
+
+# Published aggregates keyed by output name
+AGGREGATES = {
+  "monthly_spend_by_category": monthly_spend_by_category,
+  "monthly_spend_by_store": monthly_spend_by_store,
+  "active_fixed_costs_per_month": active_fixed_costs_per_month,
+  "income_per_type_and_period": income_per_type_and_period,
+  "food_price_per_100_kcal": food_price_per_100_kcal,
+}
+
+def compute_aggregates(tables: dict[str, pd.DataFrame], profiler, interval_indexes: dict[str, IntervalIndex] | None = None):
+  """
+  Yields (aggregate name, aggregate) for all AGGREGATES, each computed within a span.
+  Interval indexes not built during extraction are built here, see interval_index.py.
+  """
+  interval_indexes = dict(interval_indexes or {})
+  for table_name in INTERVAL_TABLES:
+    if table_name not in interval_indexes:
+      interval_indexes[table_name] = build_interval_index(tables[table_name])
+  for name, aggregate in AGGREGATES.items():
+    with profiler.span("aggregate", {"Aggregate": name}) as aggregate_span:
+      df = aggregate(tables, interval_indexes)
+      aggregate_span.add_rows(len(df))
+    yield name, df
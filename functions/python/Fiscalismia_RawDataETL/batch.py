@@ -0,0 +1,91 @@
+import json
+import re
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from clean_sheet_url import global_sheet_id
+from etl_config import BATCH_CONCURRENCY
+
+# Batch mode processing several spreadsheets per invocation, configured in Parameter Store as JSON list of targets:
+#   [{"name": "household", "url": "https://docs.google.com/spreadsheets/d/<id>/edit", "gid": 887527210, "profile": "default"}]
+# - name identifies the target in the response. Its run ids end with the name, its state and snapshot catalog live under targets/<name>/
+# - gid selects the worksheet of urls rewritten by clean_sheet_url, by default the Finances sheet
+# - profile selects the table layout among ddl_schema.PROFILES, by default "default"
+# Every target runs the regular ETL, including coalescing and incremental mode, on up to BATCH_CONCURRENCY threads.
+# The s3 client, the HTTP session and the upload pool are shared by all targets.
+BATCH_TARGETS_PARAMETER = "/google/sheets/fiscalismia-batch-targets"
+TARGET_NAME_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+# Lives across warm invocations
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-target")
+
+def target_state_prefix(name: str) -> str:
+  return f"targets/{name}/"
+
+def target_run_id(run_id: str, name: str) -> str:
+  # keeps the leading date of the run id, by which the snapshot catalog is partitioned
+  return f"{run_id}-{name}"
+
+def parse_targets(raw_targets: str | None) -> list[dict]:
+  """
+  Validates the batch targets from Parameter Store and resolves their ddl_schema profile into tables.
+  Raises RuntimeError if the list is missing or malformed, names are duplicated or a profile is unknown.
+  """
+  from ddl_schema import PROFILES
+  if not raw_targets:
+    raise RuntimeError(f"Batch targets missing in parameter {BATCH_TARGETS_PARAMETER}.")
+  try:
+    targets = json.loads(raw_targets)
+  except ValueError as e:
+    raise RuntimeError(f"Batch targets are not valid JSON: {e}")
+  if not isinstance(targets, list) or not targets:
+    raise RuntimeError("Batch targets must be a non-empty list.")
+  parsed_targets = []
+  for target in targets:
+    if not isinstance(target, dict) or not target.get("url"):
+      raise RuntimeError(f"Batch target without url: {target}")
+    name = str(target.get("name", ""))
+    if not TARGET_NAME_PATTERN.match(name):
+      raise RuntimeError(f"Batch target name '{name}' must match {TARGET_NAME_PATTERN.pattern}")
+    profile = target.get("profile", "default")
+    if profile not in PROFILES:
+      raise RuntimeError(f"Unknown ddl_schema profile '{profile}' of batch target '{name}'. Supported: {list(PROFILES)}")
+    try:
+      gid = int(target.get("gid", global_sheet_id))
+    except (TypeError, ValueError):
+      raise RuntimeError(f"Batch target '{name}' has a non-numeric gid: {target.get('gid')}")
+    parsed_targets.append({
+      "name": name,
+      "url": target["url"],
+      "gid": gid,
+      "profile": profile,
+      "tables": PROFILES[profile],
+      "state_prefix": target_state_prefix(name),
+    })
+  names = [target["name"] for target in parsed_targets]
+  if len(set(names)) != len(names):
+    raise RuntimeError(f"Batch target names must be unique: {names}")
+  return parsed_targets
+
+def run_targets(targets: list[dict], run_target: Callable[[dict], dict]) -> dict[str, dict]:
+  """
+  Runs run_target for every target on the batch executor and returns the responses keyed by target name.
+  run_target is expected to turn failures into error responses, so every target is reported.
+  """
+  responses = batch_executor.map(run_target, targets)
+  return {target["name"]: response for target, response in zip(targets, responses)}
+
+def batch_response(responses: dict[str, dict]) -> dict:
+  """
+  Combines the responses of all targets into one: 202 if every target succeeded, 207 otherwise.
+  The body holds status code and body of every target, and the names of the failed targets.
+  """
+  failed = [name for name, response in responses.items() if response["statusCode"] >= 400]
+  return {
+    "statusCode": 207 if failed else 202,
+    "body": json.dumps({
+      "targets": {
+        name: {"statusCode": response["statusCode"], **json.loads(response["body"])}
+        for name, response in responses.items()
+      },
+      "failed": failed,
+    })
+  }
@@ -1,5 +1,5 @@
 global_sheet_id = 887527210
-def clean_sheet_url(sheet_url, logger, export_type):
+def clean_sheet_url(sheet_url, logger, export_type, sheet_id=global_sheet_id):
   if not sheet_url :
     raise RuntimeError("Spreadsheet url from secret manager missing.")
   if "docs.google.com/spreadsheets" not in sheet_url:
@@ -9,16 +9,16 @@ def clean_sheet_url(sheet_url, logger, export_type):
     pass
     logger.info(f"sheet_url formed correctly for {export_type}")
   elif "/edit" in sheet_url:
-    sheet_url = sheet_url.split("/edit")[0] + f"/export?format={export_type}&gid={global_sheet_id}"
+    sheet_url = sheet_url.split("/edit")[0] + f"/export?format={export_type}&gid={sheet_id}"
     logger.info(f"sheet_url /edit rewritten to {sheet_url}")
   elif "/view" in sheet_url:
-    sheet_url = sheet_url.split("/view")[0] + f"/export?format={export_type}&gid={global_sheet_id}"
+    sheet_url = sheet_url.split("/view")[0] + f"/export?format={export_type}&gid={sheet_id}"
     logger.info(f"sheet_url /view rewritten to {sheet_url}")
   elif "/pubhtml" in sheet_url:
-    sheet_url = sheet_url.split("/pubhtml")[0] + f"/pub?output={export_type}&gid={global_sheet_id}"
+    sheet_url = sheet_url.split("/pubhtml")[0] + f"/pub?output={export_type}&gid={sheet_id}"
     logger.info(f"sheet_url /pubhtml rewritten to {sheet_url}")
   else:
-    sheet_url = '/'.join(sheet_url.split("/")[:-1]) + f"/export?format={export_type}&gid={global_sheet_id}"
+    sheet_url = '/'.join(sheet_url.split("/")[:-1]) + f"/export?format={export_type}&gid={sheet_id}"
     logger.info(f"sheet_url suffix not identifiable. Rewritten to {sheet_url}")
 
   return sheet_url
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import time
+from collections.abc import Callable
+from botocore.exceptions import ClientError
+from etl_config import COALESCE_WINDOW_SECONDS, COALESCE_MAX_WAIT_SECONDS, RUN_LOCK_TTL_SECONDS
+from instrumentation import Profiler
+
+# Coalescing of concurrent invocations, e.g. several dashboard clients refreshing at the same moment.
+# A single run manifest in s3 acts as lock. Conditional writes decide which invocation leads:
+# - the leader claims the manifest, runs the ETL and publishes its response in the manifest
+# - invocations arriving while the leader runs poll the manifest and return the published response.
+#   After COALESCE_MAX_WAIT_SECONDS they respond 503 instead, before API Gateway times out the request
+# - invocations arriving within COALESCE_WINDOW_SECONDS after a successful run return its response directly
+# A manifest of a failed run, of a finished run outside the window or of a leader past its lock TTL
+# is taken over by the next invocation via a write conditioned on the ETag it has read.
+RUN_MANIFEST_S3_KEY = "state/run-manifest.json"
+# Interval in which followers poll the run manifest while the leader runs
+POLL_INTERVAL_SECONDS = 0.5
+# Seconds after which a follower that stopped waiting asks its client to retry
+BUSY_RETRY_AFTER_SECONDS = 5
+# Error codes of s3 conditional writes losing a race
+CONDITIONAL_WRITE_ERRORS = ("PreconditionFailed", "ConditionalRequestConflict")
+
+def _is_conditional_write_error(e: ClientError) -> bool:
+  return e.response.get("Error", {}).get("Code") in CONDITIONAL_WRITE_ERRORS
+
+def _read_manifest(s3_bucket: str, s3_client, s3_key: str) -> tuple[dict | None, str | None]:
+  """
+  Returns the run manifest and its ETag, or (None, None) if no run has been claimed yet.
+  """
+  try:
+    response = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+      return None, None
+    raise
+  try:
+    manifest = json.loads(response["Body"].read())
+  except ValueError:
+    # an unreadable manifest is treated like an expired one and taken over
+    manifest = {"status": "unreadable", "expires_at": 0}
+  return manifest, response["ETag"]
+
+def _write_manifest(s3_bucket: str, s3_client, s3_key: str, manifest: dict, etag: str | None) -> str:
+  """
+  Writes the manifest if it still has the given ETag, or if it does not exist for etag None.
+  Returns the new ETag. Raises ClientError if another invocation wrote it in between.
+  """
+  condition = {"IfNoneMatch": "*"} if etag is None else {"IfMatch": etag}
+  response = s3_client.put_object(
+    Bucket=s3_bucket,
+    Key=s3_key,
+    Body=json.dumps(manifest).encode("utf-8"),
+    ContentType="application/json",
+    **condition,
+  )
+  return response["ETag"]
+
+def _reusable_response(manifest: dict, now: float) -> dict | None:
+  if manifest.get("status") == "succeeded" and now - manifest.get("finished_at", 0) < COALESCE_WINDOW_SECONDS:
+    return manifest["response"]
+  return None
+
+def claim_run(run_id: str, s3_bucket: str, s3_client, logger, state_prefix: str = "") -> dict:
+  """
+  Decides the role of this invocation, returning a claim with one of the roles:
+  - leader: the manifest is claimed by this invocation. Its ETag is kept for publishing the result
+  - follower: another invocation holds an unexpired claim
+  - reuse: a run finished within the coalescing window. Its response is part of the claim
+  state_prefix namespaces the run manifest per spreadsheet in batch mode, see batch.py.
+  """
+  s3_key = f"{state_prefix}{RUN_MANIFEST_S3_KEY}"
+  while True:
+    now = time.time()
+    manifest, etag = _read_manifest(s3_bucket, s3_client, s3_key)
+    if manifest is not None:
+      response = _reusable_response(manifest, now)
+      if response is not None:
+        return {"role": "reuse", "run_id": manifest["run_id"], "s3_key": s3_key, "response": response}
+      if manifest.get("status") == "running" and manifest.get("expires_at", 0) > now:
+        return {"role": "follower", "run_id": manifest["run_id"], "s3_key": s3_key, "expires_at": manifest["expires_at"]}
+    claimed_manifest = {"run_id": run_id, "status": "running", "started_at": now, "expires_at": now + RUN_LOCK_TTL_SECONDS}
+    try:
+      etag = _write_manifest(s3_bucket, s3_client, s3_key, claimed_manifest, etag)
+    except ClientError as e:
+      if not _is_conditional_write_error(e):
+        raise
+      # another invocation claimed the run in between. Its claim is read again
+      continue
+    if manifest is not None:
+      logger.info("Took over run manifest", extra={"previous_run": manifest.get("run_id"), "previous_status": manifest.get("status")})
+    return {"role": "leader", "run_id": run_id, "s3_key": s3_key, "etag": etag}
+
+def wait_for_leader(claim: dict, s3_bucket: str, s3_client, deadline: float | None = None) -> dict | None:
+  """
+  Polls the manifest until the leader publishes its response, at most until deadline, a time.time() value.
+  Returns None if the leader failed, its claim expired, another run took over or the deadline passed,
+  so the caller claims again.
+  """
+  until = claim["expires_at"] if deadline is None else min(claim["expires_at"], deadline)
+  while time.time() < until:
+    time.sleep(POLL_INTERVAL_SECONDS)
+    manifest, _ = _read_manifest(s3_bucket, s3_client, claim["s3_key"])
+    if manifest is None or manifest.get("run_id") != claim["run_id"]:
+      return None
+    if manifest.get("status") == "succeeded":
+      return manifest["response"]
+    if manifest.get("status") != "running":
+      return None
+  return None
+
+def publish_result(claim: dict, s3_bucket: str, s3_client, logger, response: dict | None):
+  """
+  Records the response of the leader in the manifest, or the failure of its run for response None.
+  A leader outlasting its lock TTL may have been taken over, in which case nothing is published.
+  """
+  now = time.time()
+  manifest = {"run_id": claim["run_id"], "status": "failed" if response is None else "succeeded", "finished_at": now}
+  if response is not None:
+    manifest["response"] = response
+  try:
+    _write_manifest(s3_bucket, s3_client, claim["s3_key"], manifest, claim["etag"])
+  except ClientError as e:
+    if not _is_conditional_write_error(e):
+      raise
+    logger.warning("Run manifest was taken over before the result was published", extra={"run_id": claim["run_id"]})
+
+def busy_response(claim: dict) -> dict:
+  """
+  Response of a follower that stopped waiting for the leader. The client retries once the leader published its response.
+  """
+  return {
+    "statusCode": 503,
+    "headers": {"Retry-After": str(BUSY_RETRY_AFTER_SECONDS)},
+    "body": json.dumps({"error": "A concurrent run of the spreadsheet is still in progress. Retry shortly.", "leader_run": claim["run_id"]}),
+  }
+
+def coalesce(
+  run_id: str,
+  s3_bucket: str,
+  s3_client,
+  profiler: Profiler,
+  logger,
+  run: Callable[[], dict],
+  state_prefix: str = ""
+) -> dict:
+  """
+  Returns the response of run(), or the response of a concurrent or recent run of another invocation.
+  Only successful responses are shared. Exceptions of run() mark the run failed and are raised to the caller.
+  Followers waiting longer than COALESCE_MAX_WAIT_SECONDS get busy_response.
+  """
+  if COALESCE_WINDOW_SECONDS <= 0:
+    return run()
+  wait_deadline = time.time() + COALESCE_MAX_WAIT_SECONDS
+  while True:
+    with profiler.span("claim_run") as claim_span:
+      claim = claim_run(run_id, s3_bucket, s3_client, logger, state_prefix)
+      claim_span.add_counts({"leader": int(claim["role"] == "leader")})
+    if claim["role"] == "reuse":
+      logger.info("Reusing response of a recent run", extra={"leader_run": claim["run_id"]})
+      return claim["response"]
+    if claim["role"] == "leader":
+      break
+    if time.time() >= wait_deadline:
+      logger.warning("Concurrent run still in progress after the maximum wait", extra={"leader_run": claim["run_id"]})
+      return busy_response(claim)
+    logger.info("Waiting for the response of a concurrent run", extra={"leader_run": claim["run_id"]})
+    with profiler.span("await_leader"):
+      response = wait_for_leader(claim, s3_bucket, s3_client, wait_deadline)
+    if response is not None:
+      return response
+  try:
+    response = run()
+  except Exception:
+    try:
+      publish_result(claim, s3_bucket, s3_client, logger, None)
+    except ClientError as e:
+      # the claim expires after RUN_LOCK_TTL_SECONDS in any case
+      logger.warning("Failed to mark run manifest as failed", extra={"error": str(e)})
+    raise
+  with profiler.span("publish_result"):
+    publish_result(claim, s3_bucket, s3_client, logger, response)
+  return response
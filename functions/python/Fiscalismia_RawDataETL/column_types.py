@@ -0,0 +1,121 @@
+import pandas as pd
+
+# Column types declared per table in ddl_schema.py under "col_types".
+# Columns without a declared type remain strings.
+DECIMAL = "decimal"    # German locale numerics such as "1.234,56 €", "1.000" or "26,375%", percentages become fractions
+DATE = "date"          # DD.MM.YYYY dates, XLSX exports may provide ISO 8601 dates instead
+BOOLEAN = "boolean"    # checkbox values TRUE / FALSE
+CATEGORY = "category"  # low cardinality strings
+
+TRUE_VALUES = {"TRUE", "WAHR", "YES", "JA", "X", "1"}
+FALSE_VALUES = {"FALSE", "FALSCH", "NO", "NEIN", "0"}
+# Number of offending raw values listed per column in the validation report
+REPORT_SAMPLE_SIZE = 5
+
+def _to_decimal(values: pd.Series) -> pd.Series:
+  # XLSX exports hold percentages as the fraction the cell displays, "26,375%" is 0.26375. CSV values are scaled to match
+  is_percent = values.str.contains("%", regex=False, na=False)
+  # Strips currency and percent signs as well as any whitespace, including non-breaking spaces
+  values = values.str.replace(r"[€%\s]", "", regex=True)
+  # Dots are thousands separators and the comma is the decimal point. Numbers of XLSX exports are rendered
+  # the same way, see download_xlsx._cell_to_str
+  values = values.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+  # scaled by exponent rather than division, which would round 48,848% to 0.48847999999999997 instead of 0.48848
+  values = values.mask(is_percent, values + "e-2")
+  return pd.to_numeric(values, errors="coerce").astype("float64")
+
+def _to_date(values: pd.Series) -> pd.Series:
+  dates = pd.to_datetime(values, format="%d.%m.%Y", errors="coerce")
+  is_unparsed = dates.isna() & values.notna()
+  if is_unparsed.any():
+    dates = dates.where(~is_unparsed, pd.to_datetime(values.where(is_unparsed), format="ISO8601", errors="coerce"))
+  return dates
+
+def _to_boolean(values: pd.Series) -> pd.Series:
+  upper = values.str.upper()
+  booleans = pd.Series(pd.NA, index=values.index, dtype="boolean")
+  booleans[upper.isin(TRUE_VALUES)] = True
+  booleans[upper.isin(FALSE_VALUES)] = False
+  return booleans
+
+def _to_category(values: pd.Series) -> pd.Series:
+  return values.astype("category")
+
+CONVERTERS = {
+  DECIMAL: _to_decimal,
+  DATE: _to_date,
+  BOOLEAN: _to_boolean,
+  CATEGORY: _to_category,
+}
+
+def apply_column_types(df: pd.DataFrame, table_def: dict, table_name: str, validation_report: dict) -> pd.DataFrame:
+  """
+  Converts the raw string columns of an extracted table to the types declared in its table_def.
+  - Empty cells become missing values
+  - Non-empty cells that cannot be converted become missing values and are
+    collected per column into validation_report[table_name]
+  """
+  col_types = table_def.get("col_types", {})
+  typed = df.copy()
+  for col_name, col_type in col_types.items():
+    raw_values = df[col_name].astype(str).str.strip()
+    raw_values = raw_values.where(raw_values != "")
+    converted = CONVERTERS[col_type](raw_values)
+    failed = converted.isna() & raw_values.notna()
+    if failed.any():
+      validation_report.setdefault(table_name, {})[col_name] = {
+        "type": col_type,
+        "failures": int(failed.sum()),
+        "rows": failed[failed].index[:REPORT_SAMPLE_SIZE].tolist(),
+        "samples": raw_values[failed].head(REPORT_SAMPLE_SIZE).tolist(),
+      }
+    typed[col_name] = converted
+  return typed
+
+# Converters of the values typed columns are serialized to by output_formats._write_tsv,
+# i.e. "1234.56", "2024-03-09" and "True" rather than the German locale values of the sheet
+TSV_CONVERTERS = {
+  # astype parses the shortest repr pandas writes exactly, unlike pd.to_numeric
+  DECIMAL: lambda values: values.astype("float64"),
+  DATE: lambda values: pd.to_datetime(values, format="ISO8601").astype("datetime64[us]"),
+  BOOLEAN: lambda values: values.map({"True": True, "False": False}).astype("boolean"),
+  CATEGORY: _to_category,
+}
+
+def restore_column_types(df: pd.DataFrame, table_def: dict) -> pd.DataFrame:
+  """
+  Converts the string columns of a typed table read back from TSV to the types declared in its table_def.
+  Empty cells become missing values. Unlike apply_column_types, values that cannot be converted raise.
+  """
+  typed = df.copy()
+  for col_name, col_type in table_def.get("col_types", {}).items():
+    values = df[col_name]
+    typed[col_name] = TSV_CONVERTERS[col_type](values.where(values != ""))
+  return typed
+
+def merge_validation_report(validation_report: dict, chunk_report: dict):
+  """
+  Merges the validation report of a chunk of rows typed by apply_column_types into validation_report.
+  """
+  for table_name, columns in chunk_report.items():
+    table_report = validation_report.setdefault(table_name, {})
+    for col_name, column_report in columns.items():
+      if col_name not in table_report:
+        table_report[col_name] = column_report
+        continue
+      merged = table_report[col_name]
+      merged["failures"] += column_report["failures"]
+      merged["rows"] = (merged["rows"] + column_report["rows"])[:REPORT_SAMPLE_SIZE]
+      merged["samples"] = (merged["samples"] + column_report["samples"])[:REPORT_SAMPLE_SIZE]
+
+def concat_typed_chunks(chunks: list[pd.DataFrame], table_def: dict) -> pd.DataFrame:
+  """
+  Concatenates the chunks of a table typed one at a time by apply_column_types.
+  Category columns are converted again, since chunks with different categories concatenate to strings.
+  Chunks without rows are left out, as their columns lack the dtype inferred from values.
+  """
+  df = pd.concat([chunk for chunk in chunks if len(chunk)] or chunks[:1], ignore_index=True)
+  for col_name, col_type in table_def.get("col_types", {}).items():
+    if col_type == CATEGORY:
+      df[col_name] = df[col_name].astype("category")
+  return df
@@ -13,6 +13,8 @@
 #   Row 3: column headers  ← HEADER_ROW
 #   Row 4+: data rows      ← DATA_START_ROW
 
+from column_types import DECIMAL, DATE, BOOLEAN, CATEGORY
+
 HEADER_ROW = 3
 DATA_START_ROW = 4
 
@@ -30,6 +32,21 @@ TABLE_VAR_EXPENSES = {
         "contains_indulgence",
         "sensitivities",
     ],
+    # Types the raw string columns are converted to. Undeclared columns remain strings
+    "col_types": {
+        "category": CATEGORY,
+        "store": CATEGORY,
+        "cost": DECIMAL,
+        "purchasing_date": DATE,
+        "is_planned": BOOLEAN,
+        "contains_indulgence": BOOLEAN,
+    },
+    # Columns identifying a row across runs for the incremental row delta
+    "key_col_names": [
+        "description",
+        "store",
+        "purchasing_date",
+    ],
     # Values in col 0 (relative) that mark non-data rows to skip
     "skip_markers": {"description", "border"},
 }
@@ -52,6 +69,23 @@ TABLE_INVESTMENTS = {
         "pct_of_profit_taxed",
         "profit_amt",
     ],
+    # Types the raw string columns are converted to. Undeclared columns remain strings
+    "col_types": {
+        "investment_type": CATEGORY,
+        "units": DECIMAL,
+        "price_per_unit": DECIMAL,
+        "total_price": DECIMAL,
+        "fees": DECIMAL,
+        "execution_date": DATE,
+        "pct_of_profit_taxed": DECIMAL,
+        "profit_amt": DECIMAL,
+    },
+    # Columns identifying a row across runs for the incremental row delta
+    "key_col_names": [
+        "execution_type",
+        "isin",
+        "execution_date",
+    ],
     "skip_markers": {"execution_type", "border"},
 }
 
@@ -69,6 +103,21 @@ TABLE_NEW_FOOD_ITEMS = {
         "price",
         "last_update",
     ],
+    # Types the raw string columns are converted to. Undeclared columns remain strings
+    "col_types": {
+        "store": CATEGORY,
+        "main_macro": CATEGORY,
+        "kcal_amount": DECIMAL,
+        "weight": DECIMAL,
+        "price": DECIMAL,
+        "last_update": DATE,
+    },
+    # Columns identifying a row across runs for the incremental row delta
+    "key_col_names": [
+        "food_item",
+        "brand",
+        "store",
+    ],
     "skip_markers": {"food_item", "[100 grams]", "border"},
 }
 
@@ -84,6 +133,21 @@ TABLE_FIXED_COSTS = {
         "billed_cost",
         "monthly_cost",
     ],
+    # Types the raw string columns are converted to. Undeclared columns remain strings
+    "col_types": {
+        "category": CATEGORY,
+        "monthly_interval": DECIMAL,
+        "billed_cost": DECIMAL,
+        "monthly_cost": DECIMAL,
+        "effective_date": DATE,
+        "expiration_date": DATE,
+    },
+    # Columns identifying a row across runs for the incremental row delta
+    "key_col_names": [
+        "category",
+        "description",
+        "effective_date",
+    ],
     # effective_date and expiration_date are derived from the embedded "Date:" rows
     "derived_col_names": ["effective_date", "expiration_date"],
     # Skip rows if first column contains these
@@ -104,6 +168,19 @@ TABLE_INCOME = {
         "monthly_interval",
         "value",
     ],
+    # Types the raw string columns are converted to. Undeclared columns remain strings
+    "col_types": {
+        "monthly_interval": DECIMAL,
+        "value": DECIMAL,
+        "effective_date": DATE,
+        "expiration_date": DATE,
+    },
+    # Columns identifying a row across runs for the incremental row delta
+    "key_col_names": [
+        "description",
+        "type",
+        "effective_date",
+    ],
     # effective_date and expiration_date are derived from the embedded "Date:" rows
     "derived_col_names": ["effective_date", "expiration_date"],
     # Skip rows if first column contains these
@@ -112,3 +189,45 @@ TABLE_INCOME = {
     # Offset (relative to col_slice start) where the date string lives on a date row
     "date_value_col_offset": 1,
 }
+
+# Version of the table definitions above, recorded in the manifest of every run (see table_manifest.py).
+# Increment whenever col_names or col_types of any table or the columns of an aggregate change,
+# so clients discard cached tables
+SCHEMA_VERSION = 1
+
+# All tables keyed by their output name, in the order they are extracted and uploaded
+TABLES = {
+  "variable_expenses": TABLE_VAR_EXPENSES,
+  "investments":       TABLE_INVESTMENTS,
+  "food_items":        TABLE_NEW_FOOD_ITEMS,
+  "fixed_costs":       TABLE_FIXED_COSTS,
+  "income":            TABLE_INCOME,
+}
+
+# Table layouts of the spreadsheets processed in batch mode, keyed by profile name. See batch.py
+# Every profile defines all tables above with the same col_names and col_types,
+# while their col_slice, skip markers and date markers may differ per spreadsheet
+PROFILES = {
+  "default": TABLES,
+}
+
+def sheet_usecols(tables: dict[str, dict]) -> list[int]:
+  return sorted({
+    col
+    for table_def in tables.values()
+    for col in range(table_def["col_slice"].start, table_def["col_slice"].stop)
+  })
+
+# 0-based source columns read by any of the tables above (B:I, K:O, Q:AB, AJ:AM, AP:AW).
+# Parsers pass these as usecols so scratch columns in between are never materialized.
+SHEET_USECOLS = sheet_usecols(TABLES)
+
+def pruned_table_def(table_def: dict, usecols: list[int] = SHEET_USECOLS) -> dict:
+  """
+  Remaps the col_slice of a table onto a sheet that was parsed with usecols=SHEET_USECOLS,
+  or the usecols of its profile.
+  Each table spans a contiguous range of used columns, so only the slice offsets shift.
+  """
+  col_slice = table_def["col_slice"]
+  start = usecols.index(col_slice.start)
+  return {**table_def, "col_slice": slice(start, start + col_slice.stop - col_slice.start)}
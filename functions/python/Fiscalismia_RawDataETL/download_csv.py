@@ -1,52 +1,120 @@
-import pandas as pd
-from io import BytesIO
-from timedelta_analysis import add_time_analysis_entry
-import requests # not in aws runtime
+from __future__ import annotations
+from concurrent.futures import wait
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+from etl_config import CSV_CHUNK_ROWS
+from run_state import conditional_request_headers, fingerprint_response, is_unchanged
+from http_client import get_export
+from stream_ingest import MemoryViewReader, read_response_body
+from snapshot_store import start_snapshot_backup
+if TYPE_CHECKING:
+  import pandas as pd
+
+def _read_csv(raw_view: memoryview, tables: dict[str, dict] | None, **read_options):
+  # pandas is only imported once a changed sheet has to be parsed
+  import pandas as pd
+  from ddl_schema import SHEET_USECOLS, sheet_usecols
+  # See https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html
+  # See https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.html
+  return pd.read_csv(
+      MemoryViewReader(raw_view),
+      sep=",",               # explicit comma delimiter
+      header=None,           # no header row — treat all rows as data
+      usecols=sheet_usecols(tables) if tables else SHEET_USECOLS, # only materialize columns referenced by ddl_schema tables
+      na_filter=False,       # skip NA detection for performance
+      dtype=str,             # preserve all raw cell values as strings
+      engine="c",            # pyarrow engine is too large of a dependency
+      **read_options
+  )
+
+def parse_csv(raw_view: memoryview, tables: dict[str, dict] | None = None) -> pd.DataFrame:
+  """
+  Parses a CSV export into a DataFrame of raw strings, materializing only the columns used by ddl_schema.
+  tables selects a ddl_schema profile other than the default TABLES.
+  Raises RuntimeError if the export lacks any of them.
+  """
+  try:
+    # Internally process the file in chunks, resulting in lower memory use while parsing
+    return _read_csv(raw_view, tables, low_memory=False)
+  except ValueError as e:
+    raise RuntimeError(f"Failed to parse CSV with the columns expected by ddl_schema: {e}")
+
+def iter_csv_chunks(raw_view: memoryview, chunk_rows: int, tables: dict[str, dict] | None = None) -> Iterator[pd.DataFrame]:
+  """
+  Parses a CSV export lazily into DataFrames of raw strings of at most chunk_rows rows each, see parse_csv.
+  Row labels continue across chunks, so every chunk is labeled with the sheet rows it holds.
+  Raises RuntimeError if the export lacks any of the columns used by ddl_schema.
+  """
+  try:
+    with _read_csv(raw_view, tables, chunksize=chunk_rows) as reader:
+      yield from reader
+  except ValueError as e:
+    raise RuntimeError(f"Failed to parse CSV with the columns expected by ddl_schema: {e}")
 
 def download_csv(
-      start_time: int,
-      timestamp: str,
+      run_id: str,
       sheet_url: str,
       s3_bucket: str,
-      timedelta_analysis: list[str],
+      profiler,
       s3_client,
-      logger
-) -> pd.DataFrame:
+      logger,
+      last_run: dict | None = None,
+      tables: dict[str, dict] | None = None,
+      state_prefix: str = ""
+) -> tuple[pd.DataFrame | Iterator[pd.DataFrame] | None, dict]:
     """
-    Queries Google Sheets via HTTP Request to download a CSV export into memory.
-    - Persists sheet with timestamp to s3 into s3://fiscalismia-raw-data-etl-storage/tmp/
+    Queries Google Sheets via pooled HTTP Request to download a CSV export into memory.
+    - Streams the response body into a single buffer shared by the parser and the s3 backup
+    - Persists sheet to the snapshot store while parsing, once per distinct content. See snapshot_store.py
     - Uses pandas with c engine for
-    - Returns the parsed DataFrame
+    - Returns the parsed DataFrame and the fingerprint of the downloaded content
+    - With CSV_CHUNK_ROWS set, returns an iterator parsing the export in chunks during extraction instead
+    - Returns None instead of a DataFrame if the content is unchanged since the last successful run
+    - tables selects the ddl_schema profile of the spreadsheet, by default TABLES
+    - state_prefix selects the snapshot catalog of a batch target, see snapshot_store.py
     """
     # Download the spreadsheet from google docs into memory
-    response = requests.get(sheet_url, stream=True, timeout=(3, 10)) # (3s connect timeout, 10s read timeout)
-    if response.status_code != 200:
-      raise RuntimeError(f"Failed to download the sheet. HTTP status: {response.status_code}")
-    add_time_analysis_entry(timedelta_analysis, start_time, "request CSV file via URL")
-
-    raw_bytes = response.content
-    s3_buffer = BytesIO(raw_bytes)
-    csv_buffer = BytesIO(raw_bytes)
-
-    # Persist raw bytes to S3 as timestamped backup
-    s3_key = f"tmp/{timestamp}-Fiscalismia-Datasource.csv"
-    add_time_analysis_entry(timedelta_analysis, start_time, "load CSV file into memory")
-    s3_client.upload_fileobj(s3_buffer, s3_bucket, s3_key)
-    logger.debug(f"CSV persisted to s3://{s3_bucket}/{s3_key}")
-    add_time_analysis_entry(timedelta_analysis, start_time, "persist CSV file to s3 /tmp")
-
-    # Parse CSV into DataFrame via pyarrow engine
-    # See https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html
-    # See https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.html
-    csv: pd.DataFrame = pd.read_csv(
-        csv_buffer,
-        sep=",",          # explicit comma delimiter
-        header=None,      # no header row — treat all rows as data
-        na_filter=False,  # skip NA detection for performance
-        dtype=str,        # preserve all raw cell values as strings
-        engine="c",       # pyarrow engine is too large of a dependency
-        low_memory=False  # Internally process the file in chunks, resulting in lower memory use while parsing
-    )
-    add_time_analysis_entry(timedelta_analysis, start_time, "read CSV via pandas C engine")
+    # Conditional request headers let Google answer with 304 if the sheet is unchanged since the last run
+    with profiler.span("download", {"ExportType": "csv"}) as download_span:
+      request_headers = conditional_request_headers(last_run, "csv")
+      # pooled session with retries and optional hedging, see http_client.py
+      response, request_stats = get_export(sheet_url, request_headers)
+      download_span.add_counts(request_stats)
+      if response.status_code == 304:
+        response.close()
+        logger.info("Sheet not modified since last successful run according to HTTP validators")
+        return None, {key: last_run.get(key) for key in ("export_type", "sha256", "etag", "last_modified")}
+      if response.status_code != 200:
+        response.close()
+        raise RuntimeError(f"Failed to download the sheet. HTTP status: {response.status_code}")
+
+      raw_view = read_response_body(response)
+      download_span.add_bytes(len(raw_view))
+    with profiler.span("fingerprint"):
+      fingerprint = fingerprint_response(response, raw_view, "csv")
+    if is_unchanged(last_run, fingerprint):
+      logger.info("Sheet content hash matches last successful run", extra={"sha256": fingerprint["sha256"]})
+      return None, fingerprint
+
+    # Persist raw bytes to the snapshot store in the background while parsing
+    backup_upload = start_snapshot_backup(raw_view, fingerprint, run_id, s3_bucket, s3_client, profiler, state_prefix)
+
+    if CSV_CHUNK_ROWS > 0:
+      # parsed chunk by chunk while the tables are extracted, see extract_transform.iter_tables_from_sheet
+      wait([backup_upload])
+      backup_upload.result()
+      logger.debug("CSV persisted to the snapshot store", extra={"sha256": fingerprint["sha256"]})
+      return iter_csv_chunks(raw_view, CSV_CHUNK_ROWS, tables), fingerprint
+
+    # Parse CSV into DataFrame via c engine
+    try:
+      with profiler.span("parse", {"ExportType": "csv"}) as parse_span:
+        csv = parse_csv(raw_view, tables)
+        parse_span.add_rows(csv.shape[0])
+    finally:
+      # the backup must not outlive the invocation, since lambda freezes the environment after returning
+      wait([backup_upload])
+    backup_upload.result()
+    logger.debug("CSV persisted to the snapshot store", extra={"sha256": fingerprint["sha256"]})
     logger.debug(f"Loaded CSV into memory with pandas pyarrow engine. Shape: {csv.shape}")
-    return csv
+    return csv, fingerprint
@@ -1,54 +1,156 @@
-import pandas as pd
-from io import BytesIO
-from timedelta_analysis import add_time_analysis_entry
-import requests # not in aws runtime
+from __future__ import annotations
+import datetime
+import operator
+from itertools import chain
+from concurrent.futures import wait
+from typing import TYPE_CHECKING
+from run_state import conditional_request_headers, fingerprint_response, is_unchanged
+from http_client import get_export
+from stream_ingest import MemoryViewReader, read_response_body
+from snapshot_store import start_snapshot_backup
+if TYPE_CHECKING:
+  import pandas as pd
+
+def _cell_to_str(value) -> str:
+  """
+  Renders a non-string cell value as pandas.read_excel(dtype=str) does with the calamine engine,
+  except for fractional numbers. These are rendered with a decimal comma, as the CSV export of the spreadsheet
+  renders them, so column_types parses numbers of both exports alike.
+  """
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  if isinstance(value, float):
+    # lossless, the repr of a float never contains a thousands separator
+    return str(value).replace(".", ",")
+  if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+    # pandas converts dates to midnight timestamps
+    return str(datetime.datetime.combine(value, datetime.time()))
+  return str(value)
+
+def _project_rows(rows, usecols: list[int]) -> list[tuple]:
+  # itemgetter returns a bare value instead of a tuple for a single column
+  project_row = operator.itemgetter(*usecols) if len(usecols) > 1 else lambda row: (row[usecols[0]],)
+  return [project_row(row) for row in rows]
+
+def _read_worksheet(worksheet, usecols: list[int]) -> pd.DataFrame:
+  """
+  Materializes the columns in usecols of a worksheet at their positions in the sheet, as in the CSV export.
+  calamine starts the rows of iter_rows at the first non-empty column and, depending on the application that
+  wrote the workbook, at the first non-empty row. Both offsets follow from the end of the used range,
+  so leading empty columns and rows are restored.
+  """
+  import numpy as np
+  import pandas as pd
+  if worksheet.start is None:
+    raise ValueError("[Finances] is empty")
+  end_row, end_col = worksheet.end
+  if end_col < max(usecols):
+    raise ValueError(f"[Finances] is {end_col + 1} columns wide, column {max(usecols)} expected")
+  rows = worksheet.iter_rows()
+  first_row = next(rows)
+  col_offset = end_col + 1 - len(first_row)
+  # columns left of the used range are empty
+  read_cols = [col for col in usecols if col >= col_offset]
+  columns = list(zip(*_project_rows(chain([first_row], rows), [col - col_offset for col in read_cols])))
+  row_offset = end_row + 1 - len(columns[0])
+  cells_by_col = dict(zip(read_cols, columns))
+  return pd.DataFrame({
+    col_label: np.array(
+      [""] * row_offset + [cell if type(cell) is str else _cell_to_str(cell) for cell in cells_by_col.get(col_label, ())],
+      dtype=object,
+    ) if col_label in cells_by_col else np.full(end_row + 1, "", dtype=object)
+    for col_label in usecols
+  })
+
+def _read_finances_sheet(raw_view: memoryview, usecols: list[int]) -> pd.DataFrame:
+  """
+  Decodes only the [Finances] worksheet of the workbook and materializes only the columns in usecols.
+  - calamine reads worksheets lazily, so the other tabs of the workbook are never decoded
+  - Rows are projected onto usecols while iterating, before any python objects are built for the other columns
+  - Empty cells become empty strings, all other cells are rendered as strings
+  """
+  from python_calamine import CalamineWorkbook, WorksheetNotFound
+  workbook = CalamineWorkbook.from_object(MemoryViewReader(raw_view))
+  # the workbook stays open until the rows are read
+  try:
+    try:
+      worksheet = workbook.get_sheet_by_name("Finances")
+    except WorksheetNotFound as e:
+      raise ValueError(f"Worksheet Finances not found: {e}")
+    return _read_worksheet(worksheet, usecols)
+  finally:
+    workbook.close()
+
+def parse_xlsx(raw_view: memoryview, tables: dict[str, dict] | None = None) -> pd.DataFrame:
+  """
+  Loads the [Finances] sheet of an XLSX export, see _read_finances_sheet.
+  tables selects a ddl_schema profile other than the default TABLES.
+  Raises RuntimeError if the worksheet or any of the columns used by ddl_schema is missing.
+  """
+  from ddl_schema import SHEET_USECOLS, sheet_usecols
+  # See https://github.com/dimastbk/python-calamine
+  try:
+    return _read_finances_sheet(raw_view, sheet_usecols(tables) if tables else SHEET_USECOLS)
+  except ValueError as e:
+    # raised for a missing worksheet as well as out-of-bounds usecols
+    raise RuntimeError(f"In memory workbook is missing [Finances] sheet or its expected columns: {e}")
 
 def download_xlsx(
-      start_time: int,
-      timestamp: str,
+      run_id: str,
       sheet_url: str,
       s3_bucket: str,
-      timedelta_analysis: list[str],
+      profiler,
       s3_client,
-      logger
-):
+      logger,
+      last_run: dict | None = None,
+      tables: dict[str, dict] | None = None,
+      state_prefix: str = ""
+) -> tuple[pd.DataFrame | None, dict]:
     """
-    Queries Google Sheets via HTTP Request to download sheet into memory.
-    - Persists sheet with timestamp to s3 into s3://fiscalismia-raw-data-etl-storage/tmp/
-    - Uses pandas with calamine engine for fast and efficient parsing
-    - Extracts and returns the [Finances] sheet from the workbook
+    Queries Google Sheets via pooled HTTP Request to download sheet into memory.
+    - Streams the response body into a single buffer shared by the parser and the s3 backup
+    - Persists sheet to the snapshot store while parsing, once per distinct content. See snapshot_store.py
+    - Uses calamine directly to decode only the [Finances] sheet and the columns used by ddl_schema
+    - Extracts and returns the [Finances] sheet from the workbook and the fingerprint of the downloaded content
+    - Returns None instead of a sheet if the content is unchanged since the last successful run
+    - tables selects the ddl_schema profile of the spreadsheet, by default TABLES
+    - state_prefix selects the snapshot catalog of a batch target, see snapshot_store.py
     """
     # Download the spreadsheet from google docs into memory
-    response = requests.get(sheet_url, stream=True, timeout=(3, 10)) # (3s connect timeout, 10s read timeout)
-    if response.status_code != 200:
-      raise RuntimeError(f"Failed to download the sheet. HTTP status: {response.status_code}")
-    add_time_analysis_entry(timedelta_analysis, start_time, "request XLSX via URL")
-
-    raw_bytes = response.content
-    s3_buffer = BytesIO(raw_bytes)
-    xlsx_buffer = BytesIO(raw_bytes)
-
-    # Persist raw bytes to S3 as timestamped backup
-    s3_key = f"tmp/{timestamp}-Fiscalismia-Datasource.xlsx"
-    add_time_analysis_entry(timedelta_analysis, start_time, "load sheet into memory temp file")
-    s3_client.upload_fileobj(s3_buffer, s3_bucket, s3_key)
-    logger.debug(f"XLSX persisted to s3://{s3_bucket}/{s3_key}")
-    add_time_analysis_entry(timedelta_analysis, start_time, "persist temp file to s3")
-
-    # Load all sheets into DataFrames via calamine engine
-    # See https://pandas.pydata.org/docs/reference/api/pandas.read_excel.html
-    # See https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.html
-    sheets: dict[str, pd.DataFrame] = pd.read_excel(
-        xlsx_buffer,
-        sheet_name=None,   # use None to read all sheets
-        engine="calamine", # fastest engine for xlsx reading
-        header=None,       # row to use as column headers
-        na_filter=False,   # skip NA detection for performance
-        dtype=str,         # use object to preserve raw cell values
-    )
-    add_time_analysis_entry(timedelta_analysis, start_time, "loaded workbook into memory")
-    logger.debug("Loaded sheet into memory with pandas and calamine engine.")
-    sheet_names = list(sheets.keys())
-    if 'Finances' not in sheet_names:
-      raise RuntimeError(f"In memory workbook is missing [Finances] sheet.")
-    return sheets.get('Finances')
+    # Conditional request headers let Google answer with 304 if the sheet is unchanged since the last run
+    with profiler.span("download", {"ExportType": "xlsx"}) as download_span:
+      request_headers = conditional_request_headers(last_run, "xlsx")
+      # pooled session with retries and optional hedging, see http_client.py
+      response, request_stats = get_export(sheet_url, request_headers)
+      download_span.add_counts(request_stats)
+      if response.status_code == 304:
+        response.close()
+        logger.info("Sheet not modified since last successful run according to HTTP validators")
+        return None, {key: last_run.get(key) for key in ("export_type", "sha256", "etag", "last_modified")}
+      if response.status_code != 200:
+        response.close()
+        raise RuntimeError(f"Failed to download the sheet. HTTP status: {response.status_code}")
+
+      raw_view = read_response_body(response)
+      download_span.add_bytes(len(raw_view))
+    with profiler.span("fingerprint"):
+      fingerprint = fingerprint_response(response, raw_view, "xlsx")
+    if is_unchanged(last_run, fingerprint):
+      logger.info("Sheet content hash matches last successful run", extra={"sha256": fingerprint["sha256"]})
+      return None, fingerprint
+
+    # Persist raw bytes to the snapshot store in the background while parsing
+    backup_upload = start_snapshot_backup(raw_view, fingerprint, run_id, s3_bucket, s3_client, profiler, state_prefix)
+
+    # Load the [Finances] sheet into a DataFrame via calamine
+    try:
+      with profiler.span("parse", {"ExportType": "xlsx"}) as parse_span:
+        sheet = parse_xlsx(raw_view, tables)
+        parse_span.add_rows(sheet.shape[0])
+    finally:
+      # the backup must not outlive the invocation, since lambda freezes the environment after returning
+      wait([backup_upload])
+    backup_upload.result()
+    logger.debug("XLSX persisted to the snapshot store", extra={"sha256": fingerprint["sha256"]})
+    logger.debug(f"Loaded [Finances] sheet into memory with calamine. Shape: {sheet.shape}")
+    return sheet, fingerprint
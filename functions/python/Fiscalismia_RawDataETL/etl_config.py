@@ -0,0 +1,70 @@
+import os
+from output_formats import parse_output_formats
+
+# Configuration of the RawDataETL function via lambda environment variables
+
+def _env_flag(name: str, default: bool = False) -> bool:
+  return os.environ.get(name, str(default)).strip().lower() in ("1", "true", "yes")
+
+# Concurrent TSV uploads per invocation. The s3 client connection pool is sized to fit them
+UPLOAD_CONCURRENCY = int(os.environ.get("ETL_UPLOAD_CONCURRENCY", "4"))
+
+# Snapshot based warm starts prime the function before the snapshot is taken in any case.
+# With this flag set, the init phase of on-demand and provisioned environments primes as well
+PRIME_ON_INIT = _env_flag("ETL_PRIME_ON_INIT")
+
+# Spreadsheet export downloaded per run: "csv", "xlsx" or "adaptive". See export_selection.py
+EXPORT_FORMAT = os.environ.get("ETL_EXPORT_FORMAT", "csv").strip().lower()
+if EXPORT_FORMAT not in ("csv", "xlsx", "adaptive"):
+  raise ValueError(f"Unknown ETL_EXPORT_FORMAT '{EXPORT_FORMAT}'. Supported: csv, xlsx, adaptive")
+
+# lambda_handler overlaps the secrets fetch with the creation of the s3 client, the last run lookup and the
+# import of the ETL modules on worker threads. See index.handle_request_async
+PIPELINED_STARTUP = _env_flag("ETL_PIPELINED_STARTUP")
+
+# Spreadsheets of a batch processed concurrently, sharing the HTTP and s3 connection pools. See batch.py
+BATCH_CONCURRENCY = max(int(os.environ.get("ETL_BATCH_CONCURRENCY", "2")), 1)
+
+# Attempts repeated by the export download after connection failures and 429/5xx responses. See http_client.py
+HTTP_MAX_RETRIES = int(os.environ.get("ETL_HTTP_MAX_RETRIES", "3"))
+# Percentile of recent export latencies after which a hedged second request is sent, e.g. 95. 0 disables hedging
+HTTP_HEDGE_PERCENTILE = float(os.environ.get("ETL_HTTP_HEDGE_PERCENTILE", "0"))
+if not 0 <= HTTP_HEDGE_PERCENTILE <= 100:
+  raise ValueError(f"ETL_HTTP_HEDGE_PERCENTILE must be between 0 and 100. Got {HTTP_HEDGE_PERCENTILE}")
+
+# Rows per chunk the CSV export is parsed and extracted in, holding a single chunk of raw strings in memory at a time.
+# 0 parses the whole export at once. XLSX exports are always parsed at once
+CSV_CHUNK_ROWS = int(os.environ.get("ETL_CSV_CHUNK_ROWS", "0"))
+
+# Emits inserted, updated and deleted rows of every table as delta TSV alongside the full snapshots
+INCREMENTAL_MODE = _env_flag("ETL_INCREMENTAL_MODE")
+
+# Publishes the rollups of aggregates.py alongside the tables. Off by default as computing them adds to the duration of every run
+AGGREGATES = _env_flag("ETL_AGGREGATES")
+
+# Tables serialized to at most this many bytes are returned compressed in the response body, and their s3 writes
+# are deferred until after the response. 0 returns presigned urls only. See inline_tables.py and post_response.py
+INLINE_MAX_BYTES = int(os.environ.get("ETL_INLINE_MAX_BYTES", "0"))
+
+# Serialization per table, e.g. "tsv.gz,fixed_costs=ndjson". See output_formats.OUTPUT_FORMATS
+OUTPUT_FORMATS = parse_output_formats(os.environ.get("ETL_OUTPUT_FORMATS", ""))
+
+# Peak memory recorded per span, "tracemalloc" or "rss". See instrumentation.MEMORY_TRACKING_MODES
+PROFILE_MEMORY = os.environ.get("ETL_PROFILE_MEMORY", "").strip().lower() or None
+
+# Concurrent invocations share the response of a single run, see coalescing.py. Responses of a successful
+# run are reused within this many seconds after it finished, hiding sheet edits made in the meantime.
+# 0 disables coalescing. The window has to stay well below the 300 seconds the presigned urls of a response are valid
+COALESCE_WINDOW_SECONDS = float(os.environ.get("ETL_COALESCE_WINDOW_SECONDS", "0"))
+if COALESCE_WINDOW_SECONDS >= 300:
+  raise ValueError(f"ETL_COALESCE_WINDOW_SECONDS must be below 300, the lifetime of presigned urls. Got {COALESCE_WINDOW_SECONDS}")
+# Claim of a running leader, taken over by the next invocation once expired. Should cover the function timeout
+RUN_LOCK_TTL_SECONDS = float(os.environ.get("ETL_RUN_LOCK_TTL_SECONDS", "120"))
+# API Gateway answers 504 once the integration takes longer than this
+API_GATEWAY_TIMEOUT_SECONDS = 29
+# Followers stop waiting for the leader after this many seconds and respond 503 with Retry-After instead
+COALESCE_MAX_WAIT_SECONDS = float(os.environ.get("ETL_COALESCE_MAX_WAIT_SECONDS", "20"))
+if not 0 < COALESCE_MAX_WAIT_SECONDS < API_GATEWAY_TIMEOUT_SECONDS:
+  raise ValueError(
+    f"ETL_COALESCE_MAX_WAIT_SECONDS must be between 0 and {API_GATEWAY_TIMEOUT_SECONDS}, the API Gateway timeout. Got {COALESCE_MAX_WAIT_SECONDS}"
+  )
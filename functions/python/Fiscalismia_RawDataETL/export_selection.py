@@ -0,0 +1,44 @@
+EXPORT_TYPES = ("csv", "xlsx")
+EXPORT_MODES = (*EXPORT_TYPES, "adaptive")
+# Weight of the latest run in the moving averages of the recorded export stats
+SMOOTHING = 0.3
+# In adaptive mode the slower export type is measured again after this many runs, so a change
+# in the relative cost of both exports is noticed. Such a run can not skip an unchanged sheet,
+# since the content hash of the other export type differs from the recorded one
+REMEASURE_INTERVAL = 20
+
+def choose_export_type(mode: str, last_run: dict | None) -> str:
+  """
+  Picks the export type of this run.
+  - csv or xlsx: fixed export type
+  - adaptive: the export type with the lower recorded download and parse time,
+    measuring an export type first if it has no stats or its stats are outdated
+  """
+  if mode in EXPORT_TYPES:
+    return mode
+  export_stats = (last_run or {}).get("export_stats", {})
+  run_count = export_stats.get("run_count", 0)
+  if not export_stats:
+    return EXPORT_TYPES[0]
+  for export_type in EXPORT_TYPES:
+    stats = export_stats.get(export_type, None)
+    if stats is None or run_count - stats["last_measured_run"] >= REMEASURE_INTERVAL:
+      return export_type
+  return min(EXPORT_TYPES, key=lambda export_type: export_stats[export_type]["download_ms"] + export_stats[export_type]["parse_ms"])
+
+def record_export_stats(last_run: dict | None, export_type: str, measurements: dict[str, float]) -> dict:
+  """
+  Folds the download and parse time and the payload size of this run into the moving averages
+  recorded with the last successful run. Returns the updated stats, persisted by save_last_run.
+  """
+  export_stats = dict((last_run or {}).get("export_stats", {}))
+  run_count = export_stats.get("run_count", 0) + 1
+  previous = export_stats.get(export_type, None)
+  stats = {}
+  for name, value in measurements.items():
+    previous_value = value if previous is None else previous.get(name, value)
+    stats[name] = round(SMOOTHING * value + (1 - SMOOTHING) * previous_value, 3)
+  stats["last_measured_run"] = run_count
+  export_stats[export_type] = stats
+  export_stats["run_count"] = run_count
+  return export_stats
@@ -1,17 +1,33 @@
 import json
 import pandas as pd
+from collections.abc import Iterator
+from itertools import chain
 from io import BytesIO
-from timedelta_analysis import add_time_analysis_entry
+from concurrent.futures import ThreadPoolExecutor, wait
+from instrumentation import Profiler
+from etl_config import UPLOAD_CONCURRENCY
+from run_state import generate_presigned_urls, aggregate_presigned_urls
+from column_types import apply_column_types, merge_validation_report, concat_typed_chunks
+from output_formats import serialize_table, DEFAULT_OUTPUT_FORMAT
+from table_manifest import manifest_entry, build_manifest, put_manifest, AGGREGATES_S3_PREFIX, INDEXES_S3_PREFIX
+from inline_tables import InlineBudget
+from aggregates import compute_aggregates
+from positions import update_positions, load_positions_state, save_positions_state
+from interval_index import INTERVAL_TABLES, build_interval_index
+from row_delta import compute_row_index, compute_row_delta, load_row_index, save_row_index
 from ddl_schema import (
   HEADER_ROW,
   DATA_START_ROW,
-  TABLE_VAR_EXPENSES,
-  TABLE_FIXED_COSTS,
-  TABLE_INVESTMENTS,
-  TABLE_INCOME,
-  TABLE_NEW_FOOD_ITEMS,
+  TABLES,
+  SHEET_USECOLS,
+  sheet_usecols,
+  pruned_table_def,
 )
 
+# Bounded pool for TSV uploads. Lives across warm invocations and shares the
+# connection pool of the s3 client, which is sized to fit it
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="tsv-upload")
+
 def _extract_trivial_table(sheet: pd.DataFrame, table_def: dict) -> pd.DataFrame:
   """
   - Extract a subtable slice using iloc.
@@ -19,20 +35,23 @@ def _extract_trivial_table(sheet: pd.DataFrame, table_def: dict) -> pd.DataFrame
   - strips all values of extra whitespace
   Rows whose first column value appears in skip_markers are dropped.
   """
-  col_slice = table_def["col_slice"]
+  # Slices the sheet into its subtable range
+  return _extract_trivial_rows(sheet.iloc[DATA_START_ROW:, table_def["col_slice"]].copy(), table_def)
+
+def _extract_trivial_rows(raw_data: pd.DataFrame, table_def: dict) -> pd.DataFrame:
+  """
+  Extracts the table rows from the data rows of its subtable range, see _extract_trivial_table.
+  """
   skip_markers = table_def.get("skip_markers", None)
 
-  # Slices the sheet into its subtable range
-  data_frame = sheet.iloc[DATA_START_ROW:, col_slice].copy()
   # Drops all empty rows from dataframe
-  data_frame = data_frame.dropna(how="all")
+  data_frame = raw_data.dropna(how="all")
 
   # Get all rows (:) from FIRST column (0) and perform vectorized strip operation
   first_col = data_frame.iloc[:, 0].astype(str).str.strip()
-  # Drops any rows whose first column is marked to be skipped
-  data_frame = data_frame[~first_col.isin(skip_markers)]
-  # Drops any rows that are null, empty
-  data_frame = data_frame[first_col.notna() & (first_col != "")]
+  # Drops any rows whose first column is marked to be skipped, null or empty.
+  # A single mask keeps its index aligned with the rows it filters
+  data_frame = data_frame[~first_col.isin(skip_markers) & first_col.notna() & (first_col != "")]
 
   data_frame.columns = table_def["col_names"]
   return data_frame.reset_index(drop=True)
@@ -43,120 +62,418 @@ def _extract_multisection_table(sheet: pd.DataFrame, table_def: dict, logger) ->
   The parsed date range is broadcast to every following data row as
   effective_date / expiration_date until the next Date row is encountered.
   """
+  # Slices the sheet into its subtable range
+  data_frame, _ = _extract_multisection_rows(sheet.iloc[DATA_START_ROW:, table_def["col_slice"]], table_def, logger)
+  return data_frame
+
+def _extract_multisection_rows(
+  raw_data: pd.DataFrame,
+  table_def: dict,
+  logger,
+  open_section: dict | None = None
+) -> tuple[pd.DataFrame, dict | None]:
+  """
+  Extracts the table rows from consecutive data rows of its subtable range, see _extract_multisection_table.
+  open_section holds the date range of the section still open at the end of the preceding rows,
+  broadcast onto the rows above the first Date row.
+  Returns the table rows and the date range of the section open at their end.
+  """
   col_slice = table_def["col_slice"]
   skip_markers = table_def.get("skip_markers", None)
   date_marker = table_def["date_marker"]
   date_col_offset = table_def["date_value_col_offset"]
 
-  # Slices the sheet into its subtable range
-  raw_data = sheet.iloc[DATA_START_ROW:, col_slice].copy()
   # Drops all empty rows from dataframe
   raw_data = raw_data.dropna(how="all")
   # resets indices to 0 and drops stale references to any dropped rows
   raw_data = raw_data.reset_index(drop=True)
 
-  records = []
-  current_effective = None
-  current_expiration = None
+  # Get all rows (:) from FIRST column (0) and perform vectorized strip operation
+  # missing values are rendered as "nan" to be dropped alongside empty strings
+  first_col = raw_data.iloc[:, 0].astype(str).fillna("nan").str.strip()
+  is_date_row = first_col == date_marker
+  # Every Date row opens a new section. Rows above the first Date row belong to section 0,
+  # which continues open_section and has no date range at the top of the sheet
+  section_ids = is_date_row.cumsum()
 
-  # INFO: itertuples might be a more performant operation https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.itertuples.html#pandas.DataFrame.itertuples
-  for _, row in raw_data.iterrows():
-    first_val = str(row.iloc[0]).strip()
+  # Split "DD.MM.YYYY - DD.MM.YYYY" from the adjacent column of all Date rows at once
+  date_strings = raw_data.loc[is_date_row].iloc[:, date_col_offset].astype(str).fillna("nan").str.strip()
+  # Whitespace around the first dash is consumed by the separator. A missing second part becomes NaN
+  date_parts = date_strings.str.split(r"\s*-\s*", n=1, expand=True, regex=True).reindex(columns=[0, 1])
+  effective_col, expiration_col = table_def["derived_col_names"]
+  section_dates = pd.DataFrame({
+    effective_col: date_parts[0].to_numpy(dtype=object),
+    expiration_col: date_parts[1].to_numpy(dtype=object),
+  }, index=section_ids[is_date_row].to_numpy())
+  for effective, expiration in zip(section_dates[effective_col], section_dates[expiration_col]):
+    logger.debug(f"Date String in col slice {col_slice} with effective {effective} and expiration {expiration}")
+  if open_section is not None:
+    section_dates = pd.concat([pd.DataFrame(open_section, index=[0], dtype=object), section_dates])
 
-    if first_val == date_marker:
-      # Parse "DD.MM.YYYY - DD.MM.YYYY" from the adjacent column
-      date_string = str(row.iloc[date_col_offset]).strip()
-      parts = [p.strip() for p in date_string.split("-", 1)]
-      current_effective = parts[0] if len(parts) > 0 else None
-      current_expiration = parts[1] if len(parts) > 1 else None
-      logger.debug(f"Date String in col slice {col_slice} with effective {current_effective} and expiration {current_expiration}")
-      continue
+  # Drops Date rows, rows whose first column is marked to be skipped and empty rows
+  is_data_row = ~is_date_row & ~first_col.isin(skip_markers) & ~first_col.isin({"", "nan"})
+  data_frame = raw_data.loc[is_data_row]
+  data_sections = section_ids[is_data_row]
 
-    if first_val in skip_markers or first_val in {"", "nan"}:
-      continue
+  # Broadcast the date range of each section onto its data rows
+  columns = {
+    col_name: data_frame.iloc[:, i].to_numpy(dtype=object)
+    for i, col_name in enumerate(table_def["col_names"])
+  }
+  for derived_col in (effective_col, expiration_col):
+    # copied, as pandas returns a read-only view of an all-NaN column, e.g. when no Date row has an expiration
+    derived_values = data_sections.map(section_dates[derived_col]).to_numpy(dtype=object, copy=True)
+    derived_values[pd.isna(derived_values)] = None
+    columns[derived_col] = derived_values
 
-    record = row.tolist() + [current_effective, current_expiration]
-    records.append(record)
+  open_section = section_dates.iloc[-1].to_dict() if len(section_dates) else None
+  return pd.DataFrame(columns), open_section
 
-  output_cols = table_def["col_names"] + table_def.get("derived_col_names", [])
-  return pd.DataFrame(records, columns=output_cols)
+def _iter_tables_from_chunks(
+  chunks: Iterator[pd.DataFrame],
+  table_defs: dict[str, dict],
+  multisection_table: dict[str, dict],
+  logger,
+  validation_report: dict,
+  profiler: Profiler
+) -> Iterator[tuple[str, pd.DataFrame]]:
+  """
+  Extracts and types the tables chunk by chunk from a sheet parsed in chunks, see download_csv.iter_csv_chunks.
+  The rows of every chunk are routed to per table accumulators of typed rows, so only a single chunk of raw
+  strings is held in memory. The date range of the section open at the end of a chunk carries over to the next.
+  Yields (table name, table) once the last chunk has been extracted.
+  """
+  typed_chunks = {name: [] for name in table_defs}
+  row_counts = dict.fromkeys(table_defs, 0)
+  open_sections = dict.fromkeys(multisection_table)
+  chunk_count = 0
+  while True:
+    with profiler.span("parse", {"ExportType": "csv"}) as parse_span:
+      chunk = next(chunks, None)
+      if chunk is not None:
+        parse_span.add_rows(len(chunk))
+    if chunk is None:
+      break
+    chunk_count += 1
+    # chunks are labeled with their sheet rows
+    data_rows = chunk.loc[chunk.index >= DATA_START_ROW]
+    with profiler.span("extract_chunk") as extract_span:
+      for name, table_def in table_defs.items():
+        raw_data = data_rows.iloc[:, table_def["col_slice"]]
+        if name in multisection_table:
+          df, open_sections[name] = _extract_multisection_rows(raw_data, table_def, logger, open_sections[name])
+        else:
+          df = _extract_trivial_rows(raw_data, table_def)
+        # rows are numbered across chunks, as rows of the validation report
+        df.index = pd.RangeIndex(row_counts[name], row_counts[name] + len(df))
+        chunk_report = {}
+        df = apply_column_types(df, table_def, name, chunk_report)
+        merge_validation_report(validation_report, chunk_report)
+        if len(df) or not typed_chunks[name]:
+          typed_chunks[name].append(df)
+        row_counts[name] += len(df)
+        extract_span.add_rows(len(df))
+    del chunk, data_rows
+  logger.debug(f"Extracted tables from {chunk_count} chunks", extra={"rows": row_counts})
 
+  for name in table_defs:
+    with profiler.span("concat", {"Table": name}) as concat_span:
+      df = concat_typed_chunks(typed_chunks.pop(name), table_defs[name])
+      concat_span.add_rows(len(df))
+    yield name, df
 
-def load_tables_from_sheet(sheet: pd.DataFrame, logger) -> dict[str, pd.DataFrame]:
+def iter_tables_from_sheet(
+  sheet: pd.DataFrame | Iterator[pd.DataFrame],
+  logger,
+  validation_report: dict | None = None,
+  profiler: Profiler | None = None,
+  tables: dict[str, dict] | None = None
+) -> Iterator[tuple[str, pd.DataFrame]]:
   """
   Extract all five Finance tables from the raw sheet using iloc-based column
-  slices defined in ddl_schema.py.
+  slices defined in ddl_schema.py, or in the ddl_schema profile given as tables.
+  Columns are converted to the col_types declared in ddl_schema.py. Values failing
+  conversion become missing and are collected per table and column into validation_report.
+  Extraction and typing of every table are recorded as spans of profiler, if given.
+
+  Yields (table name, table) as soon as each table is extracted and typed, so consumers
+  can serialize and upload a table while the next one is being extracted.
+  A sheet parsed in chunks is extracted chunk by chunk instead, yielding all tables after the last chunk.
+  """
+  tables = tables or TABLES
+  # Multi-section tables are marked by the "Date:" rows of their sections
+  trivial_table = {name: table_def for name, table_def in tables.items() if "date_marker" not in table_def}
+  multisection_table = {name: table_def for name, table_def in tables.items() if "date_marker" in table_def}
+
+  # Sheets parsed with usecols=SHEET_USECOLS keep their source column labels,
+  # but iloc positions shift. Remap col_slice offsets onto the pruned sheet
+  usecols = SHEET_USECOLS if tables is TABLES else sheet_usecols(tables)
+  is_chunked = not isinstance(sheet, pd.DataFrame)
+  # chunks are always parsed with usecols=SHEET_USECOLS, see download_csv.iter_csv_chunks
+  is_pruned = is_chunked or list(sheet.columns) == usecols
+  if is_pruned:
+    trivial_table = {name: pruned_table_def(table_def, usecols) for name, table_def in trivial_table.items()}
+    multisection_table = {name: pruned_table_def(table_def, usecols) for name, table_def in multisection_table.items()}
+
+  profiler = profiler or Profiler("Fiscalismia_RawDataETL")
+  validation_report = {} if validation_report is None else validation_report
+  if is_chunked:
+    yield from _iter_tables_from_chunks(
+      iter(sheet), {**trivial_table, **multisection_table}, multisection_table, logger, validation_report, profiler
+    )
+    if validation_report:
+      logger.warning("Column type conversion failures in Finance sheet", extra={"validation_report": validation_report})
+    return
+  for name, table_def in {**trivial_table, **multisection_table}.items():
+    with profiler.span("extract", {"Table": name}) as extract_span:
+      if name in multisection_table:
+        df = _extract_multisection_table(sheet, table_def, logger)
+      else:
+        df = _extract_trivial_table(sheet, table_def)
+      extract_span.add_rows(len(df))
+    with profiler.span("typing", {"Table": name}):
+      df = apply_column_types(df, table_def, name, validation_report)
+    yield name, df
+  if validation_report:
+    logger.warning("Column type conversion failures in Finance sheet", extra={"validation_report": validation_report})
+
+def load_tables_from_sheet(
+  sheet: pd.DataFrame | Iterator[pd.DataFrame],
+  logger,
+  validation_report: dict | None = None,
+  profiler: Profiler | None = None,
+  tables: dict[str, dict] | None = None
+) -> dict[str, pd.DataFrame]:
+  """
+  Extracts and types all tables at once, see iter_tables_from_sheet.
 
   Returns a dict keyed by table name:
-    "variable_expenses", "fixed_costs", "investments", "income", "food_items"
+    "variable_expenses", "investments", "food_items", "fixed_costs", "income"
   """
-  trivial_table = {
-    "variable_expenses": TABLE_VAR_EXPENSES,
-    "investments":       TABLE_INVESTMENTS,
-    "food_items":        TABLE_NEW_FOOD_ITEMS,
-  }
-  multisection_table = {
-    "fixed_costs": TABLE_FIXED_COSTS,
-    "income":      TABLE_INCOME,
-  }
+  return dict(iter_tables_from_sheet(sheet, logger, validation_report, profiler, tables))
 
-  result = {}
-  for name, table_def in trivial_table.items():
-    result[name] = _extract_trivial_table(sheet, table_def)
+def _upload_table(s3_buffer: BytesIO, extra_args: dict, s3_bucket: str, s3_key: str, s3_client, profiler: Profiler, span_args: dict):
+  """
+  Uploads a serialized table to s3 within an upload span, running on a worker thread.
+  """
+  with profiler.span("upload", **span_args) as upload_span:
+    upload_span.add_bytes(s3_buffer.getbuffer().nbytes)
+    s3_client.upload_fileobj(s3_buffer, s3_bucket, s3_key, ExtraArgs=extra_args)
 
-  for name, table_def in multisection_table.items():
-    result[name] = _extract_multisection_table(sheet, table_def, logger)
+def _load_row_index(s3_bucket: str, s3_client, logger, profiler: Profiler, parent_span, state_prefix: str) -> dict:
+  """
+  Loads the row index of the previous snapshot within a span, running on a worker thread.
+  """
+  with profiler.span("load_row_index", parent=parent_span):
+    return load_row_index(s3_bucket, s3_client, logger, state_prefix)
 
-  return result
+def _load_positions_state(s3_bucket: str, s3_client, logger, profiler: Profiler, parent_span, state_prefix: str) -> dict | None:
+  """
+  Loads the state of the last position update within a span, running on a worker thread.
+  """
+  with profiler.span("load_positions_state", parent=parent_span):
+    return load_positions_state(s3_bucket, s3_client, logger, state_prefix)
+
+def _compute_positions(investments: pd.DataFrame, previous_state_future, positions_state: dict, profiler: Profiler):
+  """
+  Yields the investment positions as aggregate, see positions.py.
+  The state for the next incremental update is stored under positions_state["state"].
+  """
+  with profiler.span("positions") as positions_span:
+    previous_state = previous_state_future.result() if previous_state_future else None
+    positions, ledger, positions_state["state"] = update_positions(investments, previous_state)
+    positions_span.add_rows(len(ledger))
+  yield "investment_positions", positions
 
 def extract_and_transform_to_tsv(
-  start_time: int,
-  timestamp: str,
+  run_id: str,
   sheet,
   s3_bucket: str,
-  timedelta_analysis: list[str],
+  profiler: Profiler,
   s3_client,
-  logger
-) -> list[str]:
+  logger,
+  incremental: bool = False,
+  output_formats: dict[str, str] | None = None,
+  aggregates: bool = False,
+  table_defs: dict[str, dict] | None = None,
+  state_prefix: str = "",
+  inline_max_bytes: int = 0
+) -> dict[str, list[str]]:
   """
   Extracts subtable ranges from main finance sheet, serializing each
   as a TSV file, uploads them to the specified S3 bucket under the
-  ``transformed/`` prefix, and returns short-lived presigned URLs.
+  ``transformed/`` prefix under content addressed keys, and returns
+  short-lived presigned URLs alongside the manifest of the run.
+  output_formats selects a serialization per table other than plain TSV,
+  see output_formats.parse_output_formats.
+  In incremental mode a delta TSV of the rows inserted, updated and deleted
+  since the previous snapshot is uploaded alongside each table.
+  With aggregates the rollups of aggregates.py and the investment positions
+  of positions.py are published as separate outputs in the default output format.
+  In incremental mode the positions only replay the investments added since the previous run.
+  The interval indexes of the validity periods of fixed_costs and income
+  are published as JSON, see interval_index.py.
+  In batch mode table_defs selects the ddl_schema profile of the spreadsheet and
+  state_prefix namespaces the state of incremental mode, see batch.py.
+  Tables serialized to at most inline_max_bytes are returned inline, see inline_tables.py.
+  Their uploads, the manifest and the state of incremental mode are then persisted by the
+  returned persist function, which the caller defers until after the response.
 
   Returns:
-      A list of presigned S3 URLs (one per extracted table)
-  """
-  row_count = sheet.shape[0]
-  col_count = int(sheet.shape[1])
-  debug_output = json.dumps(
-  {
-    "size": f"{sheet.size} bytes",
-    "rows": row_count,
-    "columns": col_count,
-    "header": sheet.iloc[HEADER_ROW, :].to_dict(),
-    "tail": sheet.tail(1).astype(str).to_dict(orient="records"),
-  })
-  logger.debug("Running sanity check on Finance sheet", extra={"sanity_check": debug_output})
-
-  tables = load_tables_from_sheet(sheet, logger)
-  s3_presigned_urls: list[str] = []
-  for table_name, df in tables.items():
-    file_name = f"{timestamp}-{table_name}.tsv"
-    s3_key = f"transformed/{file_name}"
-    logger.debug(f"Extracted table '{table_name}'", extra={"shape": str(df.shape)})
-    s3_buffer = BytesIO(df.to_csv(sep="\t", index=False).encode("utf-8"))
-    s3_client.upload_fileobj(s3_buffer, s3_bucket, s3_key)
-    s3_object_uri = f"{s3_bucket}/{s3_key}"
-    logger.debug(f"TSV persisted to s3://{s3_object_uri}")
-    url = s3_client.generate_presigned_url(
-      ClientMethod='get_object',
-      Params={
-          'Bucket': s3_bucket,
-          'Key': s3_key
-      },
-      ExpiresIn=300
+      A dict with presigned S3 URLs and S3 keys (one per extracted table), the manifest
+      of the run with row count, size, hash and schema version per table,
+      the validation report of column type conversion failures
+      and in incremental mode the presigned S3 URLs of the delta TSVs
+      and with aggregates the presigned S3 URLs keyed by aggregate name
+      and with inlined tables their payloads keyed by table name and the persist function
+  """
+  # a sheet parsed in chunks is only materialized one chunk at a time during extraction
+  if isinstance(sheet, pd.DataFrame):
+    row_count = sheet.shape[0]
+    col_count = int(sheet.shape[1])
+    debug_output = json.dumps(
+    {
+      "size": f"{sheet.size} bytes",
+      "rows": row_count,
+      "columns": col_count,
+      "header": sheet.iloc[HEADER_ROW, :].to_dict(),
+      "tail": sheet.tail(1).astype(str).to_dict(orient="records"),
+    })
+    logger.debug("Running sanity check on Finance sheet", extra={"sanity_check": debug_output})
+
+  validation_report = {}
+  if incremental:
+    # the previous row index is fetched while the first table is extracted
+    previous_row_index_future = upload_executor.submit(
+      _load_row_index, s3_bucket, s3_client, logger, profiler, profiler.current_span(), state_prefix
+    )
+    row_index = {}
+  previous_positions_state_future = None
+  positions_state = {}
+  if incremental and aggregates:
+    previous_positions_state_future = upload_executor.submit(
+      _load_positions_state, s3_bucket, s3_client, logger, profiler, profiler.current_span(), state_prefix
     )
-    s3_presigned_urls.append(url)
 
-  add_time_analysis_entry(timedelta_analysis, start_time, "finalized TSV extraction from Finance sheet")
-  return s3_presigned_urls
+  s3_keys: list[str] = []
+  manifest_tables: list[dict] = []
+  manifest_aggregates: list[dict] = []
+  manifest_indexes: list[dict] = []
+  tables = {}
+  interval_indexes = {}
+  delta_s3_keys: list[str] = []
+  uploads = {}
+  inline_uploads = {}
+  inline_budget = InlineBudget(inline_max_bytes)
+  # Each table is uploaded as soon as it is extracted, overlapping the extraction of the next one
+  output_formats = output_formats or {}
+  try:
+    for table_name, df in iter_tables_from_sheet(sheet, logger, validation_report, profiler, table_defs):
+      output_format = output_formats.get(table_name, output_formats.get("default", DEFAULT_OUTPUT_FORMAT))
+      logger.debug(f"Extracted table '{table_name}'", extra={"shape": str(df.shape), "output_format": output_format})
+      span_args = {"dimensions": {"Table": table_name}, "parent": profiler.current_span()}
+      with profiler.span("serialize", {"Table": table_name}) as serialize_span:
+        s3_buffer, extra_args = serialize_table(df, output_format)
+        serialize_span.add_bytes(s3_buffer.getbuffer().nbytes)
+        serialize_span.add_rows(len(df))
+        table_entry = manifest_entry(table_name, len(df), s3_buffer, output_format)
+      s3_key = table_entry["s3_key"]
+      manifest_tables.append(table_entry)
+      inlined = inline_budget.add(table_entry, s3_buffer.getbuffer())
+      upload = upload_executor.submit(_upload_table, s3_buffer, extra_args, s3_bucket, s3_key, s3_client, profiler, span_args)
+      if inlined:
+        inline_uploads[s3_key] = upload
+      else:
+        uploads[s3_key] = upload
+      s3_keys.append(s3_key)
+      tables[table_name] = df
+
+      if table_name in INTERVAL_TABLES:
+        with profiler.span("interval_index", {"Table": table_name}) as index_span:
+          interval_indexes[table_name] = build_interval_index(df)
+          s3_buffer = BytesIO(json.dumps(interval_indexes[table_name].to_dict()).encode("utf-8"))
+          index_span.add_bytes(s3_buffer.getbuffer().nbytes)
+          index_entry = manifest_entry(table_name, len(df), s3_buffer, "json", INDEXES_S3_PREFIX)
+        manifest_indexes.append(index_entry)
+        uploads[index_entry["s3_key"]] = upload_executor.submit(
+          _upload_table, s3_buffer, {"ContentType": "application/json"}, s3_bucket, index_entry["s3_key"], s3_client, profiler, span_args
+        )
+
+      if incremental:
+        with profiler.span("delta", {"Table": table_name}) as delta_span:
+          row_keys, row_hashes = compute_row_index(df, (table_defs or TABLES)[table_name]["key_col_names"])
+          empty_index = (row_keys[:0], row_hashes[:0])
+          previous_keys, previous_hashes = previous_row_index_future.result().get(table_name, empty_index)
+          delta = compute_row_delta(df, row_keys, row_hashes, previous_keys, previous_hashes)
+          row_index[table_name] = (row_keys, row_hashes)
+          delta_s3_key = f"transformed/{run_id}-{table_name}-delta.{output_format}"
+          s3_buffer, extra_args = serialize_table(delta, output_format)
+          delta_span.add_rows(len(delta))
+          delta_span.add_bytes(s3_buffer.getbuffer().nbytes)
+        logger.debug(f"Computed row delta of '{table_name}'", extra={"changes": delta["change_type"].value_counts().to_dict()})
+        uploads[delta_s3_key] = upload_executor.submit(_upload_table, s3_buffer, extra_args, s3_bucket, delta_s3_key, s3_client, profiler, span_args)
+        delta_s3_keys.append(delta_s3_key)
+
+    if aggregates:
+      # computed while the uploads of the tables are in flight
+      output_format = output_formats.get("default", DEFAULT_OUTPUT_FORMAT)
+      for aggregate_name, df in chain(
+        compute_aggregates(tables, profiler, interval_indexes),
+        _compute_positions(tables["investments"], previous_positions_state_future, positions_state, profiler),
+      ):
+        span_args = {"dimensions": {"Aggregate": aggregate_name}, "parent": profiler.current_span()}
+        with profiler.span("serialize", {"Aggregate": aggregate_name}) as serialize_span:
+          s3_buffer, extra_args = serialize_table(df, output_format)
+          serialize_span.add_bytes(s3_buffer.getbuffer().nbytes)
+          serialize_span.add_rows(len(df))
+          aggregate_entry = manifest_entry(aggregate_name, len(df), s3_buffer, output_format, AGGREGATES_S3_PREFIX)
+        manifest_aggregates.append(aggregate_entry)
+        uploads[aggregate_entry["s3_key"]] = upload_executor.submit(
+          _upload_table, s3_buffer, extra_args, s3_bucket, aggregate_entry["s3_key"], s3_client, profiler, span_args
+        )
+  except Exception:
+    # uploads already in flight must not outlive an invocation failing during extraction
+    wait([*uploads.values(), *inline_uploads.values()])
+    raise
+
+  # Waits for every upload before surfacing the first failure, so none outlives the invocation
+  wait(uploads.values())
+  for s3_key, upload in uploads.items():
+    upload.result()
+    logger.debug(f"Table persisted to s3://{s3_bucket}/{s3_key}")
+
+  manifest = build_manifest(run_id, manifest_tables, manifest_aggregates if aggregates else None, manifest_indexes)
+  result = {
+    "presigned_urls": generate_presigned_urls(s3_keys, s3_bucket, s3_client),
+    "s3_keys": s3_keys,
+    "manifest": manifest,
+    "validation_report": validation_report,
+  }
+  if incremental:
+    result["delta_presigned_urls"] = generate_presigned_urls(delta_s3_keys, s3_bucket, s3_client)
+  if aggregates:
+    result["aggregate_presigned_urls"] = aggregate_presigned_urls(manifest, s3_bucket, s3_client)
+
+  def persist():
+    wait(inline_uploads.values())
+    for s3_key, upload in inline_uploads.items():
+      upload.result()
+      logger.debug(f"Inlined table persisted to s3://{s3_bucket}/{s3_key}")
+    # the manifest only lists tables that are persisted
+    with profiler.span("save_manifest"):
+      put_manifest(manifest, s3_bucket, s3_client, logger)
+    if incremental:
+      # The index only advances once all deltas against it are persisted
+      with profiler.span("save_row_index"):
+        save_row_index(row_index, s3_bucket, s3_client, logger, state_prefix)
+    if incremental and aggregates:
+      # like the row index, the positions state only advances once the positions computed from it are persisted
+      with profiler.span("save_positions_state"):
+        save_positions_state(positions_state["state"], s3_bucket, s3_client, logger, state_prefix)
+
+  if inline_budget.payloads:
+    result["inline_tables"] = inline_budget.payloads
+    result["persist"] = persist
+  else:
+    persist()
+  return result
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import requests # not in aws runtime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from etl_config import HTTP_MAX_RETRIES, HTTP_HEDGE_PERCENTILE, BATCH_CONCURRENCY
+
+# HTTP client of the spreadsheet export downloads.
+# The session and its keep-alive connections live across warm invocations, so consecutive runs skip DNS,
+# TCP and TLS setup. Google answers export requests with a redirect to a second host, both are pooled.
+# - 429 and 5xx responses as well as connection failures are retried with jittered exponential backoff
+# - With HTTP_HEDGE_PERCENTILE set, a second request is sent once the first one takes longer than that
+#   percentile of the recent time to response headers. The response arriving first is used
+CONNECT_TIMEOUT_SECONDS = 3
+READ_TIMEOUT_SECONDS = 10
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Time to response headers of the most recent requests, the basis of the hedging delay
+LATENCY_WINDOW = 50
+# Hedging starts once this many latencies of the warm environment are known
+MIN_LATENCY_SAMPLES = 5
+
+def _create_adapter() -> HTTPAdapter:
+  retry = Retry(
+    total=HTTP_MAX_RETRIES,
+    backoff_factor=0.5,              # 0.5s, 1s, 2s, ... between attempts
+    backoff_jitter=0.5,              # plus up to 0.5s at random, so concurrent invocations spread out
+    backoff_max=8,
+    status_forcelist=RETRY_STATUS_CODES,
+    allowed_methods=frozenset({"GET"}),
+    respect_retry_after_header=True, # Retry-After of 429 and 503 responses takes precedence over the backoff
+    raise_on_status=False,           # the last response is returned once retries are exhausted
+  )
+  # a connection for the original and the hedged request of every concurrent spreadsheet of a batch,
+  # to each of the export and redirect hosts
+  return HTTPAdapter(pool_connections=4, pool_maxsize=2 * BATCH_CONCURRENCY, max_retries=retry)
+
+adapter = _create_adapter()
+session = requests.Session()
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+session.headers["Accept-Encoding"] = "gzip"
+# Lives across warm invocations, runs the original and the hedged request of every concurrent spreadsheet
+hedge_executor = ThreadPoolExecutor(max_workers=2 * BATCH_CONCURRENCY, thread_name_prefix="http-hedge")
+_latencies = deque(maxlen=LATENCY_WINDOW)
+_latencies_lock = threading.Lock()
+
+def _connection_stats() -> tuple[int, int]:
+  """
+  Returns the requests sent and connections opened over the lifetime of the pooled connections.
+  """
+  requests_sent = connections = 0
+  pools = adapter.poolmanager.pools
+  for pool_key in pools.keys():
+    pool = pools.get(pool_key)
+    if pool is not None:
+      requests_sent += pool.num_requests
+      connections += pool.num_connections
+  return requests_sent, connections
+
+def hedge_delay() -> float | None:
+  """
+  Seconds after which a hedged request is sent. None while hedging is disabled or too few latencies are known.
+  """
+  with _latencies_lock:
+    latencies = sorted(_latencies)
+  if not HTTP_HEDGE_PERCENTILE or len(latencies) < MIN_LATENCY_SAMPLES:
+    return None
+  return latencies[min(int(len(latencies) * HTTP_HEDGE_PERCENTILE / 100), len(latencies) - 1)]
+
+def _get(url: str, headers: dict) -> requests.Response:
+  start = time.perf_counter()
+  response = session.get(url, stream=True, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS), headers=headers)
+  # backoff of retried requests would inflate the hedging delay
+  if response.raw.retries is None or not response.raw.retries.history:
+    with _latencies_lock:
+      _latencies.append(time.perf_counter() - start)
+  return response
+
+def _close_response(request: Future):
+  if request.exception() is None:
+    request.result().close()
+
+def _get_hedged(url: str, headers: dict, delay: float) -> tuple[requests.Response, bool]:
+  """
+  Sends a second request if the first has no response after delay seconds.
+  Returns the first successful response and whether a hedged request was sent.
+  The other request is closed once it completes, releasing its connection to the pool.
+  """
+  first = hedge_executor.submit(_get, url, headers)
+  done, _ = wait([first], timeout=delay)
+  if done:
+    return first.result(), False
+  pending = {first, hedge_executor.submit(_get, url, headers)}
+  while True:
+    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    succeeded = [request for request in done if request.exception() is None]
+    if succeeded or not pending:
+      break
+  # raises the error of a request if both failed
+  response = succeeded[0].result() if succeeded else done.pop().result()
+  for request in [*done, *pending]:
+    if request not in succeeded[:1]:
+      request.add_done_callback(_close_response)
+  return response, True
+
+def get_export(url: str, headers: dict) -> tuple[requests.Response, dict[str, int]]:
+  """
+  GETs a spreadsheet export as streamed response over the pooled session.
+  Returns the response and counters of the request, recorded on the download span:
+  - connections_new and connections_reused: connections opened for and reused by the request and its retries
+  - retries: requests repeated after a failure or 429/5xx response
+  - hedged: 1 if a hedged request was sent
+  """
+  requests_before, connections_before = _connection_stats()
+  delay = hedge_delay()
+  if delay is None:
+    response, hedged = _get(url, headers), False
+  else:
+    response, hedged = _get_hedged(url, headers, delay)
+  requests_after, connections_after = _connection_stats()
+  connections_new = connections_after - connections_before
+  retries = response.raw.retries.history if response.raw.retries else ()
+  return response, {
+    "connections_new": connections_new,
+    "connections_reused": max(requests_after - requests_before - connections_new, 0),
+    "retries": len(retries),
+    "hedged": int(hedged),
+  }
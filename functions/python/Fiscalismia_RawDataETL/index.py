@@ -1,34 +1,45 @@
 # s3://fiscalismia-infrastructure/lambdas/fiscalismia/python/Fiscalismia_RawDataETL.zip
 import json
-import boto3
 import time
 from aws_lambda_powertools import Logger
-from aws_lambda_powertools.utilities import parameters
-from botocore.client import Config
-from download_xlsx import download_xlsx
-from download_csv import download_csv
-from clean_sheet_url import clean_sheet_url
-from timedelta_analysis import add_time_analysis_entry, log_time_analysis
-from extract_transform import extract_and_transform_to_tsv
-from datetime import datetime
-import zoneinfo
-s3_client = boto3.client('s3', config=Config(signature_version='s3v4'))
+from clean_sheet_url import clean_sheet_url, global_sheet_id
+from instrumentation import Profiler
+from run_state import load_last_run, save_last_run, generate_presigned_urls, aggregate_presigned_urls
+from etl_config import INCREMENTAL_MODE, OUTPUT_FORMATS, PROFILE_MEMORY, EXPORT_FORMAT, AGGREGATES, INLINE_MAX_BYTES, PIPELINED_STARTUP
+from export_selection import choose_export_type, record_export_stats
+from startup import get_s3_client, get_pipeline_executor, import_deferred_modules, new_run_identity, register_priming
+from secrets_cache import SecretsCache
+from coalescing import coalesce
+from batch import BATCH_TARGETS_PARAMETER, parse_targets, run_targets, batch_response, target_run_id
+from post_response import register_extension, defer, finish_invocation
+# pandas, the download and extract modules as well as the s3 client are deferred until first use. See startup.py
 s3_bucket = 'fiscalismia-raw-data-etl-storage'
-berlin_tz = zoneinfo.ZoneInfo("Europe/Berlin")
-timestamp = datetime.now(tz=berlin_tz).strftime("%Y-%m-%d_%H-%M-%S")
 logger = Logger(service="Fiscalismia_RawDataETL")
-def authenticate_request(body, headers):
+API_KEY_PARAMETER = "/api/fiscalismia/API_GW_SECRET_KEY"
+SHEET_URL_PARAMETER = "/google/sheets/fiscalismia-datasource-url"
+# The API key is never served stale, so a rotated key takes effect within API_KEY_TTL_SECONDS.
+# A key not matching the cached one forces a re-fetch, at most once per API_KEY_REFETCH_INTERVAL_SECONDS,
+# so requests with invalid keys cannot flood Parameter Store
+API_KEY_TTL_SECONDS = 60
+API_KEY_REFETCH_INTERVAL_SECONDS = 5
+last_api_key_refetch = 0.0
+# SecureStrings from AWS Parameter Store, fetched in one batch and cached across warm invocations
+secrets = SecretsCache(
+  [API_KEY_PARAMETER, SHEET_URL_PARAMETER], logger=logger, ttl_overrides={API_KEY_PARAMETER: (API_KEY_TTL_SECONDS, 0)}
+)
+# Spreadsheets of the batch mode, only fetched by batch_handler
+batch_targets_secret = SecretsCache([BATCH_TARGETS_PARAMETER], logger=logger)
+register_priming(logger)
+if INLINE_MAX_BYTES:
+  # the s3 writes of inlined tables run after the response
+  register_extension(logger)
+def authenticate_request(body, headers, secret_api_key):
   contentLength = int(headers.get('Content-Length', 0))
   authorization = headers.get('authorization', None)
   requestIp = headers.get('X-Forwarded-For', None)
 
   logger.info("Request received", extra={"ip": requestIp})
 
-  # query SecureString from AWS Parameter Store
-  secret_api_key = parameters.get_parameter(
-      "/api/fiscalismia/API_GW_SECRET_KEY",
-      decrypt=True
-  )
   # block access if payload is sent
   if body or contentLength > 0:
     logger.error(f"No payload expected. Request body should be empty. ContentLength: {contentLength}")
@@ -47,6 +58,21 @@ def authenticate_request(body, headers):
   logger.info("Request authenticated successfully")
   return {"statusCode": 200}
 
+def authenticate(body, headers, secret_values: dict[str, str | None]) -> dict:
+  """
+  Authenticates the request against the cached API key. A mismatch re-fetches the key once,
+  as it may have been rotated since it was cached.
+  """
+  global last_api_key_refetch
+  auth_response = authenticate_request(body, headers, secret_values[API_KEY_PARAMETER])
+  now = time.monotonic()
+  if auth_response["statusCode"] == 403 and headers.get('authorization') and now - last_api_key_refetch >= API_KEY_REFETCH_INTERVAL_SECONDS:
+    last_api_key_refetch = now
+    secrets.invalidate(API_KEY_PARAMETER)
+    secret_values[API_KEY_PARAMETER] = secrets.get(API_KEY_PARAMETER)
+    auth_response = authenticate_request(body, headers, secret_values[API_KEY_PARAMETER])
+  return auth_response
+
 def log_debug_info(event, headers, context, info_log=True):
   extractedEventKeys = {
     "HTTP" : event.get('httpMethod', None),
@@ -63,45 +89,317 @@ def log_debug_info(event, headers, context, info_log=True):
   logger.debug("Debug info extracted", extra={"eventKeys": extractedEventKeys})
 
 def lambda_handler(event, context):
-  timedelta_analysis = []
-  start_time = time.time_ns()
-  add_time_analysis_entry(timedelta_analysis, start_time, "function invocation")
-  body = event.get("body", None)
-  headers = event.get("headers", None)
-  log_debug_info(event, headers, context)
-  auth_response = authenticate_request(body, headers)
-  if auth_response.get("statusCode", None) != 200:
-    return auth_response
-  add_time_analysis_entry(timedelta_analysis, start_time, "request authentication")
+  profiler = Profiler("Fiscalismia_RawDataETL", memory_tracking=PROFILE_MEMORY)
   try:
-    # query SecureString from AWS Parameter Store
-    sheet_url = parameters.get_parameter(
-        "/google/sheets/fiscalismia-datasource-url",
-        decrypt=True
-    )
-    # Verify spreadsheet url is not malformed
-    sheet_url = clean_sheet_url(sheet_url, logger, "csv")
-    # Download the spreadsheet from google docs into memory
-    sheet = download_csv(start_time, timestamp, sheet_url, s3_bucket, timedelta_analysis, s3_client, logger)
-    # extract tsv files from tables nested within sheet with pandas dataframe iloc functionality
-    s3_presigned_urls = extract_and_transform_to_tsv(start_time, timestamp, sheet, s3_bucket, timedelta_analysis, s3_client, logger)
-
-    # log timedeltas for performance monitoring
-    logger.info("finalized extract transform loading operation")
-    log_time_analysis(timedelta_analysis, logger)
+    with profiler.span("invocation"):
+      if PIPELINED_STARTUP:
+        import asyncio
+        return asyncio.run(handle_request_async(event, context, profiler))
+      return handle_request(event, context, profiler)
+  finally:
+    # spans are published for failed invocations as well
+    profiler.flush(logger)
+    finish_invocation(context)
+
+def batch_handler(event, context):
+  """
+  Entry point of the batch mode, processing every spreadsheet listed in Parameter Store. See batch.py
+  Requests are authenticated like those of lambda_handler. The response reports the result of every spreadsheet.
+  """
+  profiler = Profiler("Fiscalismia_RawDataETL", memory_tracking=PROFILE_MEMORY)
+  try:
+    with profiler.span("invocation"):
+      return handle_batch_request(event, context, profiler)
+  finally:
+    profiler.flush(logger)
+    finish_invocation(context)
+
+def compaction_handler(event, context):
+  """
+  Entry point of the scheduled compaction of the raw snapshot store, see snapshot_store.compact_snapshots.
+  """
+  from snapshot_store import compact_snapshots
+  try:
+    stats = compact_snapshots(s3_bucket, get_s3_client(), logger)
+  finally:
+    finish_invocation(context)
+  return {
+    "statusCode": 200,
+    "body": json.dumps(stats)
+  }
+
+def fetch_secrets(profiler: Profiler, parent_span=None) -> dict[str, str | None]:
+  with profiler.span("secrets", parent=parent_span) as secrets_span:
+    secret_values = secrets.get_all()
+    secrets_span.add_counts(secrets.pop_stats())
+  return secret_values
+
+def fetch_last_run(profiler: Profiler, parent_span=None) -> tuple[object, dict | None]:
+  # Fingerprint of the last successful run allows skipping unchanged spreadsheets
+  s3_client = get_s3_client()
+  with profiler.span("load_last_run", parent=parent_span):
+    last_run = load_last_run(s3_bucket, s3_client, logger)
+  return s3_client, last_run
+
+def run_etl(
+  run_id: str,
+  timestamp: str,
+  sheet_url: str,
+  s3_client,
+  last_run: dict | None,
+  profiler: Profiler,
+  target: dict | None = None
+) -> dict:
+  """
+  Returns the response of an authenticated request. Concurrent invocations share the response of a single run.
+  target is a spreadsheet of the batch mode, see batch.parse_targets.
+  """
+  state_prefix = target["state_prefix"] if target else ""
+  return coalesce(
+    run_id, s3_bucket, s3_client, profiler, logger,
+    lambda: process_sheet(run_id, timestamp, sheet_url, s3_client, last_run, profiler, target),
+    state_prefix,
+  )
+
+def process_sheet(
+  run_id: str,
+  timestamp: str,
+  sheet_url: str,
+  s3_client,
+  last_run: dict | None,
+  profiler: Profiler,
+  target: dict | None = None
+) -> dict:
+  """
+  Downloads, extracts and persists the spreadsheet.
+  A target of the batch mode brings its own worksheet gid, ddl_schema profile and state prefix.
+  Batch responses never inline tables, as the tables of all targets could exceed the response size limit.
+  """
+  sheet_id = target["gid"] if target else global_sheet_id
+  inline_max_bytes = 0 if target else INLINE_MAX_BYTES
+  tables = target["tables"] if target else None
+  state_prefix = target["state_prefix"] if target else ""
+  export_type = choose_export_type(EXPORT_FORMAT, last_run)
+  # Verify spreadsheet url is not malformed
+  sheet_url = clean_sheet_url(sheet_url, logger, export_type, sheet_id)
+  # Download the spreadsheet from google docs into memory
+  if export_type == "xlsx":
+    from download_xlsx import download_xlsx as download_sheet
+  else:
+    from download_csv import download_csv as download_sheet
+  sheet, fingerprint = download_sheet(run_id, sheet_url, s3_bucket, profiler, s3_client, logger, last_run, tables, state_prefix)
+  if sheet is None:
+    # Content unchanged since last successful run. Serve the TSV files that already exist
+    s3_presigned_urls = generate_presigned_urls(last_run["s3_keys"], s3_bucket, s3_client)
+    logger.info("Spreadsheet unchanged. Skipped extract transform loading operation", extra={"last_run": last_run.get("timestamp")})
+    response_body = { "presigned_urls": list(s3_presigned_urls)}
+    if "manifest" in last_run:
+      response_body["manifest"] = last_run["manifest"]
+      if "aggregates" in last_run["manifest"]:
+        response_body["aggregates"] = aggregate_presigned_urls(last_run["manifest"], s3_bucket, s3_client)
+      if inline_max_bytes:
+        from inline_tables import fetch_inline_tables
+        with profiler.span("fetch_inline_tables"):
+          inline_tables = fetch_inline_tables(last_run["manifest"], s3_bucket, s3_client, inline_max_bytes)
+        if inline_tables:
+          response_body["inline_tables"] = inline_tables
     return {
       "statusCode": 202,
-      "body": json.dumps( { "presigned_urls": list(s3_presigned_urls)})
+      "body": json.dumps(response_body)
     }
-  except RuntimeError as e:
+  # extract tsv files from tables nested within sheet with pandas dataframe iloc functionality
+  from extract_transform import extract_and_transform_to_tsv
+  etl_result = extract_and_transform_to_tsv(
+    run_id, sheet, s3_bucket, profiler, s3_client, logger, INCREMENTAL_MODE, OUTPUT_FORMATS, AGGREGATES, tables, state_prefix,
+    inline_max_bytes
+  )
+  export_stats = record_export_stats(last_run, export_type, {
+    "download_ms": profiler.totals("download")["duration_ms"],
+    "parse_ms": profiler.totals("parse")["duration_ms"],
+    "bytes": profiler.totals("download")["bytes"],
+  })
+
+  def persist_run():
+    # the last run only advances once the tables it refers to are persisted
+    if "persist" in etl_result:
+      etl_result["persist"]()
+    with profiler.span("save_last_run"):
+      save_last_run(
+        s3_bucket, s3_client, fingerprint, etl_result["s3_keys"], timestamp, logger, export_stats, etl_result["manifest"], state_prefix
+      )
+
+  if "inline_tables" in etl_result:
+    # inlined tables are written to s3 after the response, see post_response.py
+    defer(persist_run, logger, profiler)
+  else:
+    persist_run()
+
+  logger.info("finalized extract transform loading operation")
+  response_body = { "presigned_urls": list(etl_result["presigned_urls"]), "manifest": etl_result["manifest"]}
+  if "delta_presigned_urls" in etl_result:
+    response_body["delta_presigned_urls"] = list(etl_result["delta_presigned_urls"])
+  if "aggregate_presigned_urls" in etl_result:
+    response_body["aggregates"] = etl_result["aggregate_presigned_urls"]
+  if "inline_tables" in etl_result:
+    response_body["inline_tables"] = etl_result["inline_tables"]
+  if etl_result["validation_report"]:
+    response_body["validation_report"] = etl_result["validation_report"]
+  return {
+    "statusCode": 202,
+    "body": json.dumps(response_body)
+  }
+
+def process_snapshot(as_of: str, s3_client, profiler: Profiler) -> dict:
+  """
+  Serves the tables of the spreadsheet as of a past date or run id, see snapshot_store.load_snapshot_tables.
+  The tables are uploaded under their content addressed keys in the configured output formats like those of a run,
+  while the state of the last run is left untouched.
+  """
+  from snapshot_store import find_snapshot, load_extracted_tables
+  from output_formats import serialize_table, DEFAULT_OUTPUT_FORMAT
+  from table_manifest import manifest_entry, build_manifest
+  snapshot = find_snapshot(as_of, s3_bucket, s3_client)
+  tables = load_extracted_tables(snapshot, s3_bucket, s3_client, logger, profiler)
+  manifest_tables = []
+  for table_name, df in tables.items():
+    output_format = OUTPUT_FORMATS.get(table_name, OUTPUT_FORMATS.get("default", DEFAULT_OUTPUT_FORMAT))
+    with profiler.span("serialize", {"Table": table_name}) as serialize_span:
+      s3_buffer, extra_args = serialize_table(df, output_format)
+      serialize_span.add_bytes(s3_buffer.getbuffer().nbytes)
+      table_entry = manifest_entry(table_name, len(df), s3_buffer, output_format)
+    with profiler.span("upload", {"Table": table_name}):
+      s3_client.upload_fileobj(s3_buffer, s3_bucket, table_entry["s3_key"], ExtraArgs=extra_args)
+    manifest_tables.append(table_entry)
+  logger.info("Served tables of a past snapshot", extra={"as_of": as_of, "snapshot_run": snapshot["run_id"]})
+  manifest = build_manifest(snapshot["run_id"], manifest_tables)
+  return {
+    "statusCode": 202,
+    "body": json.dumps({
+      "presigned_urls": list(generate_presigned_urls([entry["s3_key"] for entry in manifest_tables], s3_bucket, s3_client)),
+      "manifest": manifest,
+    })
+  }
+
+def snapshot_as_of(event) -> str | None:
+  # ?as_of=<YYYY-MM-DD or run id> selects a past snapshot instead of the live spreadsheet
+  return (event.get('queryStringParameters', None) or {}).get('as_of', None)
+
+def error_response(e: Exception) -> dict:
+  if isinstance(e, RuntimeError):
     logger.error("Runtime error during ETL", extra={"error": str(e)})
     return {
       "statusCode": 400,
       "body": json.dumps({"error": str(e)})
     }
+  logger.error("Unexpected error during ETL", extra={"error": str(e)})
+  return {
+      "statusCode": 500,
+      "body": json.dumps({"error": str(e)})
+  }
+
+def handle_request(event, context, profiler: Profiler):
+  timestamp, run_id = new_run_identity(context)
+  logger.append_keys(run_id=run_id)
+  body = event.get("body", None)
+  headers = event.get("headers", None)
+  log_debug_info(event, headers, context)
+  secret_values = fetch_secrets(profiler)
+  with profiler.span("authenticate"):
+    auth_response = authenticate(body, headers, secret_values)
+  if auth_response.get("statusCode", None) != 200:
+    return auth_response
+  try:
+    as_of = snapshot_as_of(event)
+    if as_of:
+      return process_snapshot(as_of, get_s3_client(), profiler)
+    s3_client, last_run = fetch_last_run(profiler)
+    return run_etl(run_id, timestamp, secret_values[SHEET_URL_PARAMETER], s3_client, last_run, profiler)
   except Exception as e:
-    logger.error("Unexpected error during ETL", extra={"error": str(e)})
-    return {
-        "statusCode": 500,
-        "body": json.dumps({"error": str(e)})
-    }
+    return error_response(e)
+
+def handle_batch_request(event, context, profiler: Profiler):
+  """
+  Runs the ETL for every target of the batch, see batch.py.
+  Each target is profiled separately, so the export stats of a target only cover its own download.
+  """
+  timestamp, run_id = new_run_identity(context)
+  logger.append_keys(run_id=run_id)
+  body = event.get("body", None)
+  headers = event.get("headers", None)
+  log_debug_info(event, headers, context)
+  secret_values = fetch_secrets(profiler)
+  with profiler.span("authenticate"):
+    auth_response = authenticate(body, headers, secret_values)
+  if auth_response.get("statusCode", None) != 200:
+    return auth_response
+  try:
+    with profiler.span("batch_targets") as batch_targets_span:
+      batch_targets = batch_targets_secret.get(BATCH_TARGETS_PARAMETER)
+      batch_targets_span.add_counts(batch_targets_secret.pop_stats())
+    targets = parse_targets(batch_targets)
+    s3_client = get_s3_client()
+  except Exception as e:
+    return error_response(e)
+
+  def run_target(target: dict) -> dict:
+    target_profiler = Profiler("Fiscalismia_RawDataETL", memory_tracking=PROFILE_MEMORY)
+    try:
+      with target_profiler.span("target", {"Target": target["name"]}):
+        with target_profiler.span("load_last_run"):
+          last_run = load_last_run(s3_bucket, s3_client, logger, target["state_prefix"])
+        return run_etl(target_run_id(run_id, target["name"]), timestamp, target["url"], s3_client, last_run, target_profiler, target)
+    except Exception as e:
+      return error_response(e)
+    finally:
+      target_profiler.flush(logger, info_log=False)
+
+  with profiler.span("targets") as targets_span:
+    responses = run_targets(targets, run_target)
+    targets_span.add_counts({"targets": len(targets)})
+  logger.info("Finalized batch", extra={"targets": {name: response["statusCode"] for name, response in responses.items()}})
+  return batch_response(responses)
+
+async def handle_request_async(event, context, profiler: Profiler):
+  """
+  Runs the stages of handle_request on the pipeline executor with ETL_PIPELINED_STARTUP set, overlapping those
+  independent of each other:
+  - the secrets fetch with the creation of the s3 client and the last run lookup
+  - the import of pandas and the ETL modules with the last run lookup, once the request is authenticated
+  The download overlaps the raw backup upload with parsing, and each extracted table is uploaded while
+  the next one is extracted.
+  """
+  import asyncio
+  loop = asyncio.get_running_loop()
+  executor = get_pipeline_executor()
+  invocation_span = profiler.current_span()
+  timestamp, run_id = new_run_identity(context)
+  logger.append_keys(run_id=run_id)
+  body = event.get("body", None)
+  headers = event.get("headers", None)
+  log_debug_info(event, headers, context)
+  secrets_future = loop.run_in_executor(executor, fetch_secrets, profiler, invocation_span)
+  last_run_future = loop.run_in_executor(executor, fetch_last_run, profiler, invocation_span)
+  secret_values = await secrets_future
+  with profiler.span("authenticate"):
+    auth_response = authenticate(body, headers, secret_values)
+  if auth_response.get("statusCode", None) != 200:
+    # the lookup finishes in the background. Its result is discarded
+    last_run_future.cancel()
+    return auth_response
+  try:
+    import_future = loop.run_in_executor(executor, import_deferred_modules)
+    s3_client, last_run = await last_run_future
+    await import_future
+    as_of = snapshot_as_of(event)
+    if as_of:
+      return await loop.run_in_executor(executor, process_snapshot, as_of, s3_client, profiler)
+    return await loop.run_in_executor(
+      executor, run_etl_in_span, run_id, timestamp, secret_values[SHEET_URL_PARAMETER], s3_client, last_run, profiler, invocation_span
+    )
+  except Exception as e:
+    return error_response(e)
+
+def run_etl_in_span(run_id: str, timestamp: str, sheet_url: str, s3_client, last_run: dict | None, profiler: Profiler, parent_span) -> dict:
+  # spans opened by run_etl on the executor thread become children of the invocation span
+  with profiler.span("etl", parent=parent_span):
+    return run_etl(run_id, timestamp, sheet_url, s3_client, last_run, profiler)
@@ -0,0 +1,62 @@
+import base64
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from etl_config import UPLOAD_CONCURRENCY
+from output_formats import OUTPUT_FORMATS
+
+# Small tables returned in the response body, sparing clients the GET of their presigned url.
+# A table serialized to at most ETL_INLINE_MAX_BYTES is inlined as
+#   {"content_encoding": "gzip", "data": "<base64>"}
+# Formats compressed already, such as tsv.gz, are inlined as stored. The manifest describes the inlined
+# bytes after decoding, including their hash. Presigned urls are returned for inlined tables as well.
+# Synchronous lambda responses are limited to 6 MB, tables exceeding the budget of a response are not inlined.
+INLINE_RESPONSE_MAX_BYTES = 4 * 1024 * 1024
+# Lives across warm invocations, fetches the inlined tables of unchanged spreadsheets
+fetch_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="inline-fetch")
+
+def inline_payload(data: bytes | memoryview, output_format: str) -> dict:
+  content_encoding = OUTPUT_FORMATS[output_format]["content_encoding"]
+  if content_encoding is None:
+    # mtime=0 keeps the payload identical for identical tables
+    data, content_encoding = gzip.compress(data, mtime=0), "gzip"
+  return {"content_encoding": content_encoding, "data": base64.b64encode(data).decode("ascii")}
+
+class InlineBudget:
+  """
+  Collects the payloads of a response, as long as each table and their sum fit the limits.
+  """
+  def __init__(self, max_table_bytes: int, max_response_bytes: int = INLINE_RESPONSE_MAX_BYTES):
+    self.max_table_bytes = max_table_bytes
+    self.remaining_bytes = max_response_bytes
+    self.payloads: dict[str, dict] = {}
+
+  def fits(self, entry: dict) -> bool:
+    return 0 < entry["bytes"] <= self.max_table_bytes and self.remaining_bytes > 0
+
+  def add(self, entry: dict, data: bytes | memoryview) -> bool:
+    """
+    Inlines the serialized table described by the manifest entry. Returns whether it fit.
+    """
+    if not self.fits(entry):
+      return False
+    payload = inline_payload(data, entry["output_format"])
+    if len(payload["data"]) > self.remaining_bytes:
+      return False
+    self.remaining_bytes -= len(payload["data"])
+    self.payloads[entry["table"]] = payload
+    return True
+
+def _fetch_table(entry: dict, s3_bucket: str, s3_client) -> bytes:
+  return s3_client.get_object(Bucket=s3_bucket, Key=entry["s3_key"])["Body"].read()
+
+def fetch_inline_tables(manifest: dict, s3_bucket: str, s3_client, max_table_bytes: int) -> dict[str, dict]:
+  """
+  Inlines the tables of a previous run, e.g. of an unchanged spreadsheet. Only tables fitting
+  max_table_bytes according to the manifest are fetched, concurrently.
+  """
+  budget = InlineBudget(max_table_bytes)
+  entries = [entry for entry in manifest.get("tables", []) if budget.fits(entry)]
+  tables = fetch_executor.map(lambda entry: _fetch_table(entry, s3_bucket, s3_client), entries)
+  for entry, data in zip(entries, tables):
+    budget.add(entry, data)
+  return budget.payloads
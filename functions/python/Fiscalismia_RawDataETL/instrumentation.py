@@ -0,0 +1,169 @@
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.metrics.provider.cloudwatch_emf.cloudwatch import AmazonCloudWatchEMFProvider
+
+# Spans are published as CloudWatch metrics via Embedded Metric Format (EMF) log lines written by powertools
+# See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+METRIC_NAMESPACE = "Fiscalismia"
+# tracemalloc: peak of python allocations within the span, slows down allocation heavy code.
+#   Spans running concurrently on other threads share the same peak
+# rss: high water mark of the resident set size of the process at the end of the span, free of charge
+MEMORY_TRACKING_MODES = ("tracemalloc", "rss")
+
+class Span:
+  """
+  A timed section of an invocation on the monotonic clock.
+  Byte, row and named counters are attached by the code running within the span.
+  """
+  def __init__(self, name: str, parent: "Span | None", dimensions: dict[str, str]):
+    self.name = name
+    self.parent = parent
+    self.dimensions = dimensions
+    self.start_ns = time.perf_counter_ns()
+    self.duration_ns: int | None = None
+    self.byte_count = 0
+    self.row_count = 0
+    self.peak_memory: int | None = None
+    self.counts: dict[str, int] = {}
+
+  @property
+  def path(self) -> str:
+    return f"{self.parent.path}/{self.name}" if self.parent else self.name
+
+  def add_bytes(self, byte_count: int):
+    self.byte_count += byte_count
+
+  def add_rows(self, row_count: int):
+    self.row_count += row_count
+
+  def add_counts(self, counts: dict[str, int]):
+    """
+    Adds named counters, published as metrics of unit Count named after the counter.
+    """
+    for name, value in counts.items():
+      self.counts[name] = self.counts.get(name, 0) + value
+
+  def to_dict(self) -> dict:
+    entry = {"span": self.path, **self.dimensions, "duration_ms": round(self.duration_ns / 1_000_000, 3)}
+    if self.byte_count:
+      entry["bytes"] = self.byte_count
+    if self.row_count:
+      entry["rows"] = self.row_count
+    if self.peak_memory is not None:
+      entry["peak_memory_bytes"] = self.peak_memory
+    if self.counts:
+      entry["counts"] = self.counts
+    return entry
+
+class Profiler:
+  """
+  Collects nested spans of a single invocation.
+  - Spans nest implicitly within a thread. Spans in worker threads name their parent explicitly
+  - flush() emits one EMF document per span with the service and Stage dimensions plus the dimensions of the span,
+    so percentiles per stage and per table become CloudWatch metrics
+  """
+  def __init__(self, service: str, namespace: str = METRIC_NAMESPACE, memory_tracking: str | None = None):
+    if memory_tracking and memory_tracking not in MEMORY_TRACKING_MODES:
+      raise ValueError(f"Unknown memory tracking mode '{memory_tracking}'. Supported: {MEMORY_TRACKING_MODES}")
+    self.service = service
+    self.namespace = namespace
+    self.memory_tracking = memory_tracking or None
+    self.spans: list[Span] = []
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    if self.memory_tracking == "tracemalloc" and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def _stack(self) -> list[Span]:
+    if not hasattr(self._local, "stack"):
+      self._local.stack = []
+    return self._local.stack
+
+  def current_span(self) -> Span | None:
+    """
+    Returns the innermost open span of the current thread, to be passed as parent to spans in worker threads.
+    """
+    stack = self._stack()
+    return stack[-1] if stack else None
+
+  @contextmanager
+  def span(self, name: str, dimensions: dict[str, str] | None = None, parent: Span | None = None):
+    """
+    Times the enclosed block as child of the innermost open span of the current thread or of parent.
+    """
+    stack = self._stack()
+    parent = parent or self.current_span()
+    if self.memory_tracking == "tracemalloc":
+      # tracemalloc only tracks a single peak. The peak so far is credited to the parent before resetting it
+      if parent:
+        parent.peak_memory = max(parent.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+      tracemalloc.reset_peak()
+    span = Span(name, parent, dimensions or {})
+    stack.append(span)
+    try:
+      yield span
+    finally:
+      span.duration_ns = time.perf_counter_ns() - span.start_ns
+      stack.remove(span)
+      if self.memory_tracking == "tracemalloc":
+        span.peak_memory = max(span.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+        if parent:
+          parent.peak_memory = max(parent.peak_memory or 0, span.peak_memory)
+      elif self.memory_tracking == "rss":
+        # ru_maxrss is reported in kilobytes on linux
+        span.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+      with self._lock:
+        self.spans.append(span)
+
+  def totals(self, name: str) -> dict[str, float]:
+    """
+    Sums duration, bytes and rows of the finished spans with the given name.
+    """
+    with self._lock:
+      spans = [span for span in self.spans if span.name == name]
+    return {
+      "duration_ms": sum(span.duration_ns for span in spans) / 1_000_000,
+      "bytes": sum(span.byte_count for span in spans),
+      "rows": sum(span.row_count for span in spans),
+    }
+
+  def _add_span_metrics(self, metrics: Metrics, span: Span):
+    metrics.add_dimension("Stage", span.name)
+    for name, value in span.dimensions.items():
+      metrics.add_dimension(name, value)
+    metrics.add_metadata("SpanPath", span.path)
+    metrics.add_metric("Duration", MetricUnit.Milliseconds, span.duration_ns / 1_000_000)
+    if span.byte_count:
+      metrics.add_metric("Bytes", MetricUnit.Bytes, span.byte_count)
+    if span.row_count:
+      metrics.add_metric("Rows", MetricUnit.Count, span.row_count)
+    if span.peak_memory is not None:
+      metrics.add_metric("PeakMemory", MetricUnit.Bytes, span.peak_memory)
+    for name, value in span.counts.items():
+      metrics.add_metric(name, MetricUnit.Count, value)
+
+  def flush(self, logger, info_log=True):
+    """
+    Publishes the finished spans as EMF documents via powertools Metrics, logs them as summary and starts over.
+    """
+    with self._lock:
+      spans, self.spans = self.spans, []
+    spans.sort(key=lambda span: span.start_ns)
+    # Metrics instances share their metric set process wide. Concurrent invocations of a batch flush profilers
+    # of their own, so every flush publishes through a provider of its own
+    metrics = Metrics(provider=AmazonCloudWatchEMFProvider(namespace=self.namespace, service=self.service))
+    timestamp_ms = int(time.time() * 1000)
+    for span in spans:
+      self._add_span_metrics(metrics, span)
+      metrics.set_timestamp(timestamp_ms)
+      # lambda forwards stdout to CloudWatch Logs, which extracts the metrics from EMF documents
+      metrics.flush_metrics(raise_on_empty_metrics=True)
+    profile = [span.to_dict() for span in spans]
+    if info_log:
+      logger.info("Span profile concluded.", extra={ "span_profile" : profile })
+    logger.debug("Span profile concluded.", extra={ "span_profile" : profile })
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+# Validity periods of the rows of fixed_costs and income, derived from the "Date:" section headers.
+# The timeline is cut into elementary segments at every effective date and every day after an expiration date.
+# Within a segment the set of active rows is constant, so a point in time is resolved by a binary search over
+# the segment boundaries, followed by a slice of the active rows stored per segment in CSR layout.
+# Dates are held as days since epoch. An open expiration date is active until the end of time.
+
+OPEN_END = np.iinfo(np.int64).max
+# Tables with effective_date and expiration_date columns that are indexed
+INTERVAL_TABLES = ("fixed_costs", "income")
+
+def _to_days(value) -> int:
+  return int(np.datetime64(pd.Timestamp(value).date(), "D").astype(np.int64))
+
+def _days_to_iso(days: np.ndarray) -> list[str]:
+  return np.datetime_as_string(days.astype("datetime64[D]"), unit="D").tolist()
+
+class IntervalIndex:
+  """
+  Point-in-time and range lookups of the rows active on a date, in O(log n + k) for k active rows.
+  - starts and ends hold the first and last active day of every indexed row, ends is OPEN_END for open periods
+  - positions holds the row position in the source table of every indexed row
+  - boundaries holds the first day of every elementary segment
+  - the rows active in segment s are segment_rows[segment_offsets[s]:segment_offsets[s + 1]]
+  """
+  def __init__(
+    self,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    positions: np.ndarray,
+    boundaries: np.ndarray,
+    segment_offsets: np.ndarray,
+    segment_rows: np.ndarray,
+  ):
+    self.starts = starts
+    self.ends = ends
+    self.positions = positions
+    self.boundaries = boundaries
+    self.segment_offsets = segment_offsets
+    self.segment_rows = segment_rows
+
+  @classmethod
+  def from_dates(cls, effective_dates: pd.Series, expiration_dates: pd.Series) -> IntervalIndex:
+    """
+    Builds the index over the rows with an effective_date. Rows expiring before they take effect are never active.
+    """
+    has_start = effective_dates.notna().to_numpy()
+    positions = np.flatnonzero(has_start)
+    starts = effective_dates.to_numpy(dtype="datetime64[D]")[has_start].astype(np.int64)
+    expirations = expiration_dates.to_numpy(dtype="datetime64[D]")[has_start]
+    ends = np.where(np.isnat(expirations), OPEN_END, expirations.astype(np.int64))
+    is_active = ends >= starts
+    # exclusive ends are the boundaries where a row stops being active
+    exclusive_ends = ends[is_active & (ends != OPEN_END)] + 1
+    boundaries = np.unique(np.concatenate([starts[is_active], exclusive_ends]))
+    # segments covered by every row, expanded into one entry per row and segment
+    first_segments = np.searchsorted(boundaries, starts)
+    last_segments = np.where(ends == OPEN_END, len(boundaries), np.searchsorted(boundaries, ends, side="right"))
+    segment_counts = np.where(is_active, last_segments - first_segments, 0)
+    rows = np.repeat(np.arange(len(starts)), segment_counts)
+    segments = np.repeat(first_segments, segment_counts) + (
+      np.arange(len(rows)) - np.repeat(np.cumsum(segment_counts) - segment_counts, segment_counts)
+    )
+    order = np.argsort(segments, kind="stable")
+    segment_offsets = np.concatenate([[0], np.cumsum(np.bincount(segments, minlength=len(boundaries)))])
+    return cls(starts, ends, positions, boundaries, segment_offsets, rows[order])
+
+  def _segment_rows(self, first_segment: int, last_segment: int) -> np.ndarray:
+    return self.segment_rows[self.segment_offsets[first_segment]:self.segment_offsets[last_segment + 1]]
+
+  def at(self, date) -> np.ndarray:
+    """
+    Returns the source table positions of the rows active on date.
+    """
+    segment = int(np.searchsorted(self.boundaries, _to_days(date), side="right")) - 1
+    if segment < 0:
+      return self.positions[:0]
+    return self.positions[self._segment_rows(segment, segment)]
+
+  def overlapping(self, start, end) -> np.ndarray:
+    """
+    Returns the source table positions of the rows active on any day from start to end, inclusive.
+    """
+    first_segment = max(int(np.searchsorted(self.boundaries, _to_days(start), side="right")) - 1, 0)
+    last_segment = int(np.searchsorted(self.boundaries, _to_days(end), side="right")) - 1
+    if last_segment < first_segment:
+      return self.positions[:0]
+    return self.positions[np.unique(self._segment_rows(first_segment, last_segment))]
+
+  def expand_monthly(self, last_month: pd.Period | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Expands every row into one entry per month it is active in, vectorized.
+    Open periods run until last_month, by default the month of the latest start or expiration date.
+    Returns the source table positions and the monthly period ordinals of all entries.
+    """
+    start_months = self.starts.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    is_open = self.ends == OPEN_END
+    end_months = np.where(is_open, 0, self.ends).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    if last_month is not None:
+      last_month_ordinal = last_month.ordinal
+    else:
+      last_month_ordinal = max(start_months.max(initial=0), end_months[~is_open].max(initial=0))
+    end_months = np.where(is_open, last_month_ordinal, end_months)
+    # period ordinals of monthly frequency count the months since 1970-01, like datetime64[M]
+    month_counts = np.where(self.ends >= self.starts, np.maximum(end_months - start_months + 1, 0), 0)
+    rows = np.repeat(np.arange(len(start_months)), month_counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(month_counts) - month_counts, month_counts)
+    return self.positions[rows], start_months[rows] + offsets
+
+  def to_dict(self) -> dict:
+    """
+    JSON serializable form, with dates as ISO 8601 strings and None for open expiration dates.
+    """
+    is_open = self.ends == OPEN_END
+    ends = _days_to_iso(np.where(is_open, 0, self.ends))
+    return {
+      "positions": self.positions.tolist(),
+      "starts": _days_to_iso(self.starts),
+      "ends": [None if open_end else end for open_end, end in zip(is_open.tolist(), ends)],
+      "boundaries": _days_to_iso(self.boundaries),
+      "segment_offsets": self.segment_offsets.tolist(),
+      "segment_rows": self.segment_rows.tolist(),
+    }
+
+  @classmethod
+  def from_dict(cls, data: dict) -> IntervalIndex:
+    def to_days(values: list) -> np.ndarray:
+      return np.array(values, dtype="datetime64[D]").astype(np.int64)
+    ends = np.array([OPEN_END if end is None else _to_days(end) for end in data["ends"]], dtype=np.int64)
+    return cls(
+      to_days(data["starts"]),
+      ends,
+      np.array(data["positions"], dtype=np.int64),
+      to_days(data["boundaries"]),
+      np.array(data["segment_offsets"], dtype=np.int64),
+      np.array(data["segment_rows"], dtype=np.int64),
+    )
+
+def build_interval_index(df: pd.DataFrame) -> IntervalIndex:
+  return IntervalIndex.from_dates(df["effective_date"], df["expiration_date"])
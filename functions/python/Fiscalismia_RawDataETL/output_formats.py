@@ -0,0 +1,97 @@
+from __future__ import annotations
+import gzip
+import importlib.util
+from io import BytesIO
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+  # parsing the output format configuration at import must not pull in pandas
+  import pandas as pd
+
+def _write_tsv(df: pd.DataFrame, buffer):
+  # pandas encodes the rows chunkwise into the binary handle instead of building one string
+  df.to_csv(buffer, sep="\t", index=False, encoding="utf-8")
+
+def _write_gzip_tsv(df: pd.DataFrame, buffer):
+  # mtime=0 keeps the compressed bytes identical for identical tables
+  with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gzip_stream:
+    _write_tsv(df, gzip_stream)
+
+def _write_zstd_tsv(df: pd.DataFrame, buffer):
+  import zstandard
+  with zstandard.ZstdCompressor().stream_writer(buffer, closefd=False) as zstd_stream:
+    _write_tsv(df, zstd_stream)
+
+def _write_ndjson(df: pd.DataFrame, buffer):
+  # pandas serializes JSON into a single string before writing it to the handle
+  df.to_json(buffer, orient="records", lines=True, force_ascii=False, date_format="iso")
+
+def _write_parquet(df: pd.DataFrame, buffer):
+  df.to_parquet(buffer, index=False)
+
+# Supported serializations of extracted tables
+# Keyed by the format name used in ETL_OUTPUT_FORMATS, which doubles as file extension
+# Formats with "requires" depend on optional packages that are not part of the lambda layer
+OUTPUT_FORMATS = {
+  "tsv": {
+    "writer": _write_tsv,
+    "content_type": "text/tab-separated-values; charset=utf-8",
+    "content_encoding": None,
+  },
+  "tsv.gz": {
+    "writer": _write_gzip_tsv,
+    "content_type": "text/tab-separated-values; charset=utf-8",
+    "content_encoding": "gzip",
+  },
+  "tsv.zst": {
+    "writer": _write_zstd_tsv,
+    "content_type": "text/tab-separated-values; charset=utf-8",
+    "content_encoding": "zstd",
+    "requires": "zstandard",
+  },
+  "ndjson": {
+    "writer": _write_ndjson,
+    "content_type": "application/x-ndjson; charset=utf-8",
+    "content_encoding": None,
+  },
+  "parquet": {
+    "writer": _write_parquet,
+    "content_type": "application/vnd.apache.parquet",
+    "content_encoding": None,
+    # pyarrow is deliberately not part of the lambda layer due to its size
+    "requires": "pyarrow",
+  },
+}
+DEFAULT_OUTPUT_FORMAT = "tsv"
+
+def parse_output_formats(spec: str) -> dict[str, str]:
+  """
+  Parses a comma separated output format specification such as "tsv.gz,fixed_costs=ndjson".
+  - A bare format name sets the default for all tables
+  - table=format overrides the format of a single table
+  Returns a dict of table name to format name with the default under the "default" key.
+  """
+  output_formats = {"default": DEFAULT_OUTPUT_FORMAT}
+  for entry in filter(None, (part.strip() for part in spec.split(","))):
+    table_name, _, output_format = entry.rpartition("=")
+    output_format = output_format.strip()
+    if output_format not in OUTPUT_FORMATS:
+      raise ValueError(f"Unknown output format '{output_format}'. Supported: {list(OUTPUT_FORMATS)}")
+    required_package = OUTPUT_FORMATS[output_format].get("requires", None)
+    if required_package and importlib.util.find_spec(required_package) is None:
+      raise ValueError(f"Output format '{output_format}' requires the {required_package} package")
+    output_formats[table_name.strip() or "default"] = output_format
+  return output_formats
+
+def serialize_table(df: pd.DataFrame, output_format: str) -> tuple[BytesIO, dict]:
+  """
+  Serializes a table straight into an upload buffer.
+  Returns the buffer rewound to its start and the s3 ExtraArgs describing its content.
+  """
+  format_def = OUTPUT_FORMATS[output_format]
+  buffer = BytesIO()
+  format_def["writer"](df, buffer)
+  buffer.seek(0)
+  extra_args = {"ContentType": format_def["content_type"]}
+  if format_def["content_encoding"]:
+    extra_args["ContentEncoding"] = format_def["content_encoding"]
+  return buffer, extra_args
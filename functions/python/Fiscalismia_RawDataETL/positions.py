@@ -0,0 +1,228 @@
+import json
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from row_delta import compute_row_index
+
+# Position and FIFO cost basis engine over the investments table.
+# Transactions are sorted by isin and execution_date once, after which every figure is derived from
+# cumulative sums per isin in a single vectorized pass:
+# - Sold units are capped at the units held, see _cap_sold_units
+# - The FIFO cost of the first x units bought of an isin is a piecewise linear function of x, with a kink
+#   at every buy. Concatenating the cumulative buy units and costs of all isins keeps it continuous, so the
+#   cost basis of every sell is a difference of two np.interp lookups over all isins at once
+# Incremental updates replay only transactions not seen before on top of the open lots of the previous state.
+POSITIONS_STATE_S3_KEY = "state/investment-positions.json"
+BUY = "buy"
+SELL = "sell"
+
+def _prepare_transactions(investments: pd.DataFrame) -> pd.DataFrame:
+  """
+  Normalizes the investments table into transactions sorted by isin and execution_date.
+  Rows without isin, positive units or a buy or sell execution_type are left out.
+  - buy_cost: total price, or units times price per unit, plus fees
+  - proceeds: total price, or units times price per unit, minus fees
+  - taxed_share: pct_of_profit_taxed, a fraction as typed by column_types. Missing percentages count as fully taxed
+  """
+  execution_type = investments["execution_type"].astype(str).str.strip().str.lower()
+  units = investments["units"]
+  is_valid = execution_type.isin([BUY, SELL]) & investments["isin"].notna() & (investments["isin"] != "") & (units > 0)
+  transactions = investments.loc[is_valid]
+  fees = transactions["fees"].fillna(0)
+  gross = transactions["total_price"].fillna(transactions["units"] * transactions["price_per_unit"])
+  is_buy = execution_type[is_valid] == BUY
+  return pd.DataFrame({
+    "isin": transactions["isin"].astype(str),
+    "execution_date": transactions["execution_date"],
+    "is_buy": is_buy,
+    "units": transactions["units"],
+    "buy_cost": (gross + fees).where(is_buy, 0.0),
+    "proceeds": (gross - fees).where(~is_buy, 0.0),
+    "taxed_share": transactions["pct_of_profit_taxed"].fillna(1.0),
+    "carried": False,
+  }).sort_values(["isin", "execution_date"], kind="stable", na_position="first")
+
+def _cap_sold_units(bought: np.ndarray, requested: np.ndarray, groups: np.ndarray) -> np.ndarray:
+  """
+  Cumulative units sold per isin, with every sell capped at the units held at that point.
+  The recurrence sold[k] = min(sold[k - 1] + requested units of k, bought[k]) unrolls into
+  sold[k] = requested[k] + min(0, min over j <= k of bought[j] - requested[j]), a running minimum per isin.
+  """
+  headroom = pd.Series(bought - requested).groupby(groups).cummin().to_numpy()
+  return requested + np.minimum(headroom, 0)
+
+def run_fifo(transactions: pd.DataFrame) -> pd.DataFrame:
+  """
+  Returns the transactions as ledger with holdings, FIFO cost basis, realized and taxable profit per row.
+  transactions must be sorted by isin and execution_date, see _prepare_transactions.
+  """
+  groups = pd.factorize(transactions["isin"], sort=False)[0]
+  is_buy = transactions["is_buy"].to_numpy()
+  units = transactions["units"].to_numpy(dtype="float64")
+  buy_units = np.where(is_buy, units, 0.0)
+  buy_cost = transactions["buy_cost"].to_numpy(dtype="float64")
+
+  bought = pd.Series(buy_units).groupby(groups).cumsum().to_numpy()
+  requested = pd.Series(np.where(is_buy, 0.0, units)).groupby(groups).cumsum().to_numpy()
+  sold = _cap_sold_units(bought, requested, groups)
+  sold_before = sold - pd.Series(sold).groupby(groups).diff().fillna(pd.Series(sold)).to_numpy()
+
+  # cost curve of all isins, continuous across isins since each one starts where the previous one ended
+  curve_units = np.concatenate([[0.0], np.cumsum(buy_units)])
+  curve_cost = np.concatenate([[0.0], np.cumsum(buy_cost)])
+  group_starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.array([], dtype=int)
+  row_offsets = np.repeat(curve_units[group_starts], np.diff(np.r_[group_starts, len(groups)]))
+  group_totals = pd.Series(buy_units).groupby(groups).transform("sum").to_numpy()
+
+  def fifo_cost(sold_units: np.ndarray) -> np.ndarray:
+    # float rounding must not spill into the curve of the next isin
+    return np.interp(row_offsets + np.minimum(sold_units, group_totals), curve_units, curve_cost) - np.interp(row_offsets, curve_units, curve_cost)
+
+  executed_units = sold - sold_before
+  cost_basis_sold = fifo_cost(sold) - fifo_cost(sold_before)
+  proceeds = transactions["proceeds"].to_numpy(dtype="float64") * np.divide(
+    executed_units, units, out=np.zeros_like(units), where=~is_buy
+  )
+  realized_profit = np.where(is_buy, 0.0, proceeds - cost_basis_sold)
+  cumulative_cost = pd.Series(np.where(is_buy, buy_cost, 0.0)).groupby(groups).cumsum().to_numpy()
+  return transactions.assign(
+    executed_units=np.where(is_buy, units, executed_units),
+    oversold_units=np.where(is_buy, 0.0, np.maximum(units - executed_units, 0.0)),
+    holdings=bought - sold,
+    open_cost_basis=cumulative_cost - fifo_cost(sold),
+    cost_basis_sold=np.where(is_buy, 0.0, cost_basis_sold),
+    realized_profit=realized_profit,
+    taxable_profit=realized_profit * transactions["taxed_share"].to_numpy(dtype="float64"),
+  )
+
+def _open_lots(ledger: pd.DataFrame) -> pd.DataFrame:
+  """
+  Units and cost of every buy not yet consumed by FIFO sells at the end of the ledger.
+  """
+  groups = pd.factorize(ledger["isin"], sort=False)[0]
+  is_buy = ledger["is_buy"].to_numpy()
+  buy_units = np.where(is_buy, ledger["units"].to_numpy(dtype="float64"), 0.0)
+  lot_end = pd.Series(buy_units).groupby(groups).cumsum().to_numpy()
+  final_holdings = ledger["holdings"].groupby(groups).transform("last").to_numpy()
+  final_sold = pd.Series(lot_end).groupby(groups).transform("last").to_numpy() - final_holdings
+  remaining = np.clip(lot_end - final_sold, 0, buy_units)
+  is_open = is_buy & (remaining > 0)
+  return pd.DataFrame({
+    "isin": ledger["isin"].to_numpy()[is_open],
+    "execution_date": ledger["execution_date"].to_numpy()[is_open],
+    "units": remaining[is_open],
+    "cost": ledger["buy_cost"].to_numpy(dtype="float64")[is_open] * remaining[is_open] / buy_units[is_open],
+  })
+
+POSITION_TOTALS = ["bought_units", "sold_units", "oversold_units", "realized_profit", "taxable_profit"]
+
+def summarize_positions(ledger: pd.DataFrame, previous_positions: pd.DataFrame | None = None) -> pd.DataFrame:
+  """
+  Current position per isin: holdings, open cost basis, average cost and the realized and taxable profit to date.
+  previous_positions carries the totals of the transactions applied in earlier runs, indexed by isin.
+  """
+  is_buy = ledger["is_buy"] & ~ledger["carried"]
+  positions = ledger.assign(
+    bought_units=ledger["executed_units"].where(is_buy, 0.0),
+    sold_units=ledger["executed_units"].where(~ledger["is_buy"], 0.0),
+  ).groupby("isin", sort=True).agg(
+    holdings=("holdings", "last"),
+    open_cost_basis=("open_cost_basis", "last"),
+    bought_units=("bought_units", "sum"),
+    sold_units=("sold_units", "sum"),
+    oversold_units=("oversold_units", "sum"),
+    realized_profit=("realized_profit", "sum"),
+    taxable_profit=("taxable_profit", "sum"),
+  )
+  if previous_positions is not None and len(previous_positions):
+    positions = positions.reindex(positions.index.union(previous_positions.index))
+    previous_positions = previous_positions.reindex(positions.index)
+    positions[POSITION_TOTALS] = positions[POSITION_TOTALS].fillna(0) + previous_positions[POSITION_TOTALS].fillna(0)
+    # isins without open lots or new transactions keep their previous position
+    for col_name in ("holdings", "open_cost_basis"):
+      positions[col_name] = positions[col_name].fillna(previous_positions[col_name])
+  positions["average_cost"] = positions["open_cost_basis"] / positions["holdings"].where(positions["holdings"] > 0)
+  positions.index.name = "isin"
+  return positions.reset_index().round(6)
+
+def _transaction_hashes(investments: pd.DataFrame) -> np.ndarray:
+  # hashed over all columns including the occurrence, so identical transactions remain distinguishable
+  return compute_row_index(investments, list(investments.columns))[0]
+
+def update_positions(investments: pd.DataFrame, previous_state: dict | None = None) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+  """
+  Computes the positions of the investments table.
+  With previous_state only the transactions not seen before are replayed on top of its open lots.
+  All transactions are replayed instead if a known transaction changed or disappeared, or if a new one
+  is dated before the latest known one, since FIFO depends on the order of all transactions.
+
+  Returns the positions per isin, the ledger of the replayed transactions and the state for the next update.
+  """
+  transactions = _prepare_transactions(investments)
+  row_hashes = _transaction_hashes(investments.loc[transactions.index])
+  hashes_by_row = pd.Series(row_hashes, index=transactions.index)
+  is_new = np.ones(len(transactions), dtype=bool)
+  previous_positions = None
+  carried = transactions.iloc[:0]
+  if previous_state:
+    known_hashes = np.array([int(row_hash, 16) for row_hash in previous_state["row_hashes"]], dtype=np.uint64)
+    is_new = ~np.isin(hashes_by_row.to_numpy(), known_hashes)
+    last_date = pd.Timestamp(previous_state["last_execution_date"]) if previous_state.get("last_execution_date") else None
+    new_dates = transactions["execution_date"][is_new]
+    is_append_only = (
+      np.isin(known_hashes, row_hashes).all()
+      and new_dates.notna().all()
+      and (last_date is None or (new_dates >= last_date).all())
+    )
+    if is_append_only:
+      lots = pd.DataFrame(previous_state["open_lots"], columns=["isin", "execution_date", "units", "cost"])
+      carried = pd.DataFrame({
+        "isin": lots["isin"].astype(str),
+        "execution_date": pd.to_datetime(lots["execution_date"]),
+        "is_buy": True,
+        "units": lots["units"].astype("float64"),
+        "buy_cost": lots["cost"].astype("float64"),
+        "proceeds": 0.0,
+        "taxed_share": 1.0,
+        "carried": True,
+      })
+      previous_positions = pd.DataFrame(previous_state["positions"]).set_index("isin") if previous_state["positions"] else None
+    else:
+      is_new[:] = True
+
+  replayed = pd.concat([carried, transactions[is_new]]).sort_values(["isin", "execution_date"], kind="stable", na_position="first")
+  ledger = run_fifo(replayed)
+  positions = summarize_positions(ledger, previous_positions)
+  execution_dates = transactions["execution_date"].dropna()
+  lots = _open_lots(ledger)
+  state = {
+    "row_hashes": [f"{row_hash:016x}" for row_hash in row_hashes],
+    "last_execution_date": execution_dates.max().isoformat() if len(execution_dates) else None,
+    "open_lots": lots.assign(execution_date=lots["execution_date"].astype(str)).to_dict(orient="records"),
+    "positions": positions.drop(columns="average_cost").to_dict(orient="records"),
+  }
+  return positions, ledger[~ledger["carried"]], state
+
+def load_positions_state(s3_bucket: str, s3_client, logger, state_prefix: str = "") -> dict | None:
+  """
+  Fetches the state of the last position update from s3. Returns None if there is none.
+  """
+  try:
+    response = s3_client.get_object(Bucket=s3_bucket, Key=f"{state_prefix}{POSITIONS_STATE_S3_KEY}")
+    return json.loads(response["Body"].read())
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+      logger.warning("Failed to load positions state", extra={"error": str(e)})
+    return None
+  except ValueError as e:
+    logger.warning("Positions state is not valid JSON", extra={"error": str(e)})
+    return None
+
+def save_positions_state(state: dict, s3_bucket: str, s3_client, logger, state_prefix: str = ""):
+  s3_client.put_object(
+    Bucket=s3_bucket,
+    Key=f"{state_prefix}{POSITIONS_STATE_S3_KEY}",
+    Body=json.dumps(state).encode("utf-8"),
+    ContentType="application/json",
+  )
+  logger.debug(f"Positions state persisted to s3://{s3_bucket}/{state_prefix}{POSITIONS_STATE_S3_KEY}")
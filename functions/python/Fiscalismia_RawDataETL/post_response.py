@@ -0,0 +1,119 @@
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections.abc import Callable
+
+# Work deferred until after the response of an invocation, such as the s3 writes of inlined tables.
+# Lambda freezes the execution environment once the handler returns, unless an extension is still busy with
+# the invocation. An internal extension, a thread registered with the Extensions API during init, receives
+# every invocation and only asks for the next one after it ran the tasks deferred by the handler.
+# The tasks count towards the duration and timeout of the invocation, but not towards its response time.
+# Without the extension, i.e. outside of lambda, with SnapStart or before register_extension, tasks run at once.
+EXTENSION_NAME = os.path.basename(__file__)
+EXTENSIONS_API_VERSION = "2020-01-01"
+# Margin before the invocation deadline after which the extension stops waiting for the handler
+DEADLINE_MARGIN_SECONDS = 1
+
+_extension_id: str | None = None
+_deferred_tasks: list[tuple[Callable[[], None], object]] = []
+_deferred_tasks_lock = threading.Lock()
+# Deferred tasks handed from the handler to the extension, one (request id, tasks) entry per invocation
+_handoff: queue.Queue = queue.Queue()
+
+def _extensions_api_url(path: str) -> str:
+  return f"http://{os.environ['AWS_LAMBDA_RUNTIME_API']}/{EXTENSIONS_API_VERSION}/extension/{path}"
+
+def register_extension(logger) -> bool:
+  """
+  Registers the internal extension for INVOKE events and starts its thread. Has to run during the init phase.
+  Returns whether tasks are deferred until after the response from now on.
+  """
+  global _extension_id
+  if _extension_id is not None:
+    return True
+  if "AWS_LAMBDA_RUNTIME_API" not in os.environ:
+    return False
+  if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "snap-start":
+    # the connection to the Extensions API would not survive the snapshot
+    logger.info("Post response extension not registered with SnapStart. Deferred tasks run before the response")
+    return False
+  request = urllib.request.Request(
+    _extensions_api_url("register"),
+    data=json.dumps({"events": ["INVOKE"]}).encode("utf-8"),
+    headers={"Lambda-Extension-Name": EXTENSION_NAME},
+    method="POST",
+  )
+  try:
+    with urllib.request.urlopen(request, timeout=2) as response:
+      extension_id = response.headers["Lambda-Extension-Identifier"]
+  except Exception as e:
+    logger.warning("Post response extension failed to register. Deferred tasks run before the response", extra={"error": str(e)})
+    return False
+  threading.Thread(target=_extension_loop, args=(extension_id, logger), name="post-response", daemon=True).start()
+  _extension_id = extension_id
+  return True
+
+def _extension_loop(extension_id: str, logger):
+  """
+  Waits for the next invocation, then for the tasks its handler deferred, and runs them.
+  Lambda only freezes the environment once this thread asks for the next event again.
+  An invocation handing off after the extension stopped waiting leaves its tasks in the queue. They are run
+  while waiting for the handoff of the next invocation, instead of being taken for its own.
+  """
+  request = urllib.request.Request(_extensions_api_url("event/next"), headers={"Lambda-Extension-Identifier": extension_id})
+  while True:
+    with urllib.request.urlopen(request) as response:
+      event = json.load(response)
+    deadline = event.get("deadlineMs", 0) / 1000 - DEADLINE_MARGIN_SECONDS
+    while True:
+      try:
+        request_id, tasks = _handoff.get(timeout=max(deadline - time.time(), 0))
+      except queue.Empty:
+        logger.warning("Invocation ended without handing off its deferred tasks", extra={"request_id": event.get("requestId")})
+        break
+      _run_tasks(tasks, logger)
+      if request_id == event.get("requestId"):
+        break
+      logger.warning("Ran the deferred tasks of an earlier invocation handed off late", extra={"request_id": request_id})
+
+def _run_tasks(tasks: list[tuple[Callable[[], None], object]], logger):
+  """
+  Runs deferred tasks, logging failures instead of raising them, as their response is already sent.
+  The spans recorded by a task are published right away instead of with the next invocation.
+  """
+  for task, profiler in tasks:
+    try:
+      task()
+    except Exception as e:
+      logger.error("Deferred task failed", extra={"error": str(e)})
+    finally:
+      if profiler is not None:
+        profiler.flush(logger, info_log=False)
+
+def defer(task: Callable[[], None], logger, profiler=None):
+  """
+  Runs task after the response of the current invocation. Tasks may be deferred from any thread,
+  their failures are logged, see _run_tasks.
+  Without the extension, task runs right away and its failures propagate like those of the handler.
+  """
+  if _extension_id is None:
+    task()
+    return
+  with _deferred_tasks_lock:
+    _deferred_tasks.append((task, profiler))
+
+def finish_invocation(context):
+  """
+  Hands the tasks deferred during the invocation to the extension. Every handler calls it once as it returns,
+  deferred tasks or not, since the extension waits for the handoff before it releases the invocation.
+  The handoff is tagged with the request id of the lambda context, which the extension matches to the INVOKE event.
+  """
+  if _extension_id is None:
+    return
+  with _deferred_tasks_lock:
+    tasks = _deferred_tasks[:]
+    _deferred_tasks.clear()
+  _handoff.put((getattr(context, "aws_request_id", None), tasks))
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from botocore.exceptions import ClientError
+
+# Compact index of the row hashes of every table from the last successful run
+ROW_INDEX_S3_KEY = "state/row-index.npz"
+
+CHANGE_INSERT = "insert"
+CHANGE_UPDATE = "update"
+CHANGE_DELETE = "delete"
+
+def _hash_columns(df: pd.DataFrame) -> np.ndarray:
+  """
+  Stable 64-bit hash per row over the string representation of all given columns.
+  """
+  return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy(dtype=np.uint64)
+
+def compute_row_index(df: pd.DataFrame, key_col_names: list[str]) -> tuple[np.ndarray, np.ndarray]:
+  """
+  Returns the key hash and the content hash of every row.
+  - The key hash identifies a row across runs, so a changed row is detected as update rather than delete and insert
+  - Rows sharing the same key columns are told apart by their order of occurrence
+  """
+  key_columns = df[key_col_names].astype(str)
+  key_columns["occurrence"] = key_columns.groupby(key_col_names, sort=False, dropna=False).cumcount().astype(str)
+  return _hash_columns(key_columns), _hash_columns(df)
+
+def compute_row_delta(
+  df: pd.DataFrame,
+  row_keys: np.ndarray,
+  row_hashes: np.ndarray,
+  previous_keys: np.ndarray,
+  previous_hashes: np.ndarray,
+) -> pd.DataFrame:
+  """
+  Compares the rows of a table against the index of the previous snapshot.
+  Returns inserted and updated rows with their content, deleted rows only with their row_key.
+  The leading change_type and row_key columns allow the delta to be applied by key.
+  """
+  previous_positions = pd.Index(previous_keys).get_indexer(row_keys)
+  is_insert = previous_positions == -1
+  is_update = np.zeros(len(row_keys), dtype=bool)
+  is_update[~is_insert] = previous_hashes[previous_positions[~is_insert]] != row_hashes[~is_insert]
+  is_delete = ~np.isin(previous_keys, row_keys)
+
+  changed = df.loc[is_insert | is_update].copy()
+  changed.insert(0, "row_key", [f"{key:016x}" for key in row_keys[is_insert | is_update]])
+  changed.insert(0, "change_type", np.where(is_insert[is_insert | is_update], CHANGE_INSERT, CHANGE_UPDATE))
+  deleted = pd.DataFrame({
+    "change_type": CHANGE_DELETE,
+    "row_key": [f"{key:016x}" for key in previous_keys[is_delete]],
+  })
+  return pd.concat([changed, deleted], ignore_index=True)
+
+def load_row_index(s3_bucket: str, s3_client, logger, state_prefix: str = "") -> dict[str, tuple[np.ndarray, np.ndarray]]:
+  """
+  Fetches the row index of the previous snapshot from s3.
+  Returns an empty dict if none has been persisted yet, so every row becomes an insert.
+  """
+  try:
+    response = s3_client.get_object(Bucket=s3_bucket, Key=f"{state_prefix}{ROW_INDEX_S3_KEY}")
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+      logger.warning("Failed to load row index", extra={"error": str(e)})
+    return {}
+  with np.load(BytesIO(response["Body"].read()), allow_pickle=False) as archive:
+    table_names = {name.rsplit(".", 1)[0] for name in archive.files}
+    return {
+      table_name: (archive[f"{table_name}.keys"], archive[f"{table_name}.hashes"])
+      for table_name in table_names
+    }
+
+def save_row_index(row_index: dict[str, tuple[np.ndarray, np.ndarray]], s3_bucket: str, s3_client, logger, state_prefix: str = ""):
+  """
+  Persists the row index of the current snapshot as compressed npz archive to s3.
+  """
+  arrays = {}
+  for table_name, (row_keys, row_hashes) in row_index.items():
+    arrays[f"{table_name}.keys"] = row_keys
+    arrays[f"{table_name}.hashes"] = row_hashes
+  s3_buffer = BytesIO()
+  np.savez_compressed(s3_buffer, **arrays)
+  s3_buffer.seek(0)
+  s3_client.upload_fileobj(s3_buffer, s3_bucket, f"{state_prefix}{ROW_INDEX_S3_KEY}")
+  logger.debug(f"Row index persisted to s3://{s3_bucket}/{state_prefix}{ROW_INDEX_S3_KEY}")
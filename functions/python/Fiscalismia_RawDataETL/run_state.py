@@ -0,0 +1,119 @@
+import json
+import hashlib
+from botocore.exceptions import ClientError
+
+# Persisted record of the last successful ETL run. Used to short-circuit
+# invocations for a spreadsheet whose content has not changed since.
+RUN_STATE_S3_KEY = "state/last-successful-run.json"
+
+def load_last_run(s3_bucket: str, s3_client, logger, state_prefix: str = "") -> dict | None:
+  """
+  Fetches the record of the last successful run from s3.
+  state_prefix namespaces the record per spreadsheet in batch mode, see batch.py.
+  Returns None if no run has been recorded yet or the record is unreadable.
+  """
+  try:
+    response = s3_client.get_object(Bucket=s3_bucket, Key=f"{state_prefix}{RUN_STATE_S3_KEY}")
+    last_run = json.loads(response["Body"].read())
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+      logger.warning("Failed to load last run state", extra={"error": str(e)})
+    return None
+  except ValueError as e:
+    logger.warning("Last run state is not valid JSON", extra={"error": str(e)})
+    return None
+  logger.debug("Loaded last run state", extra={"last_run": last_run})
+  return last_run
+
+def save_last_run(
+  s3_bucket: str,
+  s3_client,
+  fingerprint: dict,
+  s3_keys: list[str],
+  timestamp: str,
+  logger,
+  export_stats: dict | None = None,
+  manifest: dict | None = None,
+  state_prefix: str = ""
+):
+  """
+  Persists fingerprint of the processed spreadsheet alongside the s3 keys of its TSV files.
+  export_stats carries the recorded download and parse cost per export type, see export_selection.py.
+  manifest is returned again for an unchanged spreadsheet, see table_manifest.py.
+  """
+  last_run = {
+    **fingerprint,
+    "timestamp": timestamp,
+    "s3_keys": s3_keys,
+  }
+  if export_stats:
+    last_run["export_stats"] = export_stats
+  if manifest:
+    last_run["manifest"] = manifest
+  s3_client.put_object(
+    Bucket=s3_bucket,
+    Key=f"{state_prefix}{RUN_STATE_S3_KEY}",
+    Body=json.dumps(last_run).encode("utf-8"),
+    ContentType="application/json",
+  )
+  logger.debug(f"Run state persisted to s3://{s3_bucket}/{state_prefix}{RUN_STATE_S3_KEY}")
+
+def conditional_request_headers(last_run: dict | None, export_type: str) -> dict:
+  """
+  Builds If-None-Match / If-Modified-Since headers from validators Google returned on the last run.
+  Google Sheets exports rarely provide them, so the content hash remains the authoritative check.
+  """
+  headers = {}
+  if not last_run or not last_run.get("s3_keys") or last_run.get("export_type") != export_type:
+    return headers
+  if last_run.get("etag"):
+    headers["If-None-Match"] = last_run["etag"]
+  if last_run.get("last_modified"):
+    headers["If-Modified-Since"] = last_run["last_modified"]
+  return headers
+
+def fingerprint_response(response, raw_bytes, export_type: str) -> dict:
+  """
+  Returns the sha256 content hash of the downloaded sheet and the HTTP validators of its response.
+  """
+  return {
+    "export_type": export_type,
+    "sha256": hashlib.sha256(raw_bytes).hexdigest(),
+    "etag": response.headers.get("ETag", None),
+    "last_modified": response.headers.get("Last-Modified", None),
+  }
+
+def is_unchanged(last_run: dict | None, fingerprint: dict) -> bool:
+  """
+  True if the downloaded sheet is byte-identical to the one processed in the last successful run.
+  """
+  if not last_run or not last_run.get("s3_keys"):
+    return False
+  return (
+    last_run.get("export_type") == fingerprint["export_type"]
+    and last_run.get("sha256") == fingerprint["sha256"]
+  )
+
+def generate_presigned_urls(s3_keys: list[str], s3_bucket: str, s3_client) -> list[str]:
+  """
+  Returns short-lived presigned GET URLs for the given s3 keys, preserving their order.
+  """
+  return [
+    s3_client.generate_presigned_url(
+      ClientMethod='get_object',
+      Params={
+          'Bucket': s3_bucket,
+          'Key': s3_key
+      },
+      ExpiresIn=300
+    )
+    for s3_key in s3_keys
+  ]
+
+def aggregate_presigned_urls(manifest: dict, s3_bucket: str, s3_client) -> dict[str, str]:
+  """
+  Presigned urls of the aggregates listed in a manifest, keyed by aggregate name.
+  """
+  entries = manifest.get("aggregates", [])
+  presigned_urls = generate_presigned_urls([entry["s3_key"] for entry in entries], s3_bucket, s3_client)
+  return {entry["table"]: presigned_url for entry, presigned_url in zip(entries, presigned_urls)}
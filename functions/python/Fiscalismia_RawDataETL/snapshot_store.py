@@ -0,0 +1,236 @@
+from __future__ import annotations
+import hashlib
+import re
+from concurrent.futures import Future
+from io import BytesIO
+from typing import TYPE_CHECKING
+from botocore.exceptions import ClientError
+from output_formats import serialize_table
+from stream_ingest import BACKUP_TRANSFER_CONFIG, MemoryViewReader, backup_executor
+if TYPE_CHECKING:
+  import pandas as pd
+
+# Content addressed store of the raw spreadsheet exports downloaded by the ETL runs.
+#   snapshots/raw/<sha256>.<export type>                            raw export, stored once per distinct content
+#   snapshots/catalog/<state prefix><date>/<run id>_<sha256>.<ext>  empty marker per run, listing alone yields the history
+#   snapshots/extracted/<sha256>.<cache tag>/<table>.tsv.gz         tables of a snapshot as returned by load_tables_from_sheet
+# Dates of the catalog are the Europe/Berlin dates the run ids start with, so keys sort chronologically.
+# Batch targets keep their own history below their state prefix, e.g. snapshots/catalog/targets/<name>/, see batch.py.
+# Raw exports are shared, extracted tables are cached per ddl_schema profile.
+# Extracted tables are cached as gzipped TSV like the outputs of the runs and typed again on load, see
+# column_types.restore_column_types. Unlike pickles, objects of the bucket never execute code when read.
+RAW_PREFIX = "snapshots/raw/"
+CATALOG_PREFIX = "snapshots/catalog/"
+EXTRACTED_PREFIX = "snapshots/extracted/"
+# Raw backups written before the snapshot store, migrated by compact_snapshots
+LEGACY_BACKUP_PATTERN = re.compile(r"^tmp/(?P<run_id>.+)-Fiscalismia-Datasource\.(?P<export_type>csv|xlsx)$")
+# Catalog keys relative to the catalog prefix of their state prefix. Keys of batch targets never match the default one
+CATALOG_KEY_PATTERN = re.compile(
+  r"^(?P<date>\d{4}-\d{2}-\d{2})/(?P<run_id>.+)_(?P<sha256>[0-9a-f]{64})\.(?P<export_type>csv|xlsx)$"
+)
+
+def raw_snapshot_key(sha256: str, export_type: str) -> str:
+  return f"{RAW_PREFIX}{sha256}.{export_type}"
+
+def catalog_key(run_id: str, sha256: str, export_type: str, state_prefix: str = "") -> str:
+  return f"{CATALOG_PREFIX}{state_prefix}{run_id[:10]}/{run_id}_{sha256}.{export_type}"
+
+# Serialization of the cached extracted tables, see output_formats.py
+EXTRACTED_FORMAT = "tsv.gz"
+
+def _extracted_cache_tag(profile: str) -> str:
+  # cached tables are only read back by the table definitions that wrote them
+  from ddl_schema import SCHEMA_VERSION
+  return f"{profile}.schema{SCHEMA_VERSION}"
+
+def extracted_table_key(sha256: str, profile: str, table_name: str) -> str:
+  return f"{EXTRACTED_PREFIX}{sha256}.{_extracted_cache_tag(profile)}/{table_name}.{EXTRACTED_FORMAT}"
+
+def _exists(s3_bucket: str, s3_key: str, s3_client) -> bool:
+  try:
+    s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+      return False
+    raise
+  return True
+
+def _list_keys(s3_bucket: str, prefix: str, s3_client, start_after: str | None = None):
+  """
+  Yields all keys below prefix in lexicographic order, following continuation tokens.
+  """
+  request = {"Bucket": s3_bucket, "Prefix": prefix}
+  if start_after:
+    request["StartAfter"] = start_after
+  while True:
+    response = s3_client.list_objects_v2(**request)
+    for entry in response.get("Contents", []):
+      if not start_after or entry["Key"] > start_after:
+        yield entry["Key"]
+    if not response.get("IsTruncated"):
+      return
+    request["ContinuationToken"] = response["NextContinuationToken"]
+
+def store_snapshot(view: memoryview, sha256: str, export_type: str, run_id: str, s3_bucket: str, s3_client, state_prefix: str = "") -> bool:
+  """
+  Stores the raw export unless a snapshot with the same content exists and records the run in the catalog
+  of state_prefix. Returns whether the raw export was uploaded.
+  """
+  s3_key = raw_snapshot_key(sha256, export_type)
+  uploaded = not _exists(s3_bucket, s3_key, s3_client)
+  if uploaded:
+    s3_client.upload_fileobj(MemoryViewReader(view), s3_bucket, s3_key, Config=BACKUP_TRANSFER_CONFIG)
+  s3_client.put_object(Bucket=s3_bucket, Key=catalog_key(run_id, sha256, export_type, state_prefix), Body=b"")
+  return uploaded
+
+def _store_snapshot_in_span(view: memoryview, fingerprint: dict, run_id: str, s3_bucket: str, s3_client, profiler, parent, state_prefix: str):
+  with profiler.span("backup", parent=parent) as backup_span:
+    if store_snapshot(view, fingerprint["sha256"], fingerprint["export_type"], run_id, s3_bucket, s3_client, state_prefix):
+      backup_span.add_bytes(len(view))
+    else:
+      backup_span.add_counts({"deduplicated": 1})
+
+def start_snapshot_backup(view: memoryview, fingerprint: dict, run_id: str, s3_bucket: str, s3_client, profiler, state_prefix: str = "") -> Future:
+  """
+  Stores the buffer in the snapshot store in the background, while the caller parses the same buffer.
+  The backup span is recorded as child of the caller's innermost open span.
+  """
+  parent = profiler.current_span()
+  return backup_executor.submit(_store_snapshot_in_span, view, fingerprint, run_id, s3_bucket, s3_client, profiler, parent, state_prefix)
+
+def list_snapshots(
+  s3_bucket: str,
+  s3_client,
+  start_date: str | None = None,
+  end_date: str | None = None,
+  state_prefix: str = ""
+) -> list[dict]:
+  """
+  Returns the catalog entries of all runs between start_date and end_date (inclusive, YYYY-MM-DD) in chronological order.
+  state_prefix selects the history of a batch target instead of the default spreadsheet.
+  """
+  prefix = f"{CATALOG_PREFIX}{state_prefix}"
+  start_after = f"{prefix}{start_date}" if start_date else None
+  snapshots = []
+  for s3_key in _list_keys(s3_bucket, prefix, s3_client, start_after):
+    match = CATALOG_KEY_PATTERN.match(s3_key[len(prefix):])
+    if match is None:
+      continue
+    if end_date and match["date"] > end_date:
+      break
+    snapshots.append(match.groupdict())
+  return snapshots
+
+def find_snapshot(as_of: str, s3_bucket: str, s3_client, state_prefix: str = "") -> dict:
+  """
+  Returns the catalog entry of the last run on or before as_of, a date (YYYY-MM-DD) or run id, within the history of state_prefix.
+  Raises RuntimeError if no run precedes it.
+  """
+  snapshots = list_snapshots(s3_bucket, s3_client, end_date=as_of[:10], state_prefix=state_prefix)
+  candidates = [snapshot for snapshot in snapshots if snapshot["run_id"][:len(as_of)] <= as_of]
+  if not candidates:
+    raise RuntimeError(f"No snapshot recorded on or before {as_of}")
+  return candidates[-1]
+
+def _get_body(s3_bucket: str, s3_key: str, s3_client) -> bytes | None:
+  try:
+    return s3_client.get_object(Bucket=s3_bucket, Key=s3_key)["Body"].read()
+  except ClientError as e:
+    if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+      return None
+    raise
+
+def _read_extracted(snapshot: dict, profile: str, tables: dict[str, dict], s3_bucket: str, s3_client, profiler) -> dict[str, pd.DataFrame] | None:
+  """
+  Returns the cached tables of a snapshot, or None unless every table is cached.
+  """
+  import pandas as pd
+  from column_types import restore_column_types
+  extracted = {}
+  for table_name, table_def in tables.items():
+    with profiler.span("load_extracted", {"Table": table_name}) as load_span:
+      cached = _get_body(s3_bucket, extracted_table_key(snapshot["sha256"], profile, table_name), s3_client)
+      if cached is None:
+        return None
+      load_span.add_bytes(len(cached))
+      # read as plain strings, "" included, and typed like the table the TSV was written from
+      df = pd.read_csv(BytesIO(cached), sep="\t", compression="gzip", dtype=str, na_filter=False)
+      extracted[table_name] = restore_column_types(df, table_def)
+      load_span.add_rows(len(df))
+  return extracted
+
+def load_extracted_tables(snapshot: dict, s3_bucket: str, s3_client, logger, profiler=None, target: dict | None = None) -> dict[str, pd.DataFrame]:
+  """
+  Loads the tables of a snapshot listed in the catalog, as load_tables_from_sheet returns them for the live sheet.
+  - Served from the extracted form cached per content hash and profile, so backfills never parse the same export twice
+  - On a cache miss the raw export is parsed and extracted once and the result is cached
+  - A target of the batch mode selects its ddl_schema profile, see batch.py
+  """
+  from ddl_schema import TABLES
+  from instrumentation import Profiler
+  profiler = profiler or Profiler("Fiscalismia_RawDataETL")
+  tables = target["tables"] if target else None
+  profile = target["profile"] if target else "default"
+  extracted = _read_extracted(snapshot, profile, tables or TABLES, s3_bucket, s3_client, profiler)
+  if extracted is not None:
+    logger.debug("Loaded extracted snapshot from cache", extra={"run_id": snapshot["run_id"], "sha256": snapshot["sha256"]})
+    return extracted
+
+  from extract_transform import load_tables_from_sheet
+  with profiler.span("load_raw"):
+    raw = s3_client.get_object(Bucket=s3_bucket, Key=raw_snapshot_key(snapshot["sha256"], snapshot["export_type"]))["Body"].read()
+  with profiler.span("parse", {"ExportType": snapshot["export_type"]}):
+    if snapshot["export_type"] == "xlsx":
+      from download_xlsx import parse_xlsx as parse_export
+    else:
+      from download_csv import parse_csv as parse_export
+    sheet = parse_export(memoryview(raw), tables)
+  extracted = load_tables_from_sheet(sheet, logger, profiler=profiler, tables=tables)
+  for table_name, df in extracted.items():
+    with profiler.span("save_extracted", {"Table": table_name}) as save_span:
+      buffer, extra_args = serialize_table(df, EXTRACTED_FORMAT)
+      save_span.add_bytes(buffer.getbuffer().nbytes)
+      s3_client.put_object(
+        Bucket=s3_bucket, Key=extracted_table_key(snapshot["sha256"], profile, table_name), Body=buffer.getvalue(), **extra_args
+      )
+  logger.info("Extracted snapshot and cached the result", extra={"run_id": snapshot["run_id"], "sha256": snapshot["sha256"]})
+  return extracted
+
+def load_snapshot_tables(as_of: str, s3_bucket: str, s3_client, logger, profiler=None, target: dict | None = None) -> dict[str, pd.DataFrame]:
+  """
+  Loads the tables of the snapshot valid at as_of, a date (YYYY-MM-DD) or run id, see load_extracted_tables.
+  A target of the batch mode selects its own history and ddl_schema profile.
+  """
+  snapshot = find_snapshot(as_of, s3_bucket, s3_client, target["state_prefix"] if target else "")
+  return load_extracted_tables(snapshot, s3_bucket, s3_client, logger, profiler, target)
+
+def compact_snapshots(s3_bucket: str, s3_client, logger) -> dict[str, int]:
+  """
+  Compacts the snapshot store and returns counters of the work done.
+  - Moves the raw backups under tmp/ into the store, keeping a single copy per distinct content
+  - Deletes extracted tables cached for outdated table definitions or removed profiles
+  """
+  from ddl_schema import PROFILES
+  stats = {"migrated": 0, "deduplicated": 0, "deleted_bytes": 0, "stale_extracted": 0}
+  for s3_key in list(_list_keys(s3_bucket, "tmp/", s3_client)):
+    match = LEGACY_BACKUP_PATTERN.match(s3_key)
+    if match is None:
+      continue
+    raw = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)["Body"].read()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    if store_snapshot(memoryview(raw), sha256, match["export_type"], match["run_id"], s3_bucket, s3_client):
+      stats["migrated"] += 1
+    else:
+      stats["deduplicated"] += 1
+      stats["deleted_bytes"] += len(raw)
+    s3_client.delete_object(Bucket=s3_bucket, Key=s3_key)
+
+  cache_suffixes = tuple(f".{_extracted_cache_tag(profile)}" for profile in PROFILES)
+  for s3_key in list(_list_keys(s3_bucket, EXTRACTED_PREFIX, s3_client)):
+    # keys of the pickles cached before are deleted along with those of outdated table definitions
+    cache_dir, _, _ = s3_key[len(EXTRACTED_PREFIX):].partition("/")
+    if not cache_dir.endswith(cache_suffixes):
+      s3_client.delete_object(Bucket=s3_bucket, Key=s3_key)
+      stats["stale_extracted"] += 1
+  logger.info("Compacted snapshot store", extra={"compaction": stats})
+  return stats
@@ -0,0 +1,79 @@
+import functools
+import uuid
+import zoneinfo
+from datetime import datetime
+from etl_config import UPLOAD_CONCURRENCY, PRIME_ON_INIT, BATCH_CONCURRENCY
+
+# Startup of the RawDataETL function.
+# Module import of index.py is kept free of pandas and the s3 client, so that rejected requests and
+# unchanged spreadsheets never pay for them. prime() front-loads the deferred work where it is free,
+# which is before a SnapStart snapshot is taken or optionally during the init phase.
+
+berlin_tz = zoneinfo.ZoneInfo("Europe/Berlin")
+# Modules deferred until first use, imported up front by prime()
+DEFERRED_MODULES = ("pandas", "numpy", "python_calamine", "download_csv", "download_xlsx", "extract_transform")
+
+@functools.cache
+def get_s3_client():
+  """
+  Creates the s3 client on first use and reuses it across warm invocations.
+  The connection pool is shared by the concurrent table uploads and the multipart raw backups
+  of the spreadsheets processed concurrently in batch mode.
+  """
+  import boto3
+  from botocore.client import Config
+  from stream_ingest import BACKUP_TRANSFER_CONFIG
+  return boto3.client('s3', config=Config(
+    signature_version='s3v4',
+    max_pool_connections=UPLOAD_CONCURRENCY + BATCH_CONCURRENCY * BACKUP_TRANSFER_CONFIG.max_request_concurrency,
+  ))
+
+@functools.cache
+def get_pipeline_executor():
+  """
+  Worker threads of the pipelined startup, reused across warm invocations. See etl_config.PIPELINED_STARTUP
+  Two workers fit the widest stage, the secrets fetch running alongside the last run lookup.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+  return ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline")
+
+def import_deferred_modules():
+  import importlib
+  for module_name in DEFERRED_MODULES:
+    importlib.import_module(module_name)
+
+def new_run_identity(context) -> tuple[str, str]:
+  """
+  Returns the timestamp and the run id of an invocation.
+  The run id prefixes all s3 keys written by the run. It extends the timestamp by the start of the
+  request id, so runs within the same second do not overwrite each other.
+  """
+  timestamp = datetime.now(tz=berlin_tz).strftime("%Y-%m-%d_%H-%M-%S")
+  request_id = getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+  return timestamp, f"{timestamp}-{request_id.replace('-', '')[:8]}"
+
+def prime(logger):
+  """
+  Imports the deferred modules, creates the s3 client and runs the CSV parser once on a tiny input,
+  which loads the lazily initialized parts of pandas.
+  """
+  import io
+  import_deferred_modules()
+  get_s3_client()
+  import pandas as pd
+  pd.read_csv(io.BytesIO(b"a,b\n1,2\n"), header=None, dtype=str, na_filter=False, engine="c")
+  logger.info("Function primed", extra={"modules": list(DEFERRED_MODULES)})
+
+def register_priming(logger):
+  """
+  Registers prime() as SnapStart runtime hook, so its cost is captured in the snapshot.
+  snapshot_restore_py is provided by the lambda python runtime and missing elsewhere.
+  """
+  try:
+    from snapshot_restore_py import register_before_snapshot
+  except ImportError:
+    register_before_snapshot = None
+  if register_before_snapshot:
+    register_before_snapshot(prime, logger)
+  if PRIME_ON_INIT:
+    prime(logger)
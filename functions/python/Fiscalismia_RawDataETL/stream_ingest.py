@@ -0,0 +1,77 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from etl_config import BATCH_CONCURRENCY
+
+# Size of chunks read from the HTTP response body
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Multipart upload reads one part at a time from the shared buffer. This bounds the
+# additional memory held by the backup to max_concurrency * multipart_chunksize
+BACKUP_TRANSFER_CONFIG = TransferConfig(
+  multipart_threshold=8 * 1024 * 1024,
+  multipart_chunksize=8 * 1024 * 1024,
+  max_concurrency=2,
+)
+# Lives across warm invocations, one worker per spreadsheet processed concurrently
+backup_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="raw-backup")
+
+class MemoryViewReader(io.RawIOBase):
+  """
+  Seekable read-only file object over a memoryview.
+  Several readers can share the same buffer without copying it, each with its own position.
+  """
+  def __init__(self, view: memoryview):
+    self._view = view
+    self._position = 0
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def readinto(self, target) -> int:
+    size = min(len(target), len(self._view) - self._position)
+    if size <= 0:
+      return 0
+    target[:size] = self._view[self._position:self._position + size]
+    self._position += size
+    return size
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_SET:
+      position = offset
+    elif whence == io.SEEK_CUR:
+      position = self._position + offset
+    elif whence == io.SEEK_END:
+      position = len(self._view) + offset
+    else:
+      raise ValueError(f"Invalid whence: {whence}")
+    if position < 0:
+      raise ValueError(f"Negative seek position: {position}")
+    self._position = position
+    return self._position
+
+  def tell(self) -> int:
+    return self._position
+
+def read_response_body(response, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> memoryview:
+  """
+  Reads a streamed HTTP response body chunk by chunk into a single buffer.
+  - Preallocates the buffer if the uncompressed size is known from Content-Length
+  - Returns a zero-copy memoryview over the buffer
+  """
+  content_length = response.headers.get("Content-Length", None)
+  if content_length and not response.headers.get("Content-Encoding", None):
+    buffer = bytearray(int(content_length))
+    position = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+      buffer[position:position + len(chunk)] = chunk
+      position += len(chunk)
+    # truncates the buffer if the body was shorter than announced
+    del buffer[position:]
+  else:
+    buffer = bytearray()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+      buffer += chunk
+  return memoryview(buffer)
@@ -0,0 +1,65 @@
+import hashlib
+import json
+from io import BytesIO
+from ddl_schema import SCHEMA_VERSION
+
+# Manifest of the tables written by a run, returned to clients and persisted next to the tables.
+# Tables are stored under content addressed keys. A table whose serialized bytes did not change keeps
+# its key across runs, so clients and CDN caches holding a table with the same hash can skip it.
+
+TABLES_S3_PREFIX = "transformed/"
+AGGREGATES_S3_PREFIX = "transformed/aggregates/"
+INDEXES_S3_PREFIX = "transformed/indexes/"
+
+def content_addressed_key(table_name: str, content_hash: str, output_format: str, s3_prefix: str = TABLES_S3_PREFIX) -> str:
+  return f"{s3_prefix}{table_name}/{content_hash}.{output_format}"
+
+def manifest_entry(
+  table_name: str,
+  row_count: int,
+  s3_buffer: BytesIO,
+  output_format: str,
+  s3_prefix: str = TABLES_S3_PREFIX
+) -> dict:
+  """
+  Describes a serialized table. The hash covers the bytes as stored in s3, i.e. after compression.
+  """
+  content_hash = hashlib.sha256(s3_buffer.getbuffer()).hexdigest()
+  return {
+    "table": table_name,
+    "rows": row_count,
+    "bytes": s3_buffer.getbuffer().nbytes,
+    "sha256": content_hash,
+    "schema_version": SCHEMA_VERSION,
+    "output_format": output_format,
+    "s3_key": content_addressed_key(table_name, content_hash, output_format, s3_prefix),
+  }
+
+def build_manifest(run_id: str, tables: list[dict], aggregates: list[dict] | None = None, indexes: list[dict] | None = None) -> dict:
+  """
+  Lists the tables of a run. Aggregates and interval indexes are listed in the same form as tables,
+  see aggregates.py and interval_index.py. The rows of an index entry are the rows of the indexed table.
+  """
+  manifest = {
+    "run_id": run_id,
+    "schema_version": SCHEMA_VERSION,
+    "tables": tables,
+  }
+  if aggregates is not None:
+    manifest["aggregates"] = aggregates
+  if indexes:
+    manifest["indexes"] = indexes
+  return manifest
+
+def put_manifest(manifest: dict, s3_bucket: str, s3_client, logger):
+  """
+  Persists a manifest once all of its tables are uploaded.
+  """
+  s3_key = f"transformed/{manifest['run_id']}-manifest.json"
+  s3_client.put_object(
+    Bucket=s3_bucket,
+    Key=s3_key,
+    Body=json.dumps(manifest).encode("utf-8"),
+    ContentType="application/json",
+  )
+  logger.debug(f"Manifest persisted to s3://{s3_bucket}/{s3_key}")
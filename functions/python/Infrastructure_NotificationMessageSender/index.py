@@ -1,13 +1,54 @@
+import asyncio
 import json
 import os
+import time
 from datetime import datetime
+from secrets_cache import SecretsCache
+from telegram_sender import NotificationSender, format_notification
 
 print('Loading function: Infrastructure_NotificationMessageSender')
 
+BOT_TOKEN_PARAMETER = "/telegram/fiscalismia/BOT_TOKEN"
+CHAT_ID_PARAMETER = "/telegram/fiscalismia/CHAT_ID"
+# Notifications unsent this close to the lambda timeout are reported as failed instead of timing out the batch
+TIMEOUT_MARGIN_SECONDS = float(os.environ.get("NOTIFICATION_TIMEOUT_MARGIN_SECONDS", "2"))
+# SecureStrings from AWS Parameter Store, fetched in one batch and cached across warm invocations
+secrets = SecretsCache([BOT_TOKEN_PARAMETER, CHAT_ID_PARAMETER])
+# The event loop outlives invocations, so the connections of the bot, its rate limiters
+# and its dedupe window are reused by warm invocations
+loop = asyncio.new_event_loop()
+senders = {}
+
+def get_sender(token):
+    if token not in senders:
+        senders.clear()
+        senders[token] = NotificationSender(token)
+    return senders[token]
+
+def parse_records(records, default_chat_id):
+    """
+    Turns SNS records into notifications. The chat_id message attribute overrides the default chat.
+    """
+    notifications = []
+    for index, record in enumerate(records):
+        sns = record.get('Sns', {})
+        text, dedupe_key = format_notification(sns.get('Subject'), sns.get('Message', ''))
+        chat_id = sns.get('MessageAttributes', {}).get('chat_id', {}).get('Value', default_chat_id)
+        notifications.append({
+            "id": sns.get('MessageId', str(index)),
+            "chat_id": chat_id,
+            "text": text,
+            "dedupe_key": dedupe_key
+        })
+    return notifications
+
 def lambda_handler(event, context):
     """
     Lambda function to send notification messages.
-    Triggered by SNS to process and forward notifications.
+    Triggered by SNS to process and forward notifications to Telegram.
+    Every record of the event is sent, see telegram_sender.py. SNS invokes asynchronously and discards the response,
+    so failed notifications raise after all results are logged. Lambda then retries the event and finally hands it
+    to the dead-letter queue. Notifications sent before are skipped as duplicates by the same warm sender.
     """
     function_name = context.function_name
     request_id = context.request_id
@@ -15,25 +56,33 @@ def lambda_handler(event, context):
     print(f"Function: {function_name} | Request ID: {request_id}")
     print(f"Invoked at: {datetime.utcnow().isoformat()}")
 
-    # Extract SNS message
+    # Extract SNS messages
     try:
         if 'Records' in event and len(event['Records']) > 0:
-            sns_message = event['Records'][0]['Sns']['Message']
-            sns_subject = event['Records'][0]['Sns'].get('Subject', 'No Subject')
+            secret_values = secrets.get_all()
+            if not secret_values[BOT_TOKEN_PARAMETER] or not secret_values[CHAT_ID_PARAMETER]:
+                raise RuntimeError(f"Parameters {BOT_TOKEN_PARAMETER} and {CHAT_ID_PARAMETER} are required")
+            notifications = parse_records(event['Records'], secret_values[CHAT_ID_PARAMETER])
+            print(f"SNS Records: {len(notifications)}")
 
-            print(f"SNS Subject: {sns_subject}")
-            print(f"SNS Message: {sns_message}")
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - TIMEOUT_MARGIN_SECONDS
+            sender = get_sender(secret_values[BOT_TOKEN_PARAMETER])
+            results = loop.run_until_complete(sender.send_all(notifications, deadline))
 
-            # TODO: Implement your notification logic here
-            # Example: Send email, post to Slack, write to database, etc.
+            failed = [result for result in results if result["status"] == "failed"]
+            for result in failed:
+                print(f"Failed to send notification {result['id']}: {result['error']}")
+            print(f"Notifications sent: {sum(result['status'] == 'sent' for result in results)} | "
+                  f"Duplicates: {sum(result['status'] == 'duplicate' for result in results)} | Failed: {len(failed)}")
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(results)} notifications failed: {[result['id'] for result in failed]}")
 
             return {
                 "statusCode": 200,
                 "body": json.dumps({
-                    "message": "Notification sent successfully",
+                    "message": "Notifications sent successfully",
                     "function": function_name,
-                    "subject": sns_subject,
-                    "notification_content": sns_message
+                    "results": results
                 })
             }
         else:
@@ -44,4 +93,4 @@ def lambda_handler(event, context):
             }
     except Exception as e:
         print(f"Error processing notification: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+# Delivery of notifications as Telegram messages via python-telegram-bot from Infrastructure_PythonDependencies.
+# - Every notification of an invocation is sent concurrently on the event loop of the caller
+# - Token buckets keep within the flood limits of Telegram: about one message per second per chat,
+#   20 per minute per group and 30 per second overall. Messages wait for a token instead of being rejected
+# - Identical notifications to the same chat are sent once within the dedupe window
+# - Failures are reported per notification, the remaining notifications are sent regardless
+
+# Bot API endpoint the bot token is appended to. Pointed at a local stub bot API for tests
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+DEDUPE_WINDOW_SECONDS = float(os.environ.get("NOTIFICATION_DEDUPE_WINDOW_SECONDS", "300"))
+MAX_SEND_ATTEMPTS = int(os.environ.get("NOTIFICATION_MAX_SEND_ATTEMPTS", "3"))
+CHAT_MESSAGES_PER_SECOND = 1.0
+GROUP_MESSAGES_PER_SECOND = 20 / 60
+GLOBAL_MESSAGES_PER_SECOND = 30.0
+# Longer message texts are truncated
+MAX_MESSAGE_LENGTH = 4096
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Rate limiter refilling rate tokens per second up to capacity.
+    A waiting sender reserves its token before sleeping, so senders are served in order of arrival.
+    Runs on a single event loop and needs no locking.
+    """
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, deadline=None):
+        """
+        Waits for a token. Raises DeadlineExceeded without taking one if it is not available before deadline,
+        a time.monotonic() value.
+        """
+        self._refill()
+        delay = max((1 - self.tokens) / self.rate, 0.0)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise DeadlineExceeded(f"Rate limit delay of {delay:.1f}s exceeds the remaining time")
+        self.tokens -= 1
+        if delay:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """
+        Withholds tokens for seconds, e.g. after Telegram answered with a flood wait.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+def format_notification(subject, message):
+    """
+    Returns the message text and the dedupe key of an SNS notification.
+    CloudWatch alarm notifications are reduced to alarm name, state and reason. Their dedupe key leaves out
+    the reason, which differs in datapoints and timestamps between otherwise identical alarms.
+    """
+    try:
+        alarm = json.loads(message)
+    except ValueError:
+        alarm = None
+    if isinstance(alarm, dict) and "AlarmName" in alarm:
+        state = alarm.get("NewStateValue", "UNKNOWN")
+        text = f"{alarm['AlarmName']}: {state}\n{alarm.get('NewStateReason', '')}".strip()
+        dedupe_key = f"alarm\n{alarm['AlarmName']}\n{state}"
+    else:
+        text = f"{subject}\n\n{message}" if subject else message
+        dedupe_key = f"text\n{text}"
+    return text[:MAX_MESSAGE_LENGTH], dedupe_key
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class NotificationSender:
+    """
+    Sends notifications through a bot. Created once per bot token and reused across warm invocations
+    on the same event loop, keeping connections, rate limiters and the dedupe window.
+    """
+
+    def __init__(self, token, base_url=TELEGRAM_API_BASE_URL, dedupe_window_seconds=DEDUPE_WINDOW_SECONDS,
+                 max_attempts=MAX_SEND_ATTEMPTS):
+        self.bot = Bot(token, base_url=base_url, request=HTTPXRequest(connection_pool_size=32))
+        self.dedupe_window_seconds = dedupe_window_seconds
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(GLOBAL_MESSAGES_PER_SECOND, capacity=GLOBAL_MESSAGES_PER_SECOND)
+        self.chat_buckets = {}
+        # dedupe hash -> monotonic time of the last successful send
+        self.sent_at = {}
+
+    def _chat_bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            # group and channel ids are negative
+            rate = GROUP_MESSAGES_PER_SECOND if str(chat_id).startswith("-") else CHAT_MESSAGES_PER_SECOND
+            self.chat_buckets[chat_id] = TokenBucket(rate)
+        return self.chat_buckets[chat_id]
+
+    async def _send(self, chat_id, text, deadline):
+        """
+        Sends a message and returns its message id. Flood waits and network failures are retried
+        up to max_attempts. Rejected messages, e.g. for an unknown chat, are not.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(1, self.max_attempts + 1):
+            await chat_bucket.acquire(deadline)
+            await self.global_bucket.acquire(deadline)
+            try:
+                message = await self.bot.send_message(chat_id=chat_id, text=text)
+                return message.message_id
+            except RetryAfter as e:
+                if attempt == self.max_attempts:
+                    raise
+                # the next token of the chat is only available once the flood wait is over
+                chat_bucket.pause(_retry_after_seconds(e))
+            except BadRequest:
+                raise
+            except NetworkError:
+                if attempt == self.max_attempts:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+    def _prune_sent(self, now):
+        for dedupe_hash in [key for key, sent_at in self.sent_at.items() if now - sent_at >= self.dedupe_window_seconds]:
+            del self.sent_at[dedupe_hash]
+
+    async def send_all(self, notifications, deadline=None):
+        """
+        Sends notifications, dicts of id, chat_id, text and dedupe_key, concurrently.
+        Returns a result per notification in the same order: id, status "sent", "duplicate" or "failed",
+        and the message id or error. deadline is a time.monotonic() value after which no message is sent.
+        """
+        self._prune_sent(time.monotonic())
+        results = [None] * len(notifications)
+        # notifications with the same chat and dedupe key share a single send
+        pending = {}
+        for index, notification in enumerate(notifications):
+            dedupe_hash = hashlib.sha256(f"{notification['chat_id']}\n{notification['dedupe_key']}".encode("utf-8")).hexdigest()
+            if dedupe_hash in self.sent_at:
+                results[index] = {"id": notification["id"], "status": "duplicate"}
+            elif dedupe_hash in pending:
+                pending[dedupe_hash][1].append(index)
+            else:
+                pending[dedupe_hash] = (notification, [index])
+
+        sends = [self._send(notification["chat_id"], notification["text"], deadline) for notification, _ in pending.values()]
+        outcomes = await asyncio.gather(*sends, return_exceptions=True)
+        for (dedupe_hash, (notification, indexes)), outcome in zip(pending.items(), outcomes):
+            if isinstance(outcome, BaseException):
+                first = {"id": notification["id"], "status": "failed", "error": f"{type(outcome).__name__}: {outcome}"}
+            else:
+                self.sent_at[dedupe_hash] = time.monotonic()
+                first = {"id": notification["id"], "status": "sent", "message_id": outcome}
+            results[indexes[0]] = first
+            for index in indexes[1:]:
+                duplicate = {"id": notifications[index]["id"], "status": "duplicate" if first["status"] == "sent" else "failed"}
+                if "error" in first:
+                    duplicate["error"] = first["error"]
+                results[index] = duplicate
+        return results
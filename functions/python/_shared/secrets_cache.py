@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+
+# Shared by all python functions. create_function_archives.sh adds the modules of functions/python/_shared
+# to the root of every function archive, so they are imported by their top level name.
+#
+# Usage:
+#   secrets = SecretsCache(
+#     ["/api/fiscalismia/API_GW_SECRET_KEY", "/google/sheets/fiscalismia-datasource-url"],
+#     ttl_overrides={"/api/fiscalismia/API_GW_SECRET_KEY": (60, 0)},
+#   )
+#   values = secrets.get_all()
+
+# Values younger than the TTL are served from memory
+DEFAULT_TTL_SECONDS = float(os.environ.get("SECRETS_CACHE_TTL_SECONDS", "300"))
+# Values older than the TTL but within the stale window are served while a background refresh runs
+DEFAULT_STALE_SECONDS = float(os.environ.get("SECRETS_CACHE_STALE_SECONDS", "3600"))
+# Upper limit of names per GetParameters request
+SSM_BATCH_SIZE = 10
+
+class SecretsCache:
+  """
+  Caches Parameter Store values across warm invocations of a lambda environment.
+  - Names due for a fetch are fetched together in batched GetParameters calls with decryption
+  - Fresh values are served from memory, stale ones trigger a single background refresh
+  - Values past the stale window, or never fetched, block on a synchronous fetch
+  - ttl_overrides sets (ttl_seconds, stale_seconds) of single names, e.g. of credentials
+  - Counters of hits, stale hits, misses and refreshes can be collected per invocation via pop_stats()
+  Parameters missing in Parameter Store are cached as None.
+  A background refresh started just before lambda freezes the environment only completes with the next invocation.
+  Credentials that requests are checked against should therefore be cached with stale_seconds=0.
+  """
+  def __init__(
+    self,
+    names: list[str],
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    stale_seconds: float = DEFAULT_STALE_SECONDS,
+    ssm_client=None,
+    logger=None,
+    ttl_overrides: dict[str, tuple[float, float]] | None = None,
+  ):
+    self.names = list(names)
+    self.ttl_seconds = ttl_seconds
+    self.stale_seconds = stale_seconds
+    self.ttl_overrides = dict(ttl_overrides or {})
+    self.logger = logger or logging.getLogger("secrets_cache")
+    self._ssm_client = ssm_client
+    self._values: dict[str, str | None] = {}
+    # monotonic time of the last fetch per name
+    self._fetched_at: dict[str, float] = {}
+    self._lock = threading.Lock()
+    self._refresh_thread: threading.Thread | None = None
+    self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0}
+
+  def _client(self):
+    if self._ssm_client is None:
+      # boto3 is part of the lambda runtime. Imported on first fetch to keep module import cheap
+      import boto3
+      self._ssm_client = boto3.client("ssm")
+    return self._ssm_client
+
+  def _fetch(self, names: list[str]) -> dict[str, str | None]:
+    values = dict.fromkeys(names)
+    for batch_start in range(0, len(names), SSM_BATCH_SIZE):
+      response = self._client().get_parameters(
+        Names=names[batch_start:batch_start + SSM_BATCH_SIZE],
+        WithDecryption=True,
+      )
+      for parameter in response["Parameters"]:
+        values[parameter["Name"]] = parameter["Value"]
+      if response.get("InvalidParameters"):
+        self.logger.warning(f"Parameters not found: {response['InvalidParameters']}")
+    return values
+
+  def _store(self, values: dict[str, str | None]):
+    with self._lock:
+      fetched_at = time.monotonic()
+      self._values.update(values)
+      self._fetched_at.update(dict.fromkeys(values, fetched_at))
+      self._stats["refreshes"] += 1
+
+  def _refresh_in_background(self, names: list[str]):
+    try:
+      self._store(self._fetch(names))
+    except Exception as e:
+      # the stale values remain in place until the stale window closes
+      with self._lock:
+        self._stats["refresh_failures"] += 1
+      self.logger.warning(f"Background refresh of secrets failed: {e}")
+
+  def _freshness(self, name: str, now: float) -> str:
+    ttl_seconds, stale_seconds = self.ttl_overrides.get(name, (self.ttl_seconds, self.stale_seconds))
+    fetched_at = self._fetched_at.get(name, None)
+    if fetched_at is not None and now - fetched_at < ttl_seconds:
+      return "fresh"
+    if fetched_at is not None and now - fetched_at < ttl_seconds + stale_seconds:
+      return "stale"
+    return "expired"
+
+  def get_all(self) -> dict[str, str | None]:
+    """
+    Returns the values of all names, fetching or refreshing them as required.
+    Names past their stale window are fetched synchronously, together with the stale ones in a single call.
+    """
+    with self._lock:
+      now = time.monotonic()
+      freshness = {name: self._freshness(name, now) for name in self.names}
+      due = [name for name in self.names if freshness[name] != "fresh"]
+      if not due:
+        self._stats["hits"] += 1
+        return dict(self._values)
+      if "expired" not in freshness.values():
+        self._stats["stale_hits"] += 1
+        if self._refresh_thread is None or not self._refresh_thread.is_alive():
+          # lambda freezes the environment after the response. A refresh interrupted by the freeze
+          # resumes with the next invocation or fails and is retried by the next stale hit
+          self._refresh_thread = threading.Thread(target=self._refresh_in_background, args=(due,), daemon=True)
+          self._refresh_thread.start()
+        return dict(self._values)
+      self._stats["misses"] += 1
+    self._store(self._fetch(due))
+    with self._lock:
+      return dict(self._values)
+
+  def get(self, name: str) -> str | None:
+    if name not in self.names:
+      raise KeyError(f"{name} is not managed by this cache")
+    return self.get_all()[name]
+
+  def invalidate(self, name: str | None = None):
+    """
+    Forces a synchronous fetch of name, or of all names, with the next access.
+    """
+    with self._lock:
+      if name is None:
+        self._fetched_at.clear()
+      else:
+        self._fetched_at.pop(name, None)
+
+  def pop_stats(self) -> dict[str, int]:
+    """
+    Returns the counters accumulated since the last call and resets them.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      self._stats = dict.fromkeys(self._stats, 0)
+    return stats
@@ -49,12 +49,18 @@ cd ${FUNCTION_DIR}
 
 ##### PYTHON FUNCTIONS #####
 if [ "${PROGRAMMING_LANG}" == "python" ]; then
+  # modules in _shared/ are added to the root of every function archive
+  SHARED_DIR="${FUNCTION_DIR}_shared"
   for folder in */; do
+    if [ "${folder}" == "_shared/" ]; then
+      continue
+    fi
     cd "${FUNCTION_DIR}${folder}"
     folder_name=$(echo "${folder}" | sed 's/\/$//')
     zip_name="${folder_name}.zip"
     echo -e "${BLUE}Zipping python function code for ${FUNCTION_DIR}${folder} ${NC}"
     zip -q ${zip_name} *.py
+    zip -q -j ${zip_name} ${SHARED_DIR}/*.py
     mv ${zip_name} ${FUNCTION_DIR}
   done
 ##### TYPERSCRIPT FUNCTIONS #####
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The function modules are imported by their top level name, as in the lambda archive
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "python")
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, "_shared"))
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, "Fiscalismia_RawDataETL"))
+# Synthetic sheets and the local stand-ins for Google Sheets and s3, see benchmarks/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
@@ -0,0 +1,141 @@
+"""
+Run manifest lock of coalescing.py against the local s3 stand-in with conditional writes.
+"""
+import importlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import coalescing
+from coalescing import RUN_MANIFEST_S3_KEY, claim_run, coalesce, publish_result, wait_for_leader
+from instrumentation import Profiler
+from local_stubs import LocalS3
+
+BUCKET = "coalescing-test"
+logger = logging.getLogger(__name__)
+
+@pytest.fixture(autouse=True)
+def coalescing_enabled(monkeypatch):
+  monkeypatch.setattr(coalescing, "COALESCE_WINDOW_SECONDS", 30)
+  monkeypatch.setattr(coalescing, "COALESCE_MAX_WAIT_SECONDS", 5)
+  monkeypatch.setattr(coalescing, "POLL_INTERVAL_SECONDS", 0.01)
+
+def _manifest(s3: LocalS3, state_prefix: str = "") -> dict:
+  return json.loads(s3.objects[(BUCKET, f"{state_prefix}{RUN_MANIFEST_S3_KEY}")]["Body"])
+
+def _response(run_id: str) -> dict:
+  return {"statusCode": 202, "body": json.dumps({"run_id": run_id})}
+
+def test_leader_claims_run():
+  s3 = LocalS3()
+  claim = claim_run("run-a", BUCKET, s3, logger)
+  assert claim["role"] == "leader"
+  manifest = _manifest(s3)
+  assert manifest["run_id"] == "run-a"
+  assert manifest["status"] == "running"
+  assert manifest["expires_at"] > time.time()
+  # a concurrent invocation follows the claim
+  follower = claim_run("run-b", BUCKET, s3, logger)
+  assert follower["role"] == "follower"
+  assert follower["run_id"] == "run-a"
+
+def test_claims_per_state_prefix():
+  s3 = LocalS3()
+  assert claim_run("run-a", BUCKET, s3, logger, "targets/a/")["role"] == "leader"
+  assert claim_run("run-b", BUCKET, s3, logger, "targets/b/")["role"] == "leader"
+
+def test_follower_reuses_result():
+  s3 = LocalS3()
+  leader = claim_run("run-a", BUCKET, s3, logger)
+  follower = claim_run("run-b", BUCKET, s3, logger)
+  publisher = threading.Timer(0.05, publish_result, (leader, BUCKET, s3, logger, _response("run-a")))
+  publisher.start()
+  assert wait_for_leader(follower, BUCKET, s3) == _response("run-a")
+  publisher.join()
+  # invocations within the coalescing window reuse the published response without waiting
+  reuse = claim_run("run-c", BUCKET, s3, logger)
+  assert reuse["role"] == "reuse"
+  assert reuse["response"] == _response("run-a")
+
+def test_concurrent_invocations_run_once():
+  s3 = LocalS3()
+  runs = []
+  barrier = threading.Barrier(5)
+
+  def invoke(run_id: str) -> dict:
+    def run() -> dict:
+      runs.append(run_id)
+      time.sleep(0.1)
+      return _response(run_id)
+    barrier.wait()
+    return coalesce(run_id, BUCKET, s3, Profiler("test"), logger, run)
+
+  with ThreadPoolExecutor(max_workers=5) as executor:
+    responses = list(executor.map(invoke, [f"run-{index}" for index in range(5)]))
+  assert len(runs) == 1
+  assert all(response == _response(runs[0]) for response in responses)
+
+def test_recent_result_outside_window_runs_again(monkeypatch):
+  s3 = LocalS3()
+  leader = claim_run("run-a", BUCKET, s3, logger)
+  publish_result(leader, BUCKET, s3, logger, _response("run-a"))
+  monkeypatch.setattr(coalescing, "COALESCE_WINDOW_SECONDS", 0.01)
+  time.sleep(0.02)
+  assert claim_run("run-b", BUCKET, s3, logger)["role"] == "leader"
+
+def test_expired_lock_is_taken_over(monkeypatch):
+  s3 = LocalS3()
+  monkeypatch.setattr(coalescing, "RUN_LOCK_TTL_SECONDS", 0.05)
+  stale_leader = claim_run("run-a", BUCKET, s3, logger)
+  follower = claim_run("run-b", BUCKET, s3, logger)
+  assert follower["role"] == "follower"
+  # the follower stops waiting once the claim of the leader expired
+  assert wait_for_leader(follower, BUCKET, s3) is None
+  new_leader = claim_run("run-b", BUCKET, s3, logger)
+  assert new_leader["role"] == "leader"
+  # the stale leader finishing late does not overwrite the claim of the new leader
+  publish_result(stale_leader, BUCKET, s3, logger, _response("run-a"))
+  assert _manifest(s3)["run_id"] == "run-b"
+  assert _manifest(s3)["status"] == "running"
+
+def test_failed_leader_is_taken_over():
+  s3 = LocalS3()
+
+  def failing_run() -> dict:
+    raise RuntimeError("download failed")
+
+  with pytest.raises(RuntimeError, match="download failed"):
+    coalesce("run-a", BUCKET, s3, Profiler("test"), logger, failing_run)
+  assert _manifest(s3)["status"] == "failed"
+  # failures are never shared, the next invocation runs itself
+  response = coalesce("run-b", BUCKET, s3, Profiler("test"), logger, lambda: _response("run-b"))
+  assert response == _response("run-b")
+  assert _manifest(s3)["status"] == "succeeded"
+
+def test_follower_takes_over_after_leader_failure():
+  s3 = LocalS3()
+  leader = claim_run("run-a", BUCKET, s3, logger)
+  threading.Timer(0.05, publish_result, (leader, BUCKET, s3, logger, None)).start()
+  response = coalesce("run-b", BUCKET, s3, Profiler("test"), logger, lambda: _response("run-b"))
+  assert response == _response("run-b")
+
+def test_follower_wait_is_capped(monkeypatch):
+  s3 = LocalS3()
+  monkeypatch.setattr(coalescing, "COALESCE_MAX_WAIT_SECONDS", 0.1)
+  claim_run("run-a", BUCKET, s3, logger)
+  start = time.time()
+  response = coalesce("run-b", BUCKET, s3, Profiler("test"), logger, lambda: pytest.fail("the follower must not run"))
+  assert time.time() - start < 1
+  assert response["statusCode"] == 503
+  assert json.loads(response["body"])["leader_run"] == "run-a"
+  assert "Retry-After" in response["headers"]
+
+def test_opt_in_defaults(monkeypatch):
+  monkeypatch.delenv("ETL_COALESCE_WINDOW_SECONDS", raising=False)
+  monkeypatch.delenv("ETL_COALESCE_MAX_WAIT_SECONDS", raising=False)
+  import etl_config
+  defaults = importlib.reload(etl_config)
+  assert defaults.COALESCE_WINDOW_SECONDS == 0
+  assert defaults.COALESCE_MAX_WAIT_SECONDS < defaults.API_GATEWAY_TIMEOUT_SECONDS
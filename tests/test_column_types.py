@@ -0,0 +1,40 @@
+"""
+Typing of the raw string cells of both exports, see column_types.py.
+"""
+import math
+import pandas as pd
+import pytest
+from column_types import _to_decimal
+from download_xlsx import _cell_to_str
+
+@pytest.mark.parametrize("raw, expected", [
+  ("1.234 €", 1234.0),
+  ("1.000.000", 1000000.0),
+  ("1.234,56 €", 1234.56),
+  ("26,375%", 0.26375),
+  ("48,848 %", 0.48848),
+  ("-12,5", -12.5),
+  ("0", 0.0),
+  ("1 234,5 €", 1234.5),
+])
+def test_decimal_german_locale(raw, expected):
+  assert _to_decimal(pd.Series([raw], dtype=object)).tolist() == [expected]
+
+@pytest.mark.parametrize("raw", ["abc", "x%", "1,2,3"])
+def test_decimal_unparsable(raw):
+  assert math.isnan(_to_decimal(pd.Series([raw], dtype=object)).iloc[0])
+
+def test_decimal_missing():
+  assert _to_decimal(pd.Series([None, "2,5"], dtype=object)).isna().tolist() == [True, False]
+
+@pytest.mark.parametrize("cell, expected", [
+  (1234.56, 1234.56),
+  (1234.0, 1234.0),
+  (1000000.0, 1000000.0),
+  (0.26375, 0.26375),
+  (1e-05, 1e-05),
+  (1.5e+16, 1.5e+16),
+])
+def test_decimal_xlsx_numbers(cell, expected):
+  # numeric XLSX cells keep their exact value through the string rendering of the parser
+  assert _to_decimal(pd.Series([_cell_to_str(cell)], dtype=object)).tolist() == [expected]
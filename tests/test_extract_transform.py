@@ -0,0 +1,106 @@
+"""
+Equivalence of the vectorized multi-section extractor with the row loop it replaced.
+"""
+import logging
+import random
+import pandas as pd
+import pytest
+from ddl_schema import TABLE_FIXED_COSTS, TABLE_INCOME
+from extract_transform import _extract_multisection_rows
+
+logger = logging.getLogger(__name__)
+
+def _row_loop_multisection(raw_data: pd.DataFrame, table_def: dict) -> pd.DataFrame:
+  # The iterrows implementation preceding the vectorized extractor
+  skip_markers = table_def.get("skip_markers", None)
+  date_marker = table_def["date_marker"]
+  date_col_offset = table_def["date_value_col_offset"]
+  raw_data = raw_data.dropna(how="all").reset_index(drop=True)
+  records = []
+  current_effective = None
+  current_expiration = None
+  for _, row in raw_data.iterrows():
+    first_val = str(row.iloc[0]).strip()
+    if first_val == date_marker:
+      date_string = str(row.iloc[date_col_offset]).strip()
+      parts = [p.strip() for p in date_string.split("-", 1)]
+      current_effective = parts[0] if len(parts) > 0 else None
+      current_expiration = parts[1] if len(parts) > 1 else None
+      continue
+    if first_val in skip_markers or first_val in {"", "nan"}:
+      continue
+    records.append(row.tolist() + [current_effective, current_expiration])
+  return pd.DataFrame(records, columns=table_def["col_names"] + table_def["derived_col_names"])
+
+def _records(df: pd.DataFrame) -> list[list]:
+  return [[None if pd.isna(value) else value for value in row] for row in df.astype(object).itertuples(index=False)]
+
+def _rows(table_def: dict, *rows: list) -> pd.DataFrame:
+  width = len(table_def["col_names"])
+  return pd.DataFrame([row + [None] * (width - len(row)) for row in rows], columns=range(width), dtype=object)
+
+def _date_row(table_def: dict, date_string: str) -> list:
+  row = [None] * (table_def["date_value_col_offset"] + 1)
+  row[0] = table_def["date_marker"]
+  row[table_def["date_value_col_offset"]] = date_string
+  return row
+
+def _assert_equivalent(raw_data: pd.DataFrame, table_def: dict):
+  expected = _row_loop_multisection(raw_data, table_def)
+  actual, _ = _extract_multisection_rows(raw_data, table_def, logger)
+  assert list(actual.columns) == list(expected.columns)
+  assert _records(actual) == _records(expected)
+
+@pytest.mark.parametrize("table_def", [TABLE_FIXED_COSTS, TABLE_INCOME])
+@pytest.mark.parametrize("date_strings", [
+  ["01.01.2020 - 31.12.2020", "01.01.2021 - 31.12.2021"],
+  # no Date row has a dash, leaving every expiration empty
+  ["01.01.2020", "01.01.2021"],
+  # open range
+  ["01.01.2020 - 31.12.2020", "01.01.2021 -"],
+  ["01.01.2020-31.12.2020", " 01.01.2021 -  "],
+])
+def test_sections_match_row_loop(table_def, date_strings):
+  rows = [["before first date", "x"], ["border"]]
+  for section, date_string in enumerate(date_strings):
+    rows += [_date_row(table_def, date_string), [f"item {section}", "1"], [], [f"other {section}", "2"]]
+  _assert_equivalent(_rows(table_def, *rows), table_def)
+
+@pytest.mark.parametrize("table_def", [TABLE_FIXED_COSTS, TABLE_INCOME])
+def test_rows_above_first_date_row_have_no_range(table_def):
+  raw_data = _rows(table_def, ["rent", "1"], ["power", "2"])
+  _assert_equivalent(raw_data, table_def)
+  actual, open_section = _extract_multisection_rows(raw_data, table_def, logger)
+  assert actual[table_def["derived_col_names"]].isna().all().all()
+  assert open_section is None
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_sheets_match_row_loop(seed):
+  rng = random.Random(seed)
+  table_def = rng.choice([TABLE_FIXED_COSTS, TABLE_INCOME])
+  date_strings = ["01.01.2020 - 31.12.2020", "01.01.2020", "01.01.2020 -", "01.01.2020-02.02.2020", "", "a - b - c"]
+  first_values = ["rent", " padded ", "", None, "border", "description", "nan"]
+  rows = []
+  for _ in range(rng.randint(0, 30)):
+    if rng.random() < 0.2:
+      rows.append(_date_row(table_def, rng.choice(date_strings)))
+    else:
+      rows.append([rng.choice(first_values), rng.choice(["1", None, "x"])])
+  _assert_equivalent(_rows(table_def, *rows), table_def)
+
+def test_chunks_match_whole_range():
+  table_def = TABLE_FIXED_COSTS
+  raw_data = _rows(
+    table_def,
+    ["before", "0"],
+    _date_row(table_def, "01.01.2020"),
+    ["rent", "1"],
+    ["power", "2"],
+    _date_row(table_def, "01.01.2021 - 31.12.2021"),
+    ["water", "3"],
+  )
+  whole, _ = _extract_multisection_rows(raw_data, table_def, logger)
+  for split in range(1, len(raw_data)):
+    head, open_section = _extract_multisection_rows(raw_data.iloc[:split], table_def, logger)
+    tail, _ = _extract_multisection_rows(raw_data.iloc[split:], table_def, logger, open_section)
+    assert _records(pd.concat([head, tail], ignore_index=True)) == _records(whole)
@@ -0,0 +1,115 @@
+"""
+Entry points of index.py against the local s3 stand-in and a local HTTP stub serving the spreadsheet export.
+"""
+import json
+import pytest
+from ddl_schema import TABLES
+from local_stubs import LocalHttpStub, LocalS3
+from secrets_cache import SecretsCache
+from synthetic_sheet import generate_sheet, to_csv_bytes
+
+index = pytest.importorskip("index")
+API_KEY = "key"
+
+class StubSsm:
+  def __init__(self, values: dict[str, str]):
+    self.values = values
+
+  def get_parameters(self, Names: list[str], WithDecryption: bool) -> dict:
+    return {
+      "Parameters": [{"Name": name, "Value": self.values[name]} for name in Names if name in self.values],
+      "InvalidParameters": [name for name in Names if name not in self.values],
+    }
+
+def _event(api_key: str = API_KEY, query: dict | None = None) -> dict:
+  return {"headers": {"authorization": api_key}, "queryStringParameters": query}
+
+def _sheet_url(stub: LocalHttpStub) -> str:
+  # clean_sheet_url only accepts Google Sheets urls, which the stub serves under any path
+  return stub.url.replace("/spreadsheets/", "/docs.google.com/spreadsheets/") + "?format=csv"
+
+@pytest.fixture
+def s3(monkeypatch) -> LocalS3:
+  s3 = LocalS3()
+  monkeypatch.setattr(index, "get_s3_client", lambda: s3)
+  return s3
+
+@pytest.fixture
+def stub(monkeypatch):
+  with LocalHttpStub(to_csv_bytes(generate_sheet(60, seed=31))) as stub:
+    ssm = StubSsm({index.API_KEY_PARAMETER: API_KEY, index.SHEET_URL_PARAMETER: _sheet_url(stub)})
+    monkeypatch.setattr(index, "secrets", SecretsCache([index.API_KEY_PARAMETER, index.SHEET_URL_PARAMETER], ssm_client=ssm))
+    yield stub
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_lambda_handler(pipelined, s3, stub, monkeypatch):
+  monkeypatch.setattr(index, "PIPELINED_STARTUP", pipelined)
+  assert index.lambda_handler(_event("invalid"), None)["statusCode"] == 403
+  assert stub.request_count == 0
+
+  response = index.lambda_handler(_event(), None)
+  assert response["statusCode"] == 202
+  manifest = json.loads(response["body"])["manifest"]
+  assert [entry["table"] for entry in manifest["tables"]] == list(TABLES)
+  assert all((index.s3_bucket, entry["s3_key"]) in s3.objects for entry in manifest["tables"])
+
+  # the unchanged spreadsheet is served from the last run
+  response = index.lambda_handler(_event(), None)
+  assert response["statusCode"] == 202
+  assert json.loads(response["body"])["manifest"]["run_id"] == manifest["run_id"]
+  assert stub.request_count == 2
+
+def _batch_event(monkeypatch, targets: list[dict]) -> dict:
+  ssm = StubSsm({index.BATCH_TARGETS_PARAMETER: json.dumps(targets)})
+  monkeypatch.setattr(index, "batch_targets_secret", SecretsCache([index.BATCH_TARGETS_PARAMETER], ssm_client=ssm))
+  return _event()
+
+def test_batch_handler(s3, stub, monkeypatch):
+  event = _batch_event(monkeypatch, [
+    {"name": "household", "url": _sheet_url(stub)},
+    {"name": "shared", "url": _sheet_url(stub), "profile": "default"},
+  ])
+  response = index.batch_handler(event, None)
+  assert response["statusCode"] == 202
+  body = json.loads(response["body"])
+  assert body["failed"] == []
+  assert {name: target["statusCode"] for name, target in body["targets"].items()} == {"household": 202, "shared": 202}
+  # every target keeps its run state under its own prefix
+  for name in ("household", "shared"):
+    assert body["targets"][name]["manifest"]["run_id"].endswith(f"-{name}")
+    assert any(key.startswith(f"targets/{name}/") for _, key in s3.objects)
+  assert index.batch_handler(_event("invalid"), None)["statusCode"] == 403
+
+def test_batch_handler_reports_failed_targets(s3, stub, monkeypatch):
+  event = _batch_event(monkeypatch, [
+    {"name": "household", "url": _sheet_url(stub)},
+    {"name": "broken", "url": "https://example.com/not-a-spreadsheet"},
+  ])
+  response = index.batch_handler(event, None)
+  assert response["statusCode"] == 207
+  body = json.loads(response["body"])
+  assert body["failed"] == ["broken"]
+  assert body["targets"]["household"]["statusCode"] == 202
+  assert body["targets"]["broken"]["statusCode"] == 400
+  assert "malformed" in body["targets"]["broken"]["error"]
+
+def test_batch_handler_rejects_malformed_targets(s3, stub, monkeypatch):
+  event = _batch_event(monkeypatch, [{"name": "Not A Name", "url": _sheet_url(stub)}])
+  response = index.batch_handler(event, None)
+  assert response["statusCode"] == 400
+  assert stub.request_count == 0
+
+def test_compaction_handler(s3, stub):
+  raw = stub.payload
+  s3.put_object(Bucket=index.s3_bucket, Key="tmp/2024-01-01_10-00-00-Fiscalismia-Datasource.csv", Body=raw)
+  s3.put_object(Bucket=index.s3_bucket, Key="tmp/2024-01-02_10-00-00-Fiscalismia-Datasource.csv", Body=raw)
+  response = index.compaction_handler({}, None)
+  assert response["statusCode"] == 200
+  assert json.loads(response["body"]) == {"migrated": 1, "deduplicated": 1, "deleted_bytes": len(raw), "stale_extracted": 0}
+  assert not any(key.startswith("tmp/") for _, key in s3.objects)
+
+  # the migrated backups are served as past snapshots
+  response = index.lambda_handler(_event(query={"as_of": "2024-01-01"}), None)
+  assert response["statusCode"] == 202
+  assert json.loads(response["body"])["manifest"]["run_id"] == "2024-01-01_10-00-00"
+  assert stub.request_count == 0
@@ -0,0 +1,68 @@
+"""
+Spans of instrumentation.py and the EMF documents their flush publishes through powertools Metrics.
+"""
+import json
+import logging
+import threading
+from instrumentation import METRIC_NAMESPACE, Profiler
+
+logger = logging.getLogger(__name__)
+
+def _emf_documents(capsys) -> list[dict]:
+  return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+def test_flush_publishes_a_document_per_span(capsys):
+  profiler = Profiler("test-service")
+  with profiler.span("extract") as extract:
+    extract.add_bytes(2048)
+    with profiler.span("table", {"Table": "income"}) as table:
+      table.add_rows(12)
+      table.add_counts({"Retries": 2})
+  profiler.flush(logger)
+
+  documents = _emf_documents(capsys)
+  assert [document["Stage"] for document in documents] == ["extract", "table"]
+  extract_document, table_document = documents
+  assert extract_document["_aws"]["CloudWatchMetrics"][0]["Namespace"] == METRIC_NAMESPACE
+  assert extract_document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Stage", "service"]]
+  assert extract_document["service"] == "test-service"
+  assert extract_document["Bytes"] == [2048.0]
+  assert "Rows" not in extract_document
+  # span dimensions and counters of one span stay out of the document of another
+  assert table_document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Stage", "Table", "service"]]
+  assert table_document["SpanPath"] == "extract/table"
+  assert table_document["Rows"] == [12.0] and table_document["Retries"] == [2.0]
+  assert "Bytes" not in table_document
+  units = {metric["Name"]: metric["Unit"] for metric in table_document["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+  assert units == {"Duration": "Milliseconds", "Rows": "Count", "Retries": "Count"}
+  assert extract_document["_aws"]["Timestamp"] == table_document["_aws"]["Timestamp"]
+
+  # flushed spans are not published again
+  profiler.flush(logger)
+  assert _emf_documents(capsys) == []
+
+def test_concurrent_flushes_keep_their_metrics_apart(capsys):
+  profilers = [Profiler(f"service-{number}") for number in range(8)]
+
+  def run(profiler: Profiler):
+    for _ in range(20):
+      with profiler.span("stage", {"Profiler": profiler.service}):
+        pass
+    profiler.flush(logger, info_log=False)
+
+  threads = [threading.Thread(target=run, args=(profiler,)) for profiler in profilers]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  documents = _emf_documents(capsys)
+  assert len(documents) == 160
+  assert all(document["service"] == document["Profiler"] and len(document["Duration"]) == 1 for document in documents)
+
+def test_disabled_metrics(capsys, monkeypatch):
+  monkeypatch.setenv("POWERTOOLS_METRICS_DISABLED", "true")
+  profiler = Profiler("test-service")
+  with profiler.span("extract"):
+    pass
+  profiler.flush(logger)
+  assert _emf_documents(capsys) == []
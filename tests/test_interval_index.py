@@ -0,0 +1,114 @@
+"""
+Point-in-time and range lookups of interval_index.py, checked against a scan over all rows.
+"""
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from interval_index import IntervalIndex, build_interval_index
+
+def _periods(*rows: tuple) -> pd.DataFrame:
+  return pd.DataFrame({
+    "effective_date": pd.to_datetime([effective for effective, _ in rows]),
+    "expiration_date": pd.to_datetime([expiration for _, expiration in rows]),
+  })
+
+def _random_periods(row_count: int, seed: int) -> pd.DataFrame:
+  rng = np.random.default_rng(seed)
+  effective = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1000, row_count), "D")
+  expiration = effective + pd.to_timedelta(rng.integers(-30, 400, row_count), "D")
+  return pd.DataFrame({
+    "effective_date": pd.Series(effective).where(rng.random(row_count) > 0.05),
+    "expiration_date": pd.Series(expiration).where(rng.random(row_count) > 0.2),
+  })
+
+def _scan(df: pd.DataFrame, start, end) -> list[int]:
+  # rows active on any day from start to end, open expirations never end
+  expiration = df["expiration_date"].fillna(pd.Timestamp.max)
+  is_active = (df["effective_date"] <= pd.Timestamp(end)) & (expiration >= pd.Timestamp(start)) & (expiration >= df["effective_date"])
+  return np.flatnonzero(is_active.to_numpy()).tolist()
+
+def _sorted(positions: np.ndarray) -> list[int]:
+  return sorted(positions.tolist())
+
+def test_point_in_time():
+  index = build_interval_index(_periods(
+    ("2024-01-01", "2024-06-30"),
+    ("2024-07-01", None),
+    ("2024-03-01", "2024-03-01"),
+  ))
+  assert _sorted(index.at("2023-12-31")) == []
+  assert _sorted(index.at("2024-01-01")) == [0]
+  assert _sorted(index.at("2024-03-01")) == [0, 2]
+  assert _sorted(index.at("2024-03-02")) == [0]
+  assert _sorted(index.at("2024-06-30")) == [0]
+  assert _sorted(index.at("2024-07-01")) == [1]
+  assert _sorted(index.at("2099-01-01")) == [1]
+
+def test_overlap_queries():
+  index = build_interval_index(_periods(
+    ("2024-01-01", "2024-01-31"),
+    ("2024-03-01", "2024-03-31"),
+    ("2024-02-15", None),
+  ))
+  assert _sorted(index.overlapping("2024-01-31", "2024-02-14")) == [0]
+  assert _sorted(index.overlapping("2024-02-01", "2024-02-14")) == []
+  assert _sorted(index.overlapping("2024-01-15", "2024-03-15")) == [0, 1, 2]
+  assert _sorted(index.overlapping("2023-01-01", "2023-12-31")) == []
+  # a reversed range overlaps nothing
+  assert _sorted(index.overlapping("2024-03-15", "2024-01-15")) == []
+
+def test_empty_intervals():
+  df = _periods(
+    ("2024-05-01", "2024-04-30"),
+    (None, "2024-12-31"),
+    ("2024-01-01", "2024-01-01"),
+  )
+  index = build_interval_index(df)
+  # rows expiring before they take effect and rows without effective_date are never active
+  assert _sorted(index.overlapping("2000-01-01", "2100-01-01")) == [2]
+  assert _sorted(index.at("2024-04-30")) == []
+  positions, months = index.expand_monthly()
+  assert positions.tolist() == [2]
+  assert months.tolist() == [pd.Period("2024-01", "M").ordinal]
+
+def test_empty_table():
+  index = build_interval_index(_periods())
+  assert _sorted(index.at("2024-01-01")) == []
+  assert _sorted(index.overlapping("2024-01-01", "2024-12-31")) == []
+  assert [values.tolist() for values in index.expand_monthly()] == [[], []]
+  assert _sorted(IntervalIndex.from_dict(json.loads(json.dumps(index.to_dict()))).at("2024-01-01")) == []
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_matches_scan(seed):
+  df = _random_periods(300, seed)
+  index = build_interval_index(df)
+  rng = np.random.default_rng(seed)
+  for offset, length in zip(rng.integers(-50, 1500, 100), rng.integers(0, 120, 100)):
+    start = pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(offset))
+    end = start + pd.Timedelta(days=int(length))
+    assert _sorted(index.at(start)) == _scan(df, start, start), start
+    assert _sorted(index.overlapping(start, end)) == _scan(df, start, end), (start, end)
+
+def test_expand_monthly():
+  index = build_interval_index(_periods(
+    ("2024-01-15", "2024-03-01"),
+    ("2024-02-01", None),
+  ))
+  positions, months = index.expand_monthly()
+  entries = sorted(zip(positions.tolist(), [str(pd.Period(ordinal=month, freq="M")) for month in months]))
+  # open periods run until the latest month of any date
+  assert entries == [(0, "2024-01"), (0, "2024-02"), (0, "2024-03"), (1, "2024-02"), (1, "2024-03")]
+  positions, _ = index.expand_monthly(pd.Period("2024-05", "M"))
+  assert positions.tolist().count(1) == 4
+
+def test_from_dict_round_trip():
+  df = _random_periods(200, seed=4)
+  index = build_interval_index(df)
+  # the index is published as JSON, see extract_transform.py
+  restored = IntervalIndex.from_dict(json.loads(json.dumps(index.to_dict())))
+  for name in ("starts", "ends", "positions", "boundaries", "segment_offsets", "segment_rows"):
+    assert np.array_equal(getattr(restored, name), getattr(index, name)), name
+  for day in pd.date_range("2019-12-01", "2023-12-31", freq="17D"):
+    assert _sorted(restored.at(day)) == _sorted(index.at(day))
+  assert restored.to_dict() == index.to_dict()
@@ -0,0 +1,154 @@
+"""
+Delivery of SNS notifications by Infrastructure_NotificationMessageSender against a local Telegram bot API.
+"""
+import asyncio
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import pytest
+from secrets_cache import SecretsCache
+from local_stubs import LocalTelegramApi
+
+pytest.importorskip("telegram")
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "python", "Infrastructure_NotificationMessageSender")
+BOT_TOKEN = "123:stub"
+DEFAULT_CHAT_ID = "42"
+
+class StubSsm:
+  def get_parameters(self, Names: list[str], WithDecryption: bool) -> dict:
+    values = {"/telegram/fiscalismia/BOT_TOKEN": BOT_TOKEN, "/telegram/fiscalismia/CHAT_ID": DEFAULT_CHAT_ID}
+    return {"Parameters": [{"Name": name, "Value": values[name]} for name in Names]}
+
+class StubContext:
+  function_name = "Infrastructure_NotificationMessageSender"
+  request_id = "test-request"
+
+  def __init__(self, timeout_seconds: float = 30):
+    self.timeout_at = time.time() + timeout_seconds
+
+  def get_remaining_time_in_millis(self) -> int:
+    return int((self.timeout_at - time.time()) * 1000)
+
+@pytest.fixture
+def telegram_api():
+  with LocalTelegramApi(failing_texts={"UNDELIVERABLE"}, flood_waits={"Flooded": 1}) as api:
+    yield api
+
+@pytest.fixture
+def telegram_sender(telegram_api, monkeypatch):
+  # the bot API endpoint is read from the environment on import, as in the lambda
+  monkeypatch.setenv("TELEGRAM_API_BASE_URL", telegram_api.base_url)
+  monkeypatch.syspath_prepend(FUNCTION_DIR)
+  import telegram_sender
+  return importlib.reload(telegram_sender)
+
+@pytest.fixture
+def handler(telegram_sender, monkeypatch):
+  # loaded under its own name, index of Fiscalismia_RawDataETL is importable as index as well
+  spec = importlib.util.spec_from_file_location("notification_index", os.path.join(FUNCTION_DIR, "index.py"))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  monkeypatch.setattr(module, "secrets", SecretsCache([module.BOT_TOKEN_PARAMETER, module.CHAT_ID_PARAMETER], ssm_client=StubSsm()))
+  yield module
+  module.loop.close()
+  sys.modules.pop("notification_index", None)
+
+def _record(message_id: str, message: str, subject: str | None = None, chat_id: str | None = None) -> dict:
+  sns = {"MessageId": message_id, "Subject": subject, "Message": message}
+  if chat_id is not None:
+    sns["MessageAttributes"] = {"chat_id": {"Type": "String", "Value": chat_id}}
+  return {"Sns": sns}
+
+def _alarm(message_id: str, alarm_name: str, reason: str) -> dict:
+  return _record(message_id, json.dumps({"AlarmName": alarm_name, "NewStateValue": "ALARM", "NewStateReason": reason}), "ALARM")
+
+def _notification(notification_id: str, chat_id: str, text: str) -> dict:
+  return {"id": notification_id, "chat_id": chat_id, "text": text, "dedupe_key": f"text\n{text}"}
+
+def test_base_url_from_environment(telegram_api, telegram_sender):
+  sender = telegram_sender.NotificationSender(BOT_TOKEN)
+  results = asyncio.run(sender.send_all([_notification("a", "1", "hello")]))
+  assert results[0]["status"] == "sent"
+  assert [parameters["text"] for _, parameters in telegram_api.sent_messages()] == ["hello"]
+
+def test_alarms_are_deduplicated(telegram_api, handler):
+  # the same alarm differs in its reason between evaluations
+  records = [_alarm("m1", "CpuHigh", "datapoint at 10:00"), _alarm("m2", "CpuHigh", "datapoint at 10:01"), _alarm("m3", "DiskFull", "datapoint at 10:00")]
+  response = handler.lambda_handler({"Records": records}, StubContext())
+  assert response["statusCode"] == 200
+  assert [result["status"] for result in json.loads(response["body"])["results"]] == ["sent", "duplicate", "sent"]
+  # a warm invocation within the dedupe window skips both alarms
+  response = handler.lambda_handler({"Records": [_alarm("m4", "CpuHigh", "datapoint at 10:02"), _alarm("m5", "DiskFull", "datapoint at 10:02")]}, StubContext())
+  assert [result["status"] for result in json.loads(response["body"])["results"]] == ["duplicate", "duplicate"]
+  assert len(telegram_api.sent_messages()) == 2
+
+def test_dedupe_window_expires(telegram_api, telegram_sender):
+  sender = telegram_sender.NotificationSender(BOT_TOKEN, dedupe_window_seconds=0.05)
+
+  async def send_twice() -> list[dict]:
+    first = await sender.send_all([_notification("a", "1", "hello")])
+    await asyncio.sleep(0.1)
+    return first + await sender.send_all([_notification("b", "1", "hello")])
+
+  assert [result["status"] for result in asyncio.run(send_twice())] == ["sent", "sent"]
+  # the same text to another chat is no duplicate
+  assert asyncio.run(sender.send_all([_notification("c", "2", "hello")]))[0]["status"] == "sent"
+
+def test_messages_to_a_chat_are_paced(telegram_api, telegram_sender, monkeypatch):
+  monkeypatch.setattr(telegram_sender, "CHAT_MESSAGES_PER_SECOND", 10.0)
+  sender = telegram_sender.NotificationSender(BOT_TOKEN)
+  results = asyncio.run(sender.send_all([_notification(str(index), "1", f"message {index}") for index in range(4)]))
+  assert all(result["status"] == "sent" for result in results)
+  sent_at = sorted(sent_at for sent_at, _ in telegram_api.sent_messages())
+  # a single token is available at once, the following messages wait one refill interval each
+  assert all(later - earlier >= 0.08 for earlier, later in zip(sent_at, sent_at[1:]))
+
+def test_group_chats_are_paced_slower(telegram_sender):
+  sender = telegram_sender.NotificationSender(BOT_TOKEN)
+  assert sender._chat_bucket("-100").rate == telegram_sender.GROUP_MESSAGES_PER_SECOND
+  assert sender._chat_bucket("100").rate == telegram_sender.CHAT_MESSAGES_PER_SECOND
+
+def test_chats_are_sent_concurrently(telegram_api, telegram_sender):
+  telegram_api.response_delay = 0.2
+  sender = telegram_sender.NotificationSender(BOT_TOKEN)
+  start = time.monotonic()
+  results = asyncio.run(sender.send_all([_notification(str(index), str(100 + index), "hello") for index in range(10)]))
+  assert all(result["status"] == "sent" for result in results)
+  # sequential sends would take at least 2 seconds
+  assert time.monotonic() - start < 1.5
+  assert len(telegram_api.sent_messages()) == 10
+
+def test_flood_wait_is_retried(telegram_api, telegram_sender):
+  sender = telegram_sender.NotificationSender(BOT_TOKEN)
+  start = time.monotonic()
+  results = asyncio.run(sender.send_all([_notification("a", "1", "Flooded chat")]))
+  assert results[0]["status"] == "sent"
+  assert len(telegram_api.sent_messages()) == 2
+  # the retry waits for the retry_after of Telegram
+  assert time.monotonic() - start >= 1
+
+def test_rate_limit_beyond_deadline_fails(telegram_api, telegram_sender, handler, monkeypatch):
+  monkeypatch.setattr(telegram_sender, "GROUP_MESSAGES_PER_SECOND", 2.0)
+  # the group chat gets a token every 0.5 seconds, the third message would be sent after the timeout margin
+  records = [_record(f"g{index}", f"group message {index}", chat_id="-500") for index in range(3)]
+  with pytest.raises(RuntimeError, match=r"1 of 3 notifications failed: \['g2'\]"):
+    handler.lambda_handler({"Records": records}, StubContext(timeout_seconds=handler.TIMEOUT_MARGIN_SECONDS + 0.8))
+  assert len(telegram_api.sent_messages()) == 2
+
+def test_partial_failure_raises_for_retry(telegram_api, handler):
+  records = [_record("ok1", "first"), _record("bad", "UNDELIVERABLE", chat_id="8"), _record("ok2", "second", chat_id="7")]
+  with pytest.raises(RuntimeError, match=r"1 of 3 notifications failed: \['bad'\]"):
+    handler.lambda_handler({"Records": records}, StubContext())
+  # the remaining notifications were sent regardless
+  assert sorted(parameters["text"] for _, parameters in telegram_api.sent_messages()) == ["UNDELIVERABLE", "first", "second"]
+  # the retry of the event by lambda skips the notifications sent before and fails again
+  with pytest.raises(RuntimeError, match=r"1 of 3 notifications failed"):
+    handler.lambda_handler({"Records": records}, StubContext())
+  assert len(telegram_api.sent_messages()) == 4
+
+def test_invalid_event(handler):
+  response = handler.lambda_handler({"Records": []}, StubContext())
+  assert response["statusCode"] == 400
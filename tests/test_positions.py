@@ -0,0 +1,167 @@
+"""
+FIFO positions and cost basis of positions.py, checked against a lot by lot reference implementation.
+"""
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from positions import update_positions
+
+def _investments(*rows: tuple) -> pd.DataFrame:
+  """
+  Investments table of (execution_type, isin, date, units, price_per_unit, fees, pct_of_profit_taxed) rows.
+  """
+  df = pd.DataFrame(rows, columns=["execution_type", "isin", "execution_date", "units", "price_per_unit", "fees", "pct_of_profit_taxed"])
+  return df.assign(
+    description="",
+    execution_date=pd.to_datetime(df["execution_date"]),
+    total_price=np.nan,
+    units=df["units"].astype("float64"),
+    fees=df["fees"].astype("float64"),
+    pct_of_profit_taxed=df["pct_of_profit_taxed"].astype("float64"),
+  )
+
+def _random_investments(row_count: int, seed: int) -> pd.DataFrame:
+  rng = np.random.default_rng(seed)
+  units = rng.integers(1, 20, row_count).astype("float64")
+  price_per_unit = rng.uniform(10, 100, row_count).round(2)
+  return pd.DataFrame({
+    "execution_type": rng.choice(["buy", "sell", "Buy", "dividend"], row_count, p=[0.45, 0.35, 0.1, 0.1]),
+    "description": "",
+    "isin": rng.choice(["DE0001", "US0002", "IE0003"], row_count),
+    "units": units,
+    "price_per_unit": price_per_unit,
+    "total_price": np.where(rng.random(row_count) < 0.3, np.nan, units * price_per_unit),
+    "fees": rng.uniform(0, 3, row_count).round(2),
+    "execution_date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 800, row_count), "D"),
+    "pct_of_profit_taxed": rng.choice([1.0, 0.7, np.nan], row_count),
+  })
+
+def _reference_positions(investments: pd.DataFrame) -> dict[str, tuple[float, float, float, float]]:
+  # consumes lots one sell at a time, returning holdings, open cost basis, realized and taxable profit per isin
+  transactions = investments.assign(execution_type=investments["execution_type"].str.lower())
+  transactions = transactions[transactions["execution_type"].isin(["buy", "sell"])]
+  positions = {}
+  for isin, rows in transactions.sort_values(["isin", "execution_date"], kind="stable").groupby("isin"):
+    lots, realized, taxable = [], 0.0, 0.0
+    for row in rows.itertuples():
+      gross = row.total_price if not np.isnan(row.total_price) else row.units * row.price_per_unit
+      if row.execution_type == "buy":
+        lots.append([row.units, (gross + row.fees) / row.units])
+        continue
+      wanted, cost, executed = row.units, 0.0, 0.0
+      while wanted > 1e-12 and lots:
+        taken = min(wanted, lots[0][0])
+        cost += taken * lots[0][1]
+        lots[0][0] -= taken
+        wanted -= taken
+        executed += taken
+        if lots[0][0] <= 1e-12:
+          lots.pop(0)
+      profit = (gross - row.fees) * executed / row.units - cost
+      realized += profit
+      taxable += profit * (1.0 if np.isnan(row.pct_of_profit_taxed) else row.pct_of_profit_taxed)
+    positions[isin] = (sum(units for units, _ in lots), sum(units * cost for units, cost in lots), realized, taxable)
+  return positions
+
+def _assert_matches_reference(positions: pd.DataFrame, investments: pd.DataFrame):
+  reference = _reference_positions(investments)
+  assert set(positions["isin"]) == set(reference)
+  for position in positions.itertuples():
+    actual = (position.holdings, position.open_cost_basis, position.realized_profit, position.taxable_profit)
+    assert actual == pytest.approx(reference[position.isin], abs=1e-4), position.isin
+
+def _position(positions: pd.DataFrame, isin: str) -> dict:
+  return positions.set_index("isin").loc[isin].to_dict()
+
+def test_partial_lot_consumption():
+  investments = _investments(
+    ("buy", "DE0001", "2024-01-01", 10, 10.0, 0.0, 1.0),
+    ("buy", "DE0001", "2024-02-01", 10, 20.0, 0.0, 1.0),
+    ("sell", "DE0001", "2024-03-01", 15, 30.0, 0.0, 0.5),
+  )
+  positions, ledger, state = update_positions(investments)
+  position = _position(positions, "DE0001")
+  # the sell consumes the first lot and half of the second one
+  assert position["holdings"] == 5
+  assert position["open_cost_basis"] == pytest.approx(100.0)
+  assert position["average_cost"] == pytest.approx(20.0)
+  assert ledger["cost_basis_sold"].tolist()[-1] == pytest.approx(200.0)
+  assert position["realized_profit"] == pytest.approx(450.0 - 200.0)
+  assert position["taxable_profit"] == pytest.approx(125.0)
+  assert state["open_lots"] == [{"isin": "DE0001", "execution_date": "2024-02-01", "units": 5.0, "cost": 100.0}]
+
+def test_sells_exceeding_holdings_are_capped():
+  investments = _investments(
+    ("buy", "US0002", "2024-01-01", 4, 10.0, 1.0, 1.0),
+    ("sell", "US0002", "2024-02-01", 6, 15.0, 0.0, 1.0),
+    ("buy", "US0002", "2024-03-01", 2, 12.0, 0.0, 1.0),
+    ("sell", "US0002", "2024-04-01", 1, 20.0, 0.0, 1.0),
+  )
+  positions, ledger, _ = update_positions(investments)
+  sells = ledger[~ledger["is_buy"]]
+  assert sells["executed_units"].tolist() == [4, 1]
+  assert sells["oversold_units"].tolist() == [2, 0]
+  position = _position(positions, "US0002")
+  assert position["holdings"] == 1
+  assert position["oversold_units"] == 2
+  # proceeds are prorated to the units held, the cost basis includes the fee of the buy
+  assert position["realized_profit"] == pytest.approx((90.0 * 4 / 6 - 41.0) + (20.0 - 12.0))
+  _assert_matches_reference(positions, investments)
+
+def test_rows_without_buy_or_sell_are_ignored():
+  investments = _investments(
+    ("buy", "DE0001", "2024-01-01", 2, 10.0, 0.0, 1.0),
+    ("dividend", "DE0001", "2024-02-01", 2, 1.0, 0.0, 1.0),
+    ("sell", "", "2024-02-01", 2, 1.0, 0.0, 1.0),
+    ("sell", "DE0001", "2024-03-01", 0, 30.0, 0.0, 1.0),
+  )
+  positions, ledger, _ = update_positions(investments)
+  assert len(ledger) == 1
+  assert _position(positions, "DE0001")["holdings"] == 2
+
+def test_matches_reference():
+  investments = _random_investments(400, seed=3)
+  positions, _, _ = update_positions(investments)
+  _assert_matches_reference(positions, investments)
+
+def test_no_investments():
+  positions, ledger, state = update_positions(_random_investments(10, seed=1).iloc[:0])
+  assert len(positions) == 0
+  assert len(ledger) == 0
+  assert state["open_lots"] == [] and state["last_execution_date"] is None
+
+@pytest.mark.parametrize("cuts", [[50, 120, 121, 200, 300], [1, 2, 300], [300, 300]])
+def test_incremental_matches_full_recompute(cuts):
+  investments = _random_investments(300, seed=5).sort_values("execution_date", kind="stable").reset_index(drop=True)
+  full, _, full_state = update_positions(investments)
+  state = None
+  for cut in cuts:
+    # the state passes through s3 as JSON
+    positions, ledger, state = update_positions(investments.iloc[:cut], json.loads(json.dumps(state)) if state else None)
+    _assert_matches_reference(positions, investments.iloc[:cut])
+  pd.testing.assert_frame_equal(positions, full, atol=1e-4)
+  assert state["row_hashes"] == full_state["row_hashes"]
+  # a replay without new transactions replays nothing but the open lots
+  _, ledger, _ = update_positions(investments, state)
+  assert len(ledger) == 0
+
+def test_incremental_only_replays_new_transactions():
+  investments = _random_investments(200, seed=7).sort_values("execution_date", kind="stable").reset_index(drop=True)
+  _, _, state = update_positions(investments.iloc[:150])
+  _, ledger, _ = update_positions(investments, state)
+  assert len(ledger) == len(update_positions(investments.iloc[150:])[1])
+
+@pytest.mark.parametrize("change", ["modified", "removed", "backdated"])
+def test_changed_history_recomputes_everything(change):
+  investments = _random_investments(200, seed=9).sort_values("execution_date", kind="stable").reset_index(drop=True)
+  _, _, state = update_positions(investments.iloc[:150])
+  if change == "modified":
+    investments.loc[3, "units"] += 1
+  elif change == "removed":
+    investments = investments.drop(index=3)
+  else:
+    investments.loc[180, "execution_date"] = investments.loc[0, "execution_date"]
+  positions, ledger, _ = update_positions(investments, state)
+  assert len(ledger) == len(update_positions(investments)[1])
+  _assert_matches_reference(positions, investments)
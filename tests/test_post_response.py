@@ -0,0 +1,179 @@
+"""
+Work deferred until after the response, see post_response.py, against a local stand-in for the Lambda Extensions API.
+"""
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import post_response
+from local_stubs import LocalHttpStub, LocalS3
+from run_state import RUN_STATE_S3_KEY
+from synthetic_sheet import generate_sheet, to_csv_bytes
+
+index = pytest.importorskip("index")
+API_KEY = "key"
+
+class ExtensionsApiStub:
+  """
+  Registers extensions and hands out the INVOKE events queued by invoke(). Every request for the next event is
+  recorded, as it releases the invocation before it.
+  """
+  def __init__(self):
+    self.registrations: list[str] = []
+    self.next_requests: queue.Queue = queue.Queue()
+    self._events: queue.Queue = queue.Queue()
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        stub.registrations.append(self.headers["Lambda-Extension-Name"])
+        self._respond(b"{}", {"Lambda-Extension-Identifier": "extension-1"})
+
+      def do_GET(self):
+        stub.next_requests.put(time.monotonic())
+        self._respond(json.dumps(stub._events.get()).encode("utf-8"))
+
+      def _respond(self, body: bytes, headers: dict | None = None):
+        self.send_response(200)
+        for name, value in (headers or {}).items():
+          self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    # the extension thread outlives the tests waiting for its next event, so the server is never shut down
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+  @property
+  def address(self) -> str:
+    return f"127.0.0.1:{self._server.server_port}"
+
+  def invoke(self, request_id: str, timeout_seconds: float = 30):
+    self._events.put({"eventType": "INVOKE", "requestId": request_id, "deadlineMs": int((time.time() + timeout_seconds) * 1000)})
+
+  def wait_for_release(self, timeout: float = 10) -> float:
+    return self.next_requests.get(timeout=timeout)
+
+class GatedS3(LocalS3):
+  """
+  Holds the write of the run state until released, or fails it.
+  """
+  def __init__(self):
+    super().__init__()
+    self.run_state_gate = threading.Event()
+    self.fail_run_state = False
+
+  def put_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+    if Key == RUN_STATE_S3_KEY:
+      self.run_state_gate.wait(10)
+      if self.fail_run_state:
+        raise RuntimeError("s3 down")
+    return super().put_object(Bucket=Bucket, Key=Key, **kwargs)
+
+@pytest.fixture
+def extensions_api(monkeypatch):
+  api = ExtensionsApiStub()
+  monkeypatch.setenv("AWS_LAMBDA_RUNTIME_API", api.address)
+  monkeypatch.delenv("AWS_LAMBDA_INITIALIZATION_TYPE", raising=False)
+  assert post_response.register_extension(index.logger)
+  # the extension asks for the first event once the init phase is done
+  api.wait_for_release()
+  yield api
+  # later tests run their deferred tasks at once again. The thread of this extension waits for an event forever
+  post_response._extension_id = None
+
+@pytest.fixture
+def s3(monkeypatch) -> GatedS3:
+  s3 = GatedS3()
+  monkeypatch.setattr(index, "get_s3_client", lambda: s3)
+  monkeypatch.setattr(index, "INLINE_MAX_BYTES", 1_000_000)
+  return s3
+
+@pytest.fixture
+def sheet(monkeypatch):
+  with LocalHttpStub(to_csv_bytes(generate_sheet(60, seed=41))) as stub:
+    sheet_url = stub.url.replace("/spreadsheets/", "/docs.google.com/spreadsheets/") + "?format=csv"
+    secret_values = {index.API_KEY_PARAMETER: API_KEY, index.SHEET_URL_PARAMETER: sheet_url}
+    monkeypatch.setattr(index, "fetch_secrets", lambda profiler, parent_span=None: dict(secret_values))
+    yield stub
+
+def _invoke(api: ExtensionsApiStub, request_id: str) -> dict:
+  api.invoke(request_id)
+  response = index.lambda_handler({"headers": {"authorization": API_KEY}}, SimpleNamespace(aws_request_id=request_id))
+  assert response["statusCode"] == 202
+  return json.loads(response["body"])
+
+def _run_state(s3: LocalS3) -> dict | None:
+  stored = s3.objects.get((index.s3_bucket, RUN_STATE_S3_KEY))
+  return json.loads(stored["Body"]) if stored else None
+
+def test_run_state_is_persisted_after_the_response(extensions_api, s3, sheet):
+  assert extensions_api.registrations == [post_response.EXTENSION_NAME]
+  body = _invoke(extensions_api, "request-1")
+  # the response inlines the tables while the run state is still to be written
+  assert set(body["inline_tables"]) == {entry["table"] for entry in body["manifest"]["tables"]}
+  assert _run_state(s3) is None
+  assert extensions_api.next_requests.empty()
+
+  s3.run_state_gate.set()
+  extensions_api.wait_for_release()
+  assert _run_state(s3)["manifest"]["run_id"] == body["manifest"]["run_id"]
+  assert all((index.s3_bucket, entry["s3_key"]) in s3.objects for entry in body["manifest"]["tables"])
+
+def test_failed_persist_releases_the_invocation(extensions_api, s3, sheet):
+  s3.fail_run_state = True
+  s3.run_state_gate.set()
+  first = _invoke(extensions_api, "request-1")
+  # the failure is logged, the invocation is released all the same
+  extensions_api.wait_for_release()
+  assert _run_state(s3) is None
+
+  # without a last run the next invocation extracts the spreadsheet again and persists its own run
+  s3.fail_run_state = False
+  second = _invoke(extensions_api, "request-2")
+  extensions_api.wait_for_release()
+  assert second["manifest"]["run_id"] != first["manifest"]["run_id"]
+  assert _run_state(s3)["manifest"]["run_id"] == second["manifest"]["run_id"]
+  assert sheet.request_count == 2
+
+def test_late_handoff_is_not_taken_for_the_next_invocation(extensions_api):
+  ran = []
+  extensions_api.invoke("request-1", timeout_seconds=post_response.DEADLINE_MARGIN_SECONDS + 0.3)
+  # the extension stops waiting for the handoff shortly before the deadline
+  extensions_api.wait_for_release(timeout=5)
+  post_response.defer(lambda: ran.append("request-1"), index.logger)
+  post_response.finish_invocation(SimpleNamespace(aws_request_id="request-1"))
+
+  extensions_api.invoke("request-2")
+  time.sleep(0.3)
+  # the late tasks ran, but request-2 is held until its own handoff
+  assert ran == ["request-1"]
+  assert extensions_api.next_requests.empty()
+  post_response.defer(lambda: ran.append("request-2"), index.logger)
+  post_response.finish_invocation(SimpleNamespace(aws_request_id="request-2"))
+  extensions_api.wait_for_release()
+  assert ran == ["request-1", "request-2"]
+
+def test_tasks_run_at_once_without_extension(monkeypatch):
+  monkeypatch.delenv("AWS_LAMBDA_RUNTIME_API", raising=False)
+  assert not post_response.register_extension(index.logger)
+  ran = []
+  post_response.defer(lambda: ran.append("task"), index.logger)
+  assert ran == ["task"]
+
+  def fail():
+    raise RuntimeError("s3 down")
+
+  # failures propagate like those of the handler
+  with pytest.raises(RuntimeError, match="s3 down"):
+    post_response.defer(fail, index.logger)
@@ -0,0 +1,93 @@
+"""
+Row level deltas of incremental mode between two snapshots of a table, see row_delta.py.
+"""
+import logging
+from io import BytesIO
+import pandas as pd
+from row_delta import CHANGE_DELETE, CHANGE_INSERT, CHANGE_UPDATE, compute_row_delta, compute_row_index, load_row_index, save_row_index
+from extract_transform import extract_and_transform_to_tsv
+from instrumentation import Profiler
+from local_stubs import LocalS3
+from synthetic_sheet import generate_sheet
+
+BUCKET = "row-delta-test"
+KEY_COL_NAMES = ["description", "store"]
+logger = logging.getLogger(__name__)
+
+def _table(*rows: tuple) -> pd.DataFrame:
+  return pd.DataFrame(rows, columns=["description", "store", "cost"])
+
+def _delta(previous: pd.DataFrame | None, current: pd.DataFrame) -> pd.DataFrame:
+  row_keys, row_hashes = compute_row_index(current, KEY_COL_NAMES)
+  if previous is None:
+    previous_keys, previous_hashes = row_keys[:0], row_hashes[:0]
+  else:
+    previous_keys, previous_hashes = compute_row_index(previous, KEY_COL_NAMES)
+  return compute_row_delta(current, row_keys, row_hashes, previous_keys, previous_hashes)
+
+def _changes(delta: pd.DataFrame) -> list[tuple]:
+  return sorted((change_type, description) for change_type, description in zip(delta["change_type"], delta["description"].fillna("")))
+
+def test_first_run_inserts_every_row():
+  current = _table(("rent", "landlord", 900.0), ("milk", "Rewe", 1.2))
+  delta = _delta(None, current)
+  assert delta["change_type"].tolist() == [CHANGE_INSERT, CHANGE_INSERT]
+  assert delta.columns.tolist() == ["change_type", "row_key", "description", "store", "cost"]
+  pd.testing.assert_frame_equal(delta.drop(columns=["change_type", "row_key"]), current)
+
+def test_added_removed_and_changed_rows():
+  previous = _table(("rent", "landlord", 900.0), ("milk", "Rewe", 1.2), ("bread", "Aldi", 2.5))
+  current = _table(("rent", "landlord", 950.0), ("bread", "Aldi", 2.5), ("coffee", "Lidl", 6.0))
+  delta = _delta(previous, current)
+  assert _changes(delta) == [(CHANGE_DELETE, ""), (CHANGE_INSERT, "coffee"), (CHANGE_UPDATE, "rent")]
+  assert delta.loc[delta["change_type"] == CHANGE_UPDATE, "cost"].tolist() == [950.0]
+  # deleted rows are identified by the key of the previous snapshot only
+  previous_keys, _ = compute_row_index(previous, KEY_COL_NAMES)
+  assert delta.loc[delta["change_type"] == CHANGE_DELETE, "row_key"].tolist() == [f"{previous_keys[1]:016x}"]
+
+def test_unchanged_table_has_empty_delta():
+  previous = _table(("rent", "landlord", 900.0), ("milk", "Rewe", 1.2))
+  assert len(_delta(previous, previous.iloc[::-1].reset_index(drop=True))) == 0
+
+def test_rows_with_equal_keys_are_told_apart_by_occurrence():
+  previous = _table(("milk", "Rewe", 1.2), ("milk", "Rewe", 1.3))
+  current = _table(("milk", "Rewe", 1.2), ("milk", "Rewe", 1.4), ("milk", "Rewe", 1.5))
+  delta = _delta(previous, current)
+  assert delta["change_type"].tolist() == [CHANGE_UPDATE, CHANGE_INSERT]
+  assert delta["cost"].tolist() == [1.4, 1.5]
+
+def test_row_index_round_trip():
+  s3 = LocalS3()
+  # nothing persisted yet, every row of the first run becomes an insert
+  assert load_row_index(BUCKET, s3, logger) == {}
+  row_index = {"income": compute_row_index(_table(("rent", "landlord", 900.0)), KEY_COL_NAMES)}
+  save_row_index(row_index, BUCKET, s3, logger, "targets/a/")
+  assert load_row_index(BUCKET, s3, logger) == {}
+  loaded = load_row_index(BUCKET, s3, logger, "targets/a/")
+  assert list(loaded) == ["income"]
+  assert (loaded["income"][0] == row_index["income"][0]).all() and (loaded["income"][1] == row_index["income"][1]).all()
+
+def test_incremental_runs():
+  s3 = LocalS3()
+  sheet = generate_sheet(200, seed=21)
+
+  def run(run_id: str, sheet: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    extract_and_transform_to_tsv(run_id, sheet, BUCKET, Profiler("test"), s3, logger, incremental=True)
+    return {
+      key.removeprefix(f"transformed/{run_id}-").removesuffix("-delta.tsv"): pd.read_csv(BytesIO(stored["Body"]), sep="\t")
+      for (_, key), stored in s3.objects.items()
+      if key.startswith(f"transformed/{run_id}-") and key.endswith("-delta.tsv")
+    }
+
+  first = run("run-1", sheet)
+  assert set(first) == {"variable_expenses", "investments", "food_items", "fixed_costs", "income"}
+  assert all((delta["change_type"] == CHANGE_INSERT).all() and len(delta) > 0 for delta in first.values())
+  assert all(len(delta) == 0 for delta in run("run-2", sheet).values())
+  # the first data row of the variable expenses changes its cost, which is column E of the sheet
+  changed = sheet.copy()
+  first_row = changed.index[changed.iloc[:, 1].str.startswith("description", na=False)][1]
+  changed.iloc[first_row, 4] = "12345,67 €"
+  third = run("run-3", changed)
+  assert third["variable_expenses"]["change_type"].tolist() == [CHANGE_UPDATE]
+  assert third["variable_expenses"]["cost"].tolist() == [12345.67]
+  assert all(len(delta) == 0 for table_name, delta in third.items() if table_name != "variable_expenses")
@@ -0,0 +1,152 @@
+"""
+Caching of Parameter Store values across warm invocations, see _shared/secrets_cache.py.
+"""
+import threading
+import time
+import pytest
+from secrets_cache import SecretsCache
+
+API_KEY = "/api/key"
+SHEET_URL = "/sheet/url"
+
+class StubSsm:
+  """
+  Counts GetParameters calls. Values can be changed between calls, names without a value are reported invalid.
+  """
+  def __init__(self, values: dict[str, str]):
+    self.values = dict(values)
+    self.calls: list[list[str]] = []
+    self.fail = False
+    self.release = threading.Event()
+    self.release.set()
+    self._lock = threading.Lock()
+
+  def get_parameters(self, Names: list[str], WithDecryption: bool) -> dict:
+    assert WithDecryption
+    self.release.wait(5)
+    with self._lock:
+      self.calls.append(list(Names))
+    if self.fail:
+      raise RuntimeError("throttled")
+    return {
+      "Parameters": [{"Name": name, "Value": self.values[name]} for name in Names if name in self.values],
+      "InvalidParameters": [name for name in Names if name not in self.values],
+    }
+
+def _wait_for_refresh(cache: SecretsCache):
+  cache._refresh_thread.join(5)
+
+def test_fresh_values_are_served_from_memory():
+  ssm = StubSsm({API_KEY: "key", SHEET_URL: "url"})
+  cache = SecretsCache([API_KEY, SHEET_URL], ttl_seconds=60, ssm_client=ssm)
+  assert cache.get_all() == {API_KEY: "key", SHEET_URL: "url"}
+  assert cache.get(SHEET_URL) == "url"
+  # both names are fetched in a single call
+  assert ssm.calls == [[API_KEY, SHEET_URL]]
+  assert cache.pop_stats() == {"hits": 1, "stale_hits": 0, "misses": 1, "refreshes": 1, "refresh_failures": 0}
+  assert cache.pop_stats() == {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0}
+
+def test_missing_parameter_is_cached_as_none():
+  cache = SecretsCache([API_KEY, SHEET_URL], ssm_client=StubSsm({API_KEY: "key"}))
+  assert cache.get_all() == {API_KEY: "key", SHEET_URL: None}
+  with pytest.raises(KeyError):
+    cache.get("/unmanaged")
+
+def test_ttl_expiry_blocks_on_fetch():
+  ssm = StubSsm({API_KEY: "old"})
+  cache = SecretsCache([API_KEY], ttl_seconds=0.05, stale_seconds=0, ssm_client=ssm)
+  assert cache.get(API_KEY) == "old"
+  ssm.values[API_KEY] = "new"
+  assert cache.get(API_KEY) == "old"
+  time.sleep(0.06)
+  assert cache.get(API_KEY) == "new"
+  assert len(ssm.calls) == 2
+  assert cache.pop_stats()["misses"] == 2
+
+def test_stale_value_is_served_while_refreshing():
+  ssm = StubSsm({SHEET_URL: "old"})
+  cache = SecretsCache([SHEET_URL], ttl_seconds=0.05, stale_seconds=60, ssm_client=ssm)
+  cache.get_all()
+  ssm.values[SHEET_URL] = "new"
+  time.sleep(0.06)
+  ssm.release.clear()
+  # served immediately although the refresh is held up, concurrent stale hits share the refresh
+  assert cache.get(SHEET_URL) == "old"
+  assert cache.get(SHEET_URL) == "old"
+  ssm.release.set()
+  _wait_for_refresh(cache)
+  assert cache.get(SHEET_URL) == "new"
+  assert len(ssm.calls) == 2
+  assert cache.pop_stats() == {"hits": 1, "stale_hits": 2, "misses": 1, "refreshes": 2, "refresh_failures": 0}
+
+def test_failed_refresh_keeps_stale_value():
+  ssm = StubSsm({SHEET_URL: "old"})
+  cache = SecretsCache([SHEET_URL], ttl_seconds=0.05, stale_seconds=0.1, ssm_client=ssm)
+  cache.get_all()
+  time.sleep(0.06)
+  ssm.fail = True
+  assert cache.get(SHEET_URL) == "old"
+  _wait_for_refresh(cache)
+  assert cache.pop_stats()["refresh_failures"] == 1
+  # past the stale window the failure surfaces to the caller
+  time.sleep(0.1)
+  with pytest.raises(RuntimeError, match="throttled"):
+    cache.get(SHEET_URL)
+
+def test_ttl_per_name():
+  ssm = StubSsm({API_KEY: "key", SHEET_URL: "url"})
+  cache = SecretsCache([API_KEY, SHEET_URL], ttl_seconds=60, stale_seconds=60, ssm_client=ssm, ttl_overrides={API_KEY: (0.05, 0)})
+  cache.get_all()
+  time.sleep(0.06)
+  ssm.values[API_KEY] = "rotated"
+  # the expired key is fetched synchronously, the fresh sheet url is left out of the call
+  assert cache.get_all() == {API_KEY: "rotated", SHEET_URL: "url"}
+  assert ssm.calls == [[API_KEY, SHEET_URL], [API_KEY]]
+
+def test_expired_and_stale_names_share_a_call():
+  ssm = StubSsm({API_KEY: "key", SHEET_URL: "url"})
+  cache = SecretsCache([API_KEY, SHEET_URL], ttl_seconds=0.05, stale_seconds=60, ssm_client=ssm, ttl_overrides={API_KEY: (0.05, 0)})
+  cache.get_all()
+  time.sleep(0.06)
+  cache.get_all()
+  assert ssm.calls == [[API_KEY, SHEET_URL], [API_KEY, SHEET_URL]]
+  assert cache.pop_stats()["stale_hits"] == 0
+
+def test_invalidate():
+  ssm = StubSsm({API_KEY: "key", SHEET_URL: "url"})
+  cache = SecretsCache([API_KEY, SHEET_URL], ttl_seconds=60, ssm_client=ssm)
+  cache.get_all()
+  cache.invalidate(API_KEY)
+  cache.get_all()
+  cache.invalidate()
+  cache.get_all()
+  assert ssm.calls == [[API_KEY, SHEET_URL], [API_KEY], [API_KEY, SHEET_URL]]
+
+def test_api_key_mismatch_refetch_is_limited(monkeypatch):
+  index = pytest.importorskip("index")
+  ssm = StubSsm({index.API_KEY_PARAMETER: "old", index.SHEET_URL_PARAMETER: "url"})
+  cache = SecretsCache(
+    [index.API_KEY_PARAMETER, index.SHEET_URL_PARAMETER], ssm_client=ssm, ttl_overrides={index.API_KEY_PARAMETER: (60, 0)}
+  )
+  monkeypatch.setattr(index, "secrets", cache)
+  monkeypatch.setattr(index, "last_api_key_refetch", 0.0)
+
+  def authenticate(key: str) -> int:
+    return index.authenticate(None, {"authorization": key}, cache.get_all())["statusCode"]
+
+  assert authenticate("old") == 200
+  ssm.values[index.API_KEY_PARAMETER] = "rotated"
+  # the rotated key is accepted once the mismatch re-fetched it
+  assert authenticate("rotated") == 200
+  assert len(ssm.calls) == 2
+  # invalid keys re-fetch at most once per API_KEY_REFETCH_INTERVAL_SECONDS
+  assert authenticate("invalid") == 403
+  assert authenticate("invalid") == 403
+  assert len(ssm.calls) == 2
+  monkeypatch.setattr(index, "last_api_key_refetch", time.monotonic() - index.API_KEY_REFETCH_INTERVAL_SECONDS)
+  assert authenticate("invalid") == 403
+  assert len(ssm.calls) == 3
+  # requests without a key never re-fetch
+  monkeypatch.setattr(index, "last_api_key_refetch", 0.0)
+  assert index.authenticate(None, {}, cache.get_all())["statusCode"] == 403
+  assert len(ssm.calls) == 3
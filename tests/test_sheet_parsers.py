@@ -0,0 +1,51 @@
+"""
+Agreement of the CSV and XLSX exports of the same sheet, down to the extracted tables.
+"""
+import logging
+import pandas as pd
+import pytest
+from ddl_schema import SHEET_USECOLS, TABLES
+from download_csv import parse_csv
+from download_xlsx import parse_xlsx
+from extract_transform import load_tables_from_sheet
+
+pytest.importorskip("openpyxl")
+pytest.importorskip("python_calamine")
+from synthetic_sheet import generate_sheet, to_csv_bytes, to_xlsx_bytes
+
+logger = logging.getLogger(__name__)
+# Percentages are exported as "26,375%" in CSV and as the fraction 0.26375 in XLSX, they only agree once typed
+PERCENT_COLS = [
+  table_def["col_slice"].start + offset
+  for table_def in TABLES.values()
+  for offset, col_name in enumerate(table_def["col_names"])
+  if col_name.startswith("pct_")
+]
+
+@pytest.mark.parametrize("blank_leading", [False, True], ids=["noise_in_column_a", "blank_leading"])
+@pytest.mark.parametrize("scratch_col_count", [0, 3], ids=["ends_at_last_table", "trailing_scratch"])
+def test_xlsx_matches_csv(blank_leading, scratch_col_count):
+  sheet = generate_sheet(300, seed=7, blank_leading=blank_leading, scratch_col_count=scratch_col_count)
+  from_csv = parse_csv(memoryview(to_csv_bytes(sheet)))
+  from_xlsx = parse_xlsx(memoryview(to_xlsx_bytes(sheet)))
+  assert list(from_xlsx.columns) == SHEET_USECOLS
+  pd.testing.assert_frame_equal(from_xlsx.drop(columns=PERCENT_COLS), from_csv.drop(columns=PERCENT_COLS), check_dtype=False)
+  csv_tables = load_tables_from_sheet(from_csv, logger)
+  xlsx_tables = load_tables_from_sheet(from_xlsx, logger)
+  assert csv_tables.keys() == xlsx_tables.keys()
+  for table_name, table in csv_tables.items():
+    assert len(table) > 0, table_name
+    pd.testing.assert_frame_equal(xlsx_tables[table_name], table, check_exact=True, obj=table_name)
+
+def test_xlsx_missing_columns():
+  narrow = generate_sheet(10, scratch_col_count=0).iloc[:, :max(SHEET_USECOLS)]
+  with pytest.raises(RuntimeError, match=f"is {max(SHEET_USECOLS)} columns wide"):
+    parse_xlsx(memoryview(to_xlsx_bytes(narrow)))
+
+def test_percentages_are_fractions():
+  sheet = generate_sheet(300, seed=3)
+  for parse, export in [(parse_csv, to_csv_bytes), (parse_xlsx, to_xlsx_bytes)]:
+    investments = load_tables_from_sheet(parse(memoryview(export(sheet))), logger)["investments"]
+    taxed = investments["pct_of_profit_taxed"].dropna()
+    assert len(taxed) > 0
+    assert taxed.between(0, 1).all(), parse.__name__
@@ -0,0 +1,150 @@
+"""
+Content addressed snapshot store, its catalog, historical loads and compaction against the local s3 stand-in.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import pandas as pd
+import pytest
+import snapshot_store
+from column_types import restore_column_types
+from ddl_schema import TABLE_VAR_EXPENSES, TABLES
+from download_csv import parse_csv
+from extract_transform import load_tables_from_sheet
+from local_stubs import LocalS3
+from output_formats import serialize_table
+from snapshot_store import (
+  compact_snapshots,
+  extracted_table_key,
+  find_snapshot,
+  list_snapshots,
+  load_snapshot_tables,
+  raw_snapshot_key,
+  store_snapshot,
+)
+from synthetic_sheet import generate_sheet, to_csv_bytes
+
+BUCKET = "snapshot-test"
+logger = logging.getLogger(__name__)
+
+def _store(s3: LocalS3, raw: bytes, run_id: str, export_type: str = "csv", state_prefix: str = "") -> str:
+  sha256 = hashlib.sha256(raw).hexdigest()
+  store_snapshot(memoryview(raw), sha256, export_type, run_id, BUCKET, s3, state_prefix)
+  return sha256
+
+def test_identical_exports_are_stored_once():
+  s3 = LocalS3()
+  assert store_snapshot(memoryview(b"a,b"), hashlib.sha256(b"a,b").hexdigest(), "csv", "2024-01-01_10-00-00-aaaa", BUCKET, s3)
+  assert not store_snapshot(memoryview(b"a,b"), hashlib.sha256(b"a,b").hexdigest(), "csv", "2024-01-02_10-00-00-bbbb", BUCKET, s3)
+  raw_keys = [key for _, key in s3.objects if key.startswith(snapshot_store.RAW_PREFIX)]
+  assert raw_keys == [raw_snapshot_key(hashlib.sha256(b"a,b").hexdigest(), "csv")]
+  assert [snapshot["run_id"] for snapshot in list_snapshots(BUCKET, s3)] == ["2024-01-01_10-00-00-aaaa", "2024-01-02_10-00-00-bbbb"]
+
+def test_find_snapshot_as_of():
+  s3 = LocalS3()
+  for run_id, raw in [("2024-01-01_10-00-00-aaaa", b"1"), ("2024-01-03_09-00-00-bbbb", b"2"), ("2024-01-03_18-00-00-cccc", b"3")]:
+    _store(s3, raw, run_id)
+  _store(s3, b"other", "2024-01-02_10-00-00-dddd", state_prefix="targets/other/")
+  assert find_snapshot("2024-01-02", BUCKET, s3)["run_id"] == "2024-01-01_10-00-00-aaaa"
+  assert find_snapshot("2024-01-03", BUCKET, s3)["run_id"] == "2024-01-03_18-00-00-cccc"
+  assert find_snapshot("2024-01-03_12-00-00", BUCKET, s3)["run_id"] == "2024-01-03_09-00-00-bbbb"
+  assert find_snapshot("2024-01-05", BUCKET, s3, "targets/other/")["run_id"] == "2024-01-02_10-00-00-dddd"
+  assert [snapshot["date"] for snapshot in list_snapshots(BUCKET, s3, "2024-01-02", "2024-01-03")] == ["2024-01-03", "2024-01-03"]
+  with pytest.raises(RuntimeError, match="No snapshot recorded on or before 2023-12-31"):
+    find_snapshot("2023-12-31", BUCKET, s3)
+
+def test_load_caches_extracted_tables():
+  s3 = LocalS3()
+  raw = to_csv_bytes(generate_sheet(300, seed=11))
+  sha256 = _store(s3, raw, "2024-01-01_10-00-00-aaaa")
+  expected = load_tables_from_sheet(parse_csv(memoryview(raw)), logger)
+  first = load_snapshot_tables("2024-01-01", BUCKET, s3, logger)
+  for table_name in TABLES:
+    cached = s3.objects[(BUCKET, extracted_table_key(sha256, "default", table_name))]["Body"]
+    # stored as plain TSV, which is never executed when read back
+    assert gzip.decompress(cached).split(b"\n", 1)[0].decode("utf-8").split("\t") == list(expected[table_name].columns)
+
+  s3.request_counts.clear()
+  second = load_snapshot_tables("2024-01-01", BUCKET, s3, logger)
+  assert s3.request_counts["GetObject"] == len(TABLES)
+  assert "PutObject" not in s3.request_counts
+  for table_name, table in expected.items():
+    pd.testing.assert_frame_equal(first[table_name], table, check_exact=True, obj=table_name)
+    pd.testing.assert_frame_equal(second[table_name], table, check_exact=True, obj=table_name)
+
+def test_partial_cache_is_extracted_again():
+  s3 = LocalS3()
+  sha256 = _store(s3, to_csv_bytes(generate_sheet(50, seed=12)), "2024-01-01_10-00-00-aaaa")
+  expected = load_snapshot_tables("2024-01-01", BUCKET, s3, logger)
+  del s3.objects[(BUCKET, extracted_table_key(sha256, "default", "income"))]
+  reloaded = load_snapshot_tables("2024-01-01", BUCKET, s3, logger)
+  pd.testing.assert_frame_equal(reloaded["income"], expected["income"], check_exact=True)
+  assert (BUCKET, extracted_table_key(sha256, "default", "income")) in s3.objects
+
+def test_restore_column_types_round_trip():
+  table = pd.DataFrame({
+    "description": ["tab\tand \"quotes\"", "line\nbreak", "nan", ""],
+    "category": pd.Series(["Rent", None, "Rent", "Travel"], dtype="category"),
+    "store": pd.Series(["Rewe", "Aldi", None, "Rewe"], dtype="category"),
+    "cost": [1234.56, None, 0.1 + 0.2, -1e-05],
+    "purchasing_date": pd.to_datetime(["2024-03-09", None, "1999-12-31", "2024-02-29"]).astype("datetime64[us]"),
+    "is_planned": pd.array([True, None, False, True], dtype="boolean"),
+    "contains_indulgence": pd.array([None, None, None, None], dtype="boolean"),
+    "sensitivities": ["a", "b", "", "d"],
+  })
+  restored = {}
+  for rows in (table, table.iloc[:0]):
+    buffer, _ = serialize_table(rows, "tsv.gz")
+    restored[len(rows)] = restore_column_types(pd.read_csv(buffer, sep="\t", compression="gzip", dtype=str, na_filter=False), TABLE_VAR_EXPENSES)
+  pd.testing.assert_frame_equal(restored[len(table)], table, check_exact=True)
+  # tables without rows keep their columns and types, categories are only known from values
+  assert restored[0].dtypes.astype(str).to_dict() == table.dtypes.astype(str).to_dict()
+
+def test_compaction_migrates_backups():
+  s3 = LocalS3()
+  raw = to_csv_bytes(generate_sheet(20, seed=13))
+  sha256 = _store(s3, raw, "2024-01-01_10-00-00-aaaa")
+  s3.put_object(Bucket=BUCKET, Key="tmp/2023-12-30_10-00-00-Fiscalismia-Datasource.csv", Body=raw)
+  s3.put_object(Bucket=BUCKET, Key="tmp/2023-12-31_10-00-00-Fiscalismia-Datasource.xlsx", Body=b"xlsx bytes")
+  s3.put_object(Bucket=BUCKET, Key="tmp/unrelated.txt", Body=b"kept")
+  load_snapshot_tables("2024-01-01", BUCKET, s3, logger)
+  # pickles cached before and tables of outdated table definitions are deleted
+  s3.put_object(Bucket=BUCKET, Key=f"{snapshot_store.EXTRACTED_PREFIX}{sha256}.default.schema1.pandas2.pkl.gz", Body=b"pickle")
+  s3.put_object(Bucket=BUCKET, Key=f"{snapshot_store.EXTRACTED_PREFIX}{sha256}.default.schema0/income.tsv.gz", Body=b"")
+
+  stats = compact_snapshots(BUCKET, s3, logger)
+  assert stats == {"migrated": 1, "deduplicated": 1, "deleted_bytes": len(raw), "stale_extracted": 2}
+  keys = {key for _, key in s3.objects}
+  assert {key for key in keys if key.startswith("tmp/")} == {"tmp/unrelated.txt"}
+  assert raw_snapshot_key(hashlib.sha256(b"xlsx bytes").hexdigest(), "xlsx") in keys
+  assert [snapshot["run_id"] for snapshot in list_snapshots(BUCKET, s3)] == [
+    "2023-12-30_10-00-00", "2023-12-31_10-00-00", "2024-01-01_10-00-00-aaaa"
+  ]
+  assert all(extracted_table_key(sha256, "default", table_name) in keys for table_name in TABLES)
+  # a second compaction has nothing left to do
+  assert compact_snapshots(BUCKET, s3, logger) == {"migrated": 0, "deduplicated": 0, "deleted_bytes": 0, "stale_extracted": 0}
+
+def test_handler_serves_past_snapshot(monkeypatch):
+  index = pytest.importorskip("index")
+  s3 = LocalS3()
+  raw = to_csv_bytes(generate_sheet(40, seed=14))
+  s3_bucket = index.s3_bucket
+  sha256 = hashlib.sha256(raw).hexdigest()
+  store_snapshot(memoryview(raw), sha256, "csv", "2024-01-01_10-00-00-aaaa", s3_bucket, s3)
+  monkeypatch.setattr(index, "get_s3_client", lambda: s3)
+  monkeypatch.setattr(index, "fetch_secrets", lambda profiler, parent_span=None: {index.API_KEY_PARAMETER: "key", index.SHEET_URL_PARAMETER: None})
+  event = {"headers": {"authorization": "key"}, "queryStringParameters": {"as_of": "2024-01-15"}}
+
+  response = index.handle_request(event, None, index.Profiler("test"))
+  assert response["statusCode"] == 202
+  body = json.loads(response["body"])
+  assert body["manifest"]["run_id"] == "2024-01-01_10-00-00-aaaa"
+  assert [entry["table"] for entry in body["manifest"]["tables"]] == list(TABLES)
+  assert all((s3_bucket, entry["s3_key"]) in s3.objects for entry in body["manifest"]["tables"])
+  # the run state of the live spreadsheet is left untouched
+  assert not any(key.startswith("state/") for _, key in s3.objects)
+
+  event["queryStringParameters"]["as_of"] = "2023-01-01"
+  response = index.handle_request(event, None, index.Profiler("test"))
+  assert response["statusCode"] == 400